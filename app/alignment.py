@@ -0,0 +1,204 @@
+# Itai Alcalai
+# alignment.py
+
+import os
+import numpy as np
+import pandas as pd
+from parse_cache import is_cached, load_columns
+
+def _partition_keys(columns, well_lookup, use_partition_column):
+    """
+    Computes the (well, partition index) join key of every row of a probe file. The partition index
+    is the file's partition number, or the position of the row among the rows of its well in file order.
+
+    Args:
+        columns (dict): Column arrays as returned by parse_cache.load_columns.
+        well_lookup (dict): Maps every well label to its global well code.
+        use_partition_column (bool): Whether to use the file's partition numbers.
+
+    Returns:
+        tuple: Global well code and partition index of every row with a well label, and the row numbers they belong to.
+    """
+    well_codes = np.asarray(columns['well_codes'])
+    rows = np.flatnonzero(well_codes >= 0)
+    global_codes = np.array([well_lookup[well] for well in columns['wells']], dtype=np.int64)[well_codes[rows]]
+    if use_partition_column:
+        partitions = np.asarray(columns['partition'])[rows].astype(np.int64)
+    else:
+        partitions = pd.Series(global_codes).groupby(global_codes).cumcount().to_numpy()
+    return global_codes, partitions, rows
+
+def _first_thresholds(columns, well_lookup, well_count):
+    """
+    Gets the threshold of every well: the threshold of the first row of its first block.
+
+    Args:
+        columns (dict): Column arrays as returned by parse_cache.load_columns.
+        well_lookup (dict): Maps every well label to its global well code.
+        well_count (int): Number of global well codes.
+
+    Returns:
+        numpy.ndarray: Threshold of every global well code (NaN for wells missing from the file).
+    """
+    thresholds = np.full(well_count, np.nan)
+    well_codes = columns['well_codes']
+    # Walk the blocks backwards so the first block of every well is written last
+    for start, threshold in zip(columns['block_starts'][::-1], columns['block_thresholds'][::-1]):
+        if well_codes[start] >= 0:
+            thresholds[well_lookup[columns['wells'][well_codes[start]]]] = threshold
+    return thresholds
+
+def load_channels(file_paths, progress=None):
+    """
+    Loads the column arrays of probe files through the parse cache, one read per file.
+
+    Args:
+        file_paths (list): Paths to the probe files, one per channel.
+        progress (callable, optional): Called with the row count of every file once it is loaded, and the
+            byte size of the CSV if it had to be parsed (0 when its columns were memory-mapped from the parse cache).
+
+    Returns:
+        list: Column arrays of every file, as returned by parse_cache.load_columns.
+    """
+    all_columns = []
+    for file_path in file_paths:
+        parsed_bytes = 0 if is_cached(file_path) else os.path.getsize(file_path)
+        all_columns.append(load_columns(file_path))
+        if progress is not None:
+            progress(len(all_columns[-1]['rfu']), parsed_bytes)
+    return all_columns
+
+def align_channels(file_paths, progress=None):
+    """
+    Joins probe files on (Well, partition index) into one droplets x channels RFU matrix.
+
+    Args:
+        file_paths (list): Paths to the probe files, one per channel.
+        progress (callable, optional): Called like the progress of load_channels once every file is loaded.
+
+    Returns:
+        dict: Aligned data as returned by join_channels.
+    """
+    return join_channels(load_channels(file_paths, progress))
+
+def join_channels(all_columns):
+    """
+    Joins loaded probe files on (Well, partition index) into one droplets x channels RFU matrix. Only droplets
+    present in every file are aligned; the others are counted as missing. Droplets are grouped by well,
+    with wells in order of first appearance in the first file.
+
+    Args:
+        all_columns (list): Column arrays of every channel, as returned by load_channels.
+
+    Returns:
+        dict: Dictionary with the aligned data:
+            'wells' (list): Well labels, in plotting order.
+            'well_starts', 'well_stops' (numpy.ndarray): Droplet range of every well in the matrix.
+            'rfu' (numpy.ndarray): N droplets x K channels RFU matrix (NaN for invalid partitions).
+            'thresholds' (numpy.ndarray): Wells x K channels thresholds.
+            'missing' (numpy.ndarray): Per channel, number of partitions found in another file but not in this one.
+            'mismatched' (list): Wells left out because their row counts differ between the files. Only
+                without partition numbers, where droplets are paired by their row position within the well.
+    """
+    # Give every well label one code shared by all the files, in order of first appearance in the first file
+    well_lookup = {}
+    for columns in all_columns:
+        well_codes = np.asarray(columns['well_codes'])
+        for start in columns['block_starts']:
+            if well_codes[start] >= 0:
+                well_lookup.setdefault(columns['wells'][well_codes[start]], len(well_lookup))
+    well_count = len(well_lookup)
+
+    # Join on the partition numbers when every file has them, and on the row position within the well otherwise
+    use_partition_column = all(columns['partition'] is not None and not np.isnan(columns['partition']).any()
+                               for columns in all_columns)
+    stride = max((len(columns['well_codes']) for columns in all_columns), default=0) + 1
+    if use_partition_column:
+        stride = max(stride, max((int(np.max(columns['partition'], initial=0)) + 1 for columns in all_columns), default=0))
+
+    # Encode (well, partition index) as a single integer key per row
+    channel_keys = []
+    channel_rows = []
+    row_counts = []
+    for columns in all_columns:
+        global_codes, partitions, rows = _partition_keys(columns, well_lookup, use_partition_column)
+        channel_keys.append(global_codes * stride + partitions)
+        channel_rows.append(rows)
+        row_counts.append(np.bincount(global_codes, minlength=well_count))
+
+    # Without partition numbers, one missing row shifts every later row of its well, so wells whose
+    # row counts differ between the files that have them cannot be paired up and are left out entirely
+    mismatched_codes = np.empty(0, dtype=np.int64)
+    if not use_partition_column and row_counts:
+        row_counts = np.stack(row_counts)
+        present = row_counts > 0
+        highest = row_counts.max(axis=0)
+        lowest = np.where(present, row_counts, highest).min(axis=0)
+        mismatched_codes = np.flatnonzero(lowest != highest)
+
+    # Keep the droplets of the first file that every other file has as well, in the first file's order
+    common = channel_keys[0]
+    for keys in channel_keys[1:]:
+        common = common[np.isin(common, keys)]
+    common = common[~np.isin(common // stride, mismatched_codes)]
+    union_count = len(np.unique(np.concatenate(channel_keys))) if channel_keys else 0
+    missing = np.array([union_count - len(keys) for keys in channel_keys])
+
+    # Group the droplets by well, keeping the partition order within every well
+    well_of_droplet = common // stride
+    order = np.argsort(well_of_droplet, kind='stable')
+    common = common[order]
+    well_of_droplet = well_of_droplet[order]
+
+    # Gather every channel's RFU values for the common droplets
+    rfu = np.empty((len(common), len(all_columns)))
+    for channel, (columns, keys, rows) in enumerate(zip(all_columns, channel_keys, channel_rows)):
+        key_order = np.argsort(keys)
+        positions = key_order[np.searchsorted(keys[key_order], common)]
+        rfu[:, channel] = np.asarray(columns['rfu'])[rows[positions]]
+
+    present_wells = np.unique(well_of_droplet)
+    well_starts = np.searchsorted(well_of_droplet, present_wells, side='left')
+    well_stops = np.searchsorted(well_of_droplet, present_wells, side='right')
+    labels = list(well_lookup)
+    thresholds = np.column_stack([_first_thresholds(columns, well_lookup, well_count) for columns in all_columns])
+    return {
+        'wells': [labels[code] for code in present_wells],
+        'well_starts': well_starts,
+        'well_stops': well_stops,
+        'rfu': rfu,
+        'thresholds': thresholds[present_wells].reshape(len(present_wells), len(all_columns)),
+        'missing': missing,
+        'mismatched': [labels[code] for code in mismatched_codes]
+    }
+
+def missing_report(aligned, probes):
+    """
+    Describes the partitions that could not be aligned across the probe files.
+
+    Args:
+        aligned (dict): Aligned data as returned by align_channels.
+        probes (list): Probe name of every channel.
+
+    Returns:
+        str: A one-line report of the aligned droplets and the missing partitions per probe.
+    """
+    missing = ", ".join(f"{probe} {count}" for probe, count in zip(probes, aligned['missing']))
+    report = f"Aligned {len(aligned['rfu'])} droplets in {len(aligned['wells'])} wells (missing partitions: {missing})"
+    if aligned['mismatched']:
+        report += f", left out wells with differing row counts: {', '.join(aligned['mismatched'])}"
+    return report
+
+def select_channels(all_columns, channels):
+    """
+    Joins a subset of loaded probe files, intersecting only the partitions of the chosen channels. The result
+    is the same as aligning those files on their own, without reading any file again.
+
+    Args:
+        all_columns (list): Column arrays of every channel, as returned by load_channels.
+        channels (list): Indices of the channels to keep, in the wanted order.
+
+    Returns:
+        dict: Aligned data of the chosen channels only, as returned by join_channels.
+    """
+    return join_channels([all_columns[channel] for channel in channels])
@@ -0,0 +1,98 @@
+# Itai Alcalai
+# calibration_cache.py
+
+import json
+import os
+import threading
+import time
+from utils import file_digest
+
+# File holding the cache, in the working directory so it survives server restarts and is shared by all the session workspaces
+CALIBRATION_CACHE_PATH = 'calibration_cache.json'
+# Maximum number of calibrations kept; the least recently used ones are evicted first
+CALIBRATION_CACHE_MAX_ENTRIES = 256
+
+_cache_lock = threading.Lock()
+# Last use of the entries looked up since the cache was last written, kept in memory so lookups never write
+_recent_uses = {}
+
+def calibration_key(file_path, control_wells, version):
+    """
+    Builds the cache key of a calibration.
+
+    Args:
+        file_path (str): Path to the data file.
+        control_wells (list): The positive, mix positive and negative control well names.
+        version (str): Version of the calibration algorithm.
+
+    Returns:
+        str: Key made of the file content hash, the control well triple and the algorithm version.
+    """
+    return "|".join([file_digest(file_path), *[str(well) for well in control_wells], version])
+
+def _load_cache():
+    """
+    Loads the cache entries from disk.
+
+    Returns:
+        dict: Cache entries keyed by calibration key. Empty if the cache file is missing or unreadable.
+    """
+    try:
+        with open(CALIBRATION_CACHE_PATH, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(entries):
+    """
+    Writes the cache entries to disk, evicting the least recently used ones above the size limit.
+    The uses remembered by lookup are applied first. Must be called with _cache_lock held.
+
+    Args:
+        entries (dict): Cache entries keyed by calibration key.
+    """
+    for key, last_used in _recent_uses.items():
+        if key in entries:
+            entries[key]['last_used'] = max(entries[key]['last_used'], last_used)
+    _recent_uses.clear()
+    if len(entries) > CALIBRATION_CACHE_MAX_ENTRIES:
+        by_last_use = sorted(entries, key=lambda key: entries[key]['last_used'])
+        for key in by_last_use[:len(entries) - CALIBRATION_CACHE_MAX_ENTRIES]:
+            del entries[key]
+    # Write to a temporary file first so a crash never leaves a truncated cache behind
+    temp_path = f"{CALIBRATION_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(entries, file)
+    os.replace(temp_path, CALIBRATION_CACHE_PATH)
+
+def lookup(key):
+    """
+    Looks up a cached calibrated threshold and marks it as recently used. The use is only remembered
+    in memory and written with the next store, so a lookup never rewrites the cache file.
+
+    Args:
+        key (str): The calibration key.
+
+    Returns:
+        float: The cached threshold, or None if the calibration is not cached.
+    """
+    with _cache_lock:
+        entries = _load_cache()
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        _recent_uses[key] = time.time()
+        return entry['threshold']
+
+def store(key, threshold):
+    """
+    Stores a calibrated threshold in the cache.
+
+    Args:
+        key (str): The calibration key.
+        threshold (float): The calibrated threshold.
+    """
+    with _cache_lock:
+        entries = _load_cache()
+        entries[key] = {'threshold': float(threshold), 'last_used': time.time()}
+        _save_cache(entries)
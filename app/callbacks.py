@@ -6,12 +6,59 @@ from dash import html, dcc
 from dash.dependencies import Input, Output, State
 import base64
 import io
+import logging
+import os
+import time
 import zipfile
 import dash_bootstrap_components as dbc
+import workspace
 from utils import create_well_name_dict
+from threshold_calibration import calibrate_directory
+from well_index import build_well_index
+from ingest import is_probe_file
 from plot1_actions import register_plot1_callbacks
 from plot2_actions import register_plot2_callbacks
 from plot3_actions import register_plot3_callbacks
+from multiplex_actions import register_multiplex_callbacks
+from quantify_actions import register_quantify_callbacks
+
+logger = logging.getLogger(__name__)
+
+def batch_calibration_summary(well_names, control_wells, session_id):
+    """
+    Calibrates every probe file in the session's input directory and summarizes the results in a table.
+
+    Args:
+        well_names (dict): Dictionary mapping well identifiers to their names.
+        control_wells (dict): Dictionary containing control well names.
+        session_id (str): The session id.
+
+    Returns:
+        html.Div: A table with the calibrated threshold and timing of every probe, or an error message.
+    """
+    start = time.perf_counter()
+    try:
+        results = calibrate_directory(workspace.input_dir(session_id), well_names, control_wells)
+    except Exception as e:
+        return html.Div(f"Batch calibration skipped: {e}", style={"color": "red", "textAlign": "center", "marginTop": "20px"})
+    elapsed = time.perf_counter() - start
+
+    rows = [html.Tr([
+        html.Td(result['probe']),
+        html.Td(f"{result['threshold']:.2f}" if result['threshold'] is not None else "-"),
+        html.Td("cached" if result['cached'] else f"{result['seconds']:.2f}s"),
+        html.Td(result['error'] or "OK", style={"color": "red" if result['error'] else "green"})
+    ]) for result in results]
+    return html.Div([
+        html.H4("Calibrated Thresholds", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Table([
+            html.Thead(html.Tr([html.Th("Probe"), html.Th("Threshold"), html.Th("Time"), html.Th("Status")])),
+            html.Tbody(rows)
+        ], bordered=True, size="sm", style={"width": "50%", "margin": "0 auto"}),
+        html.Div(f"Calibrated {len(results)} probe files in {elapsed:.2f}s "
+                 f"(sum of per-file times {sum(result['seconds'] for result in results):.2f}s)",
+                 style={"textAlign": "center"})
+    ])
 
 def register_callbacks(app):
     """
@@ -28,26 +75,42 @@ def register_callbacks(app):
         Input("upload-data", "contents"),
         State("upload-data", "filename"),
         State("upload-data", "last_modified"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
-    def handle_file_upload(contents, filenames, last_modified):
+    def handle_file_upload(contents, filenames, last_modified, session_id):
         """
-        Handles the file upload and extracts the contents of the uploaded zip file.
+        Handles the file upload and extracts the contents of the uploaded zip file into the session's input directory.
 
         Args:
             contents (list): List of uploaded file contents.
             filenames (list): List of uploaded file names.
             last_modified (list): List of last modified timestamps for the uploaded files.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             tuple: Updated initial screen children, wells selection screen style, and wells selection screen children.
         """
         if contents is not None:
+            # Make room for the upload by evicting the least recently used workspaces of other sessions
+            workspace.evict_workspaces(session_id)
+            input_dir = workspace.input_dir(session_id)
             for content, name in zip(contents, filenames):
                 _, content_string = content.split(',')
                 decoded = base64.b64decode(content_string)
                 with zipfile.ZipFile(io.BytesIO(decoded), 'r') as zip_ref:
-                    zip_ref.extractall('unzipped_dir')
+                    zip_ref.extractall(input_dir)
+                    extracted_names = zip_ref.namelist()
+                # Index the well blocks of every probe file so readers can seek straight to single wells
+                for extracted_name in extracted_names:
+                    extracted_path = os.path.join(input_dir, extracted_name)
+                    if not is_probe_file(extracted_path):
+                        continue
+                    try:
+                        build_well_index(extracted_path)
+                    except (OSError, ValueError) as e:
+                        # The file is still usable without an index, readers fall back to parsing it whole
+                        logger.warning("Could not index %s: %s", extracted_path, e)
             
             # Display information about uploaded files
             uploaded_files = html.Div([
@@ -112,6 +175,7 @@ def register_callbacks(app):
         State("control-well-positive", "value"),
         State("control-well-mix-positive", "value"),
         State("control-well-negative", "value"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
     def apply_wells_selection(n_clicks, *wells_data):
@@ -120,15 +184,16 @@ def register_callbacks(app):
 
         Args:
             n_clicks (int): Number of times the 'Apply' button has been clicked.
-            wells_data (tuple): Tuple containing values of all well inputs and control wells.
+            wells_data (tuple): Tuple containing values of all well inputs and control wells, then the session id.
 
         Returns:
             tuple: Updated initial screen children, wells selection screen style, and well names store data.
         """
-        control_well_positive = wells_data[-3]
-        control_well_mix_positive = wells_data[-2]
-        control_well_negative = wells_data[-1]
-        wells_data = wells_data[:-3]
+        control_well_positive = wells_data[-4]
+        control_well_mix_positive = wells_data[-3]
+        control_well_negative = wells_data[-2]
+        session_id = wells_data[-1]
+        wells_data = wells_data[:-4]
 
         if n_clicks:
             # Organize well data into a matrix
@@ -146,12 +211,16 @@ def register_callbacks(app):
                 html.Div(f"Positive Control Well: {control_well_positive}", style={"textAlign": "center"}),
                 html.Div(f"Mix Positive Control Well: {control_well_mix_positive}", style={"textAlign": "center"}),
                 html.Div(f"Negative Control Well: {control_well_negative}", style={"textAlign": "center"}),
+                # Calibrate all the probe files of the run up front
+                batch_calibration_summary(well_names, control_wells, session_id),
                 html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
                 # Buttons for selecting different plot actions
                 dbc.Row([
-                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 3}),
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
                     dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
-                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
                 ])
             ]), {"display": "none"}, init_well_data
         return dash.no_update, dash.no_update, dash.no_update
@@ -160,3 +229,5 @@ def register_callbacks(app):
     register_plot1_callbacks(app)
     register_plot2_callbacks(app)
     register_plot3_callbacks(app)
+    register_multiplex_callbacks(app)
+    register_quantify_callbacks(app)
@@ -0,0 +1,103 @@
+# Itai Alcalai
+# classification.py
+
+import numpy as np
+import pandas as pd
+
+def classify_droplets(rfu, thresholds):
+    """
+    Classifies every droplet by the channels it is positive in. Bit k of a droplet's class is set
+    when its channel k RFU is above the channel k threshold, so K channels give 2^K classes.
+
+    Args:
+        rfu (numpy.ndarray): N droplets x K channels RFU matrix (NaN for invalid partitions).
+        thresholds (numpy.ndarray): N x K per-droplet thresholds, or K thresholds shared by all droplets.
+
+    Returns:
+        numpy.ndarray: Class bitmask of every droplet, -1 for droplets with an invalid RFU in any channel.
+    """
+    channel_bits = 1 << np.arange(rfu.shape[1], dtype=np.int64)
+    classes = (rfu > thresholds) @ channel_bits
+    classes[np.isnan(rfu).any(axis=1)] = -1
+    return classes
+
+def classify_aligned(aligned):
+    """
+    Classifies the droplets of aligned probe files and counts every positivity class per well in one pass.
+
+    Args:
+        aligned (dict): Aligned data as returned by alignment.align_channels.
+
+    Returns:
+        dict: Dictionary with the classification:
+            'classes' (numpy.ndarray): Class bitmask of every droplet (-1 for invalid droplets).
+            'class_counts' (numpy.ndarray): Wells x 2^K count of droplets in every class.
+            'invalid_counts' (numpy.ndarray): Wells x K count of invalid droplets, each counted in the
+                first channel with an invalid RFU.
+    """
+    rfu = aligned['rfu']
+    channel_count = rfu.shape[1]
+    class_count = 1 << channel_count
+    well_count = len(aligned['wells'])
+    well_sizes = aligned['well_stops'] - aligned['well_starts']
+    well_of_droplet = np.repeat(np.arange(well_count), well_sizes)
+
+    # Every droplet is compared with the thresholds of its own well
+    classes = classify_droplets(rfu, np.repeat(aligned['thresholds'], well_sizes, axis=0))
+
+    valid = classes >= 0
+    class_counts = np.bincount(well_of_droplet[valid] * class_count + classes[valid],
+                               minlength=well_count * class_count).reshape(well_count, class_count)
+    invalid = np.isnan(rfu[~valid])
+    invalid_counts = np.bincount(well_of_droplet[~valid] * channel_count + np.argmax(invalid, axis=1),
+                                 minlength=well_count * channel_count).reshape(well_count, channel_count)
+    return {'classes': classes, 'class_counts': class_counts, 'invalid_counts': invalid_counts}
+
+def class_label(class_bits, probes):
+    """
+    Describes a positivity class, e.g. '+ Crimson - Green + Yellow'.
+
+    Args:
+        class_bits (int): The class bitmask.
+        probes (list): Probe name of every channel.
+
+    Returns:
+        str: The sign of every probe in the class.
+    """
+    return " ".join(f"{'+' if class_bits >> channel & 1 else '-'} {probe}" for channel, probe in enumerate(probes))
+
+def counts_table(aligned, classification, probes, well_names):
+    """
+    Builds the per-well table of positivity class counts and invalid counts.
+
+    Args:
+        aligned (dict): Aligned data as returned by alignment.align_channels.
+        classification (dict): Classification as returned by classify_aligned.
+        probes (list): Probe name of every channel.
+        well_names (dict): Dictionary mapping well identifiers to their names.
+
+    Returns:
+        pandas.DataFrame: One row per well with its valid droplet count, the count of every class
+            (all-positive first) and the invalid count of every probe.
+    """
+    class_counts = classification['class_counts']
+    table = pd.DataFrame({
+        'Well': aligned['wells'],
+        'Well Name': [well_names.get(well, well) for well in aligned['wells']],
+        'Valid': class_counts.sum(axis=1)
+    })
+    for class_bits in range(class_counts.shape[1] - 1, -1, -1):
+        table[class_label(class_bits, probes)] = class_counts[:, class_bits]
+    for channel, probe in enumerate(probes):
+        table[f'Invalid {probe}'] = classification['invalid_counts'][:, channel]
+    return table
+
+def write_counts_table(table, path):
+    """
+    Writes a counts table as CSV.
+
+    Args:
+        table (pandas.DataFrame): The table to write.
+        path (str): Output file path.
+    """
+    table.to_csv(path, index=False)
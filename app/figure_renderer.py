@@ -0,0 +1,74 @@
+# Itai Alcalai
+# figure_renderer.py
+
+import logging
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+logger = logging.getLogger(__name__)
+
+# Figures kept alive in this process for reuse across wells, keyed by plot type (and probes)
+_figures = {}
+
+def reusable_figure(key, build):
+    """
+    Gets the reusable figure of a plot type, building it on first use in this process. Every render
+    worker process keeps its own figures, so they are never drawn by two wells at once.
+
+    Args:
+        key (tuple): Identifies the plot type, e.g. ('2d', probe1, probe2).
+        build (callable): Builds the figure, returning a dictionary of the figure and the artists updated per well.
+
+    Returns:
+        dict: The figure and its artists, as returned by build.
+    """
+    if key not in _figures:
+        _figures[key] = build()
+    return _figures[key]
+
+def new_figure(figsize=None):
+    """
+    Creates an object-oriented Matplotlib figure with one axes, drawn by the Agg canvas outside of pyplot.
+
+    Args:
+        figsize (tuple, optional): Figure size in inches. Defaults to Matplotlib's default size.
+
+    Returns:
+        tuple: The figure and its axes.
+    """
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot()
+
+def fit_axes(axes, points, x_lines=(), y_lines=()):
+    """
+    Rescales the axes to one well's data, forgetting the limits of the previously drawn well. As with
+    axvline/axhline, a threshold line outside the data's view widens that axis to include it.
+
+    Args:
+        axes (matplotlib.axes.Axes): The axes to rescale.
+        points (numpy.ndarray): N x 2 array of the (x, y) data points.
+        x_lines (tuple, optional): X positions of the vertical lines.
+        y_lines (tuple, optional): Y positions of the horizontal lines.
+    """
+    axes.ignore_existing_data_limits = True
+    axes.update_datalim(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    axes.autoscale_view()
+    for lines, axis in ((y_lines, 'y'), (x_lines, 'x')):
+        low, high = axes.get_ybound() if axis == 'y' else axes.get_xbound()
+        if any(line < low or line > high for line in lines):
+            line_points = [[0, line] if axis == 'y' else [line, 0] for line in lines]
+            axes.update_datalim(line_points, updatex=axis == 'x', updatey=axis == 'y')
+            axes.autoscale_view(scalex=axis == 'x', scaley=axis == 'y')
+
+def log_render_time(plot_type, well, seconds):
+    """
+    Logs how long rendering one well's plot took.
+
+    Args:
+        plot_type (str): The plot type, e.g. '1D'.
+        well (str): The well name.
+        seconds (float): The render time.
+    """
+    logger.info("Rendered %s plot of well %s in %.1f ms", plot_type, well, seconds * 1000)
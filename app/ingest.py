@@ -0,0 +1,185 @@
+# Itai Alcalai
+# ingest.py
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Columns used by the plotting and calibration code
+INGEST_COLUMNS = ['Well', 'Threshold', 'RFU', 'Partition']
+
+def has_sep_line(file_path):
+    """
+    Checks if the file starts with a 'sep=' line that has to be skipped.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        bool: True if the first line of the file is a 'sep=' line, False otherwise.
+    """
+    with open(file_path, 'r') as file:
+        first_line = file.readline().strip()
+    return 'sep=' in first_line
+
+def is_probe_file(file_path):
+    """
+    Checks if a file is a probe CSV: a .csv file whose header has the Well and RFU columns.
+    Other files of an uploaded directory (notes, run reports) are skipped by the batch actions.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        bool: True if the file is a probe CSV, False otherwise.
+    """
+    if not file_path.lower().endswith('.csv') or not os.path.isfile(file_path):
+        return False
+    try:
+        with open(file_path, 'r', errors='replace') as file:
+            header = file.readline()
+            if 'sep=' in header:
+                header = file.readline()
+    except OSError:
+        return False
+    columns = {column.strip().strip('"') for column in header.split(',')}
+    return 'Well' in columns and 'RFU' in columns
+
+def read_columns(file_path):
+    """
+    Reads the Well, Threshold, RFU and (if present) Partition columns of a probe file as typed column arrays.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        dict: Dictionary with the column arrays:
+            'wells' (numpy.ndarray): Well labels, indexed by well code.
+            'well_codes' (numpy.ndarray): Integer well code of every row (-1 for a missing well).
+            'rfu' (numpy.ndarray): RFU of every row (NaN for invalid partitions).
+            'block_starts', 'block_stops' (numpy.ndarray): Row range of every contiguous well block.
+            'block_thresholds' (numpy.ndarray): Threshold of the first row of every block
+                (NaN if the file has no threshold column).
+            'partition' (numpy.ndarray): Partition number of every row, or None if the file has no partition column.
+    """
+    skip_first_line = has_sep_line(file_path)
+    # Load only the needed columns, letting pandas parse the well labels as categories
+    frame = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0,
+                        usecols=lambda column: column in INGEST_COLUMNS,
+                        dtype={'Well': 'category', 'Threshold': 'float64', 'RFU': 'float64', 'Partition': 'float64'})
+    wells = frame['Well'].cat
+    well_codes = wells.codes.to_numpy()
+    row_count = len(frame)
+    block_starts, block_stops = well_boundaries(well_codes)
+    thresholds = frame['Threshold'].to_numpy() if 'Threshold' in frame.columns else np.full(row_count, np.nan)
+    return {
+        'wells': np.asarray(wells.categories, dtype=object),
+        'well_codes': well_codes,
+        'rfu': frame['RFU'].to_numpy() if 'RFU' in frame.columns else np.full(row_count, np.nan),
+        'block_starts': block_starts,
+        'block_stops': block_stops,
+        'block_thresholds': thresholds[block_starts],
+        'partition': frame['Partition'].to_numpy() if 'Partition' in frame.columns else None
+    }
+
+def well_boundaries(well_codes):
+    """
+    Computes the boundaries of the contiguous well blocks from run-length boundaries on the well codes.
+
+    Args:
+        well_codes (numpy.ndarray): Integer well code of every row.
+
+    Returns:
+        tuple: Arrays with the start (inclusive) and stop (exclusive) row of every block.
+    """
+    if len(well_codes) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # A new block starts wherever the well code differs from the previous row
+    starts = np.concatenate(([0], np.flatnonzero(well_codes[1:] != well_codes[:-1]) + 1))
+    stops = np.append(starts[1:], len(well_codes))
+    return starts, stops
+
+def iter_wells(columns):
+    """
+    Splits the column arrays into per-well slices, in file order.
+
+    Args:
+        columns (dict): Column arrays as returned by read_columns.
+
+    Yields:
+        tuple: The well label, the threshold of the block's first row and the valid (non-NaN) RFU values of the block.
+    """
+    well_codes = columns['well_codes']
+    for start, stop, threshold in zip(columns['block_starts'], columns['block_stops'], columns['block_thresholds']):
+        code = well_codes[start]
+        # Rows without a well label cannot be assigned to a plot
+        if code < 0:
+            continue
+        rfus = columns['rfu'][start:stop]
+        yield columns['wells'][code], threshold, rfus[~np.isnan(rfus)]
+
+def _legacy_iter_wells(file_path):
+    """
+    Per-row well splitting as done by plot_data1 before the columnar engine, kept for benchmarking.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Yields:
+        tuple: The well label, the threshold of the block's first row and the list of valid RFU values.
+    """
+    reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if has_sep_line(file_path) else 0, chunksize=10000)
+    current_well = None
+    threshold = None
+    rfus = []
+    for chunk in reader:
+        for index, row in chunk.iterrows():
+            if current_well is None or row['Well'] != current_well:
+                if rfus:
+                    yield current_well, threshold, rfus
+                    rfus = []
+                current_well = row['Well']
+                threshold = row['Threshold']
+            if 'RFU' in row and pd.notna(row['RFU']):
+                rfus.append(row['RFU'])
+    if rfus:
+        yield current_well, threshold, rfus
+
+def benchmark(file_path):
+    """
+    Measures the ingestion throughput of the per-row loop and of the columnar engine on a file.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        dict: Row count and rows/sec of the legacy and columnar paths.
+    """
+    start = time.perf_counter()
+    for _ in _legacy_iter_wells(file_path):
+        pass
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = read_columns(file_path)
+    for _ in iter_wells(columns):
+        pass
+    columnar_seconds = time.perf_counter() - start
+
+    row_count = len(columns['well_codes'])
+    return {
+        'rows': row_count,
+        'legacy_rows_per_sec': row_count / legacy_seconds,
+        'columnar_rows_per_sec': row_count / columnar_seconds
+    }
+
+if __name__ == "__main__":
+    # Usage: python ingest.py <probe file> [<probe file> ...]
+    for path in sys.argv[1:]:
+        result = benchmark(path)
+        print(f"{path}: {result['rows']} rows | "
+              f"iterrows {result['legacy_rows_per_sec']:,.0f} rows/sec | "
+              f"columnar {result['columnar_rows_per_sec']:,.0f} rows/sec | "
+              f"speedup x{result['columnar_rows_per_sec'] / result['legacy_rows_per_sec']:.1f}")
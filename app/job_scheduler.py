@@ -0,0 +1,331 @@
+# Itai Alcalai
+# job_scheduler.py
+
+"""
+Job scheduler for the 1D, 2D, 3D and multiplex actions.
+
+Every plot request becomes a job with a unique id, run on a shared pool of JOB_WORKERS threads in FIFO order.
+A job moves through the JOB_STATES: queued, running, then done, failed or cancelled. New jobs are rejected
+while JOB_QUEUE_LIMIT jobs are queued or running.
+
+The Cancel button of each screen, and going back to the menu, cancels its job. A queued job is dropped at
+once; a running job stops at its next check_cancelled call, between stages or wells. Rendering jobs render
+into their own staging directory (see render_pool), so a cancelled job never touches earlier plots.
+
+While a job runs it reports its stage (one of JOB_STAGES), the rows loaded, the CSV bytes parsed and the wells rendered
+out of the total, from which job_summary derives an ETA. A screen polls its job only once it submitted one:
+every STATUS_POLL_MS at first, backing off to about a tenth of the job's age (at most STATUS_POLL_MAX_MS),
+and not at all once the job is finished.
+"""
+
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of jobs running at the same time
+JOB_WORKERS = 2
+# Maximum number of queued and running jobs; further submissions are rejected until one finishes
+JOB_QUEUE_LIMIT = 8
+# Number of finished jobs kept for status queries
+JOB_HISTORY_LIMIT = 100
+# States of a job, in lifecycle order
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+# Stages a running job reports through set_progress
+JOB_STAGES = ('parse', 'calibrate', 'render', 'write')
+# Status polling period of the screens while a job is fresh, and the longest period it backs off to
+STATUS_POLL_MS = 1000
+STATUS_POLL_MAX_MS = 5000
+
+# All known jobs by id, in submission order, and the pool running them
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+_sequence = itertools.count(1)
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job when its cancellation was requested.
+    """
+
+def _get_executor():
+    """
+    Gets the worker pool, creating it on first use.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The pool; it runs queued jobs in FIFO order.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    return _executor
+
+def _prune_history():
+    """
+    Forgets the oldest finished jobs above JOB_HISTORY_LIMIT. Must be called with _jobs_lock held.
+    """
+    finished = [job_id for job_id, job in _jobs.items() if job['state'] in ('done', 'failed', 'cancelled')]
+    for job_id in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+        del _jobs[job_id]
+
+def _run_job(job, target, args):
+    """
+    Runs one job on a pool worker and records its outcome.
+
+    Args:
+        job (dict): The job record.
+        target (callable): The job function, called as target(job, *args).
+        args (tuple): The job function's other arguments.
+    """
+    with _jobs_lock:
+        # A job cancelled while queued never starts
+        if job['state'] != 'queued':
+            return
+        job['state'] = 'running'
+        job['started'] = time.time()
+    try:
+        result = target(job, *args)
+        state, error = 'done', None
+    except JobCancelled:
+        result, state, error = None, 'cancelled', None
+    except Exception as e:
+        result, state, error = None, 'failed', str(e)
+    with _jobs_lock:
+        job['result'] = result
+        job['error'] = error
+        job['finished'] = time.time()
+        job['state'] = state
+        _prune_history()
+
+def submit_job(kind, description, target, *args, session=None):
+    """
+    Queues a job on the shared worker pool. The job function receives its own job record first and can
+    publish a status line through job['message'] and its figures through set_progress/add_progress while
+    it runs. It should pass job['cancel'] to check_cancelled between its steps, so that cancel_job stops it.
+
+    Args:
+        kind (str): Job type, e.g. '1D'.
+        description (str): Human readable description of the job.
+        target (callable): The job function, called as target(job, *args). JobCancelled marks the job
+            cancelled and any other exception marks it failed.
+        *args: The job function's other arguments.
+        session (str, optional): The session the job belongs to; only that session can see or cancel it.
+
+    Returns:
+        str: The unique id of the job.
+
+    Raises:
+        RuntimeError: If JOB_QUEUE_LIMIT jobs are already queued or running.
+    """
+    with _jobs_lock:
+        active = sum(1 for job in _jobs.values() if job['state'] in ('queued', 'running'))
+        if active >= JOB_QUEUE_LIMIT:
+            raise RuntimeError(f"Too many jobs in progress ({active}), please try again when one finishes")
+        job = {
+            'id': f"{next(_sequence)}-{uuid.uuid4().hex[:8]}",
+            'kind': kind,
+            'session': session,
+            'description': description,
+            'state': 'queued',
+            'message': None,
+            'cancel': threading.Event(),
+            'progress': {
+                'stage': None,
+                'stage_started': None,
+                'rows_read': 0,
+                'bytes_read': 0,
+                'wells_done': 0,
+                'wells_total': None
+            },
+            'error': None,
+            'result': None,
+            'submitted': time.time(),
+            'started': None,
+            'finished': None
+        }
+        _jobs[job['id']] = job
+    _get_executor().submit(_run_job, job, target, args)
+    return job['id']
+
+def set_progress(job, stage=None, **values):
+    """
+    Publishes the progress of a running job.
+
+    Args:
+        job (dict): The job record.
+        stage (str, optional): The stage the job enters, one of JOB_STAGES. Restarts the stage clock the ETA is measured on.
+        **values: Progress figures to set, e.g. wells_total=96 or wells_done=12.
+    """
+    with _jobs_lock:
+        progress = job['progress']
+        if stage is not None and stage != progress['stage']:
+            progress['stage'] = stage
+            progress['stage_started'] = time.time()
+        progress.update(values)
+
+def add_progress(job, **increments):
+    """
+    Adds to the progress figures of a running job.
+
+    Args:
+        job (dict): The job record.
+        **increments: Amounts to add, e.g. rows_read=48000, bytes_read=1200000.
+    """
+    with _jobs_lock:
+        for name, increment in increments.items():
+            job['progress'][name] += increment
+
+def _eta_seconds(progress, now):
+    """
+    Estimates the time left to render the remaining wells from the wells/sec measured so far in the render stage.
+
+    Args:
+        progress (dict): The job's progress figures.
+        now (float): The current time.
+
+    Returns:
+        float: The estimated seconds left, or None before the first well is rendered.
+    """
+    if progress['stage'] != 'render' or not progress['wells_total'] or not progress['wells_done']:
+        return None
+    seconds_per_well = (now - progress['stage_started']) / progress['wells_done']
+    return max(0, progress['wells_total'] - progress['wells_done']) * seconds_per_well
+
+def cancel_job(job_id, session=None):
+    """
+    Requests the cancellation of a job. A queued job is cancelled at once; a running job stops at its
+    next check_cancelled call.
+
+    Args:
+        job_id (str): The job id.
+        session (str, optional): The calling session; a job of another session is not cancelled.
+
+    Returns:
+        bool: True if the job was queued or running, False otherwise.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job['session'] != session or job['state'] not in ('queued', 'running'):
+            return False
+        job['cancel'].set()
+        if job['state'] == 'queued':
+            job['state'] = 'cancelled'
+            job['finished'] = time.time()
+        return True
+
+def check_cancelled(cancel):
+    """
+    Stops the calling job if its cancellation was requested.
+
+    Args:
+        cancel (threading.Event): The job's cancel token, job['cancel']. None never cancels.
+
+    Raises:
+        JobCancelled: If the token is set.
+    """
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled()
+
+def get_job(job_id, session=None):
+    """
+    Gets a snapshot of a job, with its timing.
+
+    Args:
+        job_id (str): The job id.
+        session (str, optional): The calling session; a job of another session is reported as unknown.
+
+    Returns:
+        dict: A copy of the job record plus 'queue_position' (queued jobs ahead of it, 0 once running),
+            'wait_seconds' (time queued), 'run_seconds' (time running so far) and 'eta_seconds' (estimated
+            time left, None when unknown). None for an unknown job.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job['session'] != session:
+            return None
+        snapshot = dict(job)
+        snapshot['progress'] = dict(job['progress'])
+        snapshot['queue_position'] = sum(1 for other in _jobs.values()
+                                         if other['state'] == 'queued' and other['submitted'] < job['submitted'])
+    now = time.time()
+    snapshot['wait_seconds'] = (snapshot['started'] or snapshot['finished'] or now) - snapshot['submitted']
+    snapshot['run_seconds'] = ((snapshot['finished'] or now) - snapshot['started']) if snapshot['started'] else 0.0
+    snapshot['eta_seconds'] = _eta_seconds(snapshot['progress'], now) if snapshot['state'] == 'running' else None
+    return snapshot
+
+def list_jobs():
+    """
+    Lists all known jobs of every session.
+
+    Returns:
+        list: Snapshots of every job as returned by get_job, in submission order.
+    """
+    with _jobs_lock:
+        sessions = [(job_id, job['session']) for job_id, job in _jobs.items()]
+    return [job for job in (get_job(job_id, session) for job_id, session in sessions) if job is not None]
+
+def progress_summary(job):
+    """
+    Describes the progress figures of a job in one line.
+
+    Args:
+        job (dict): A job snapshot as returned by get_job.
+
+    Returns:
+        str: e.g. 'render: 12/24 wells, 96,000 rows (3.1 MB) read, ETA 5s', or an empty string before any progress.
+            Rows that only came from the parse cache are reported as loaded from cache.
+    """
+    progress = job['progress']
+    parts = []
+    if progress['wells_total'] is not None:
+        parts.append(f"{progress['wells_done']}/{progress['wells_total']} wells")
+    if progress['rows_read'] and progress['bytes_read']:
+        parts.append(f"{progress['rows_read']:,} rows ({progress['bytes_read'] / 1e6:.1f} MB) read")
+    elif progress['rows_read']:
+        # Rows memory-mapped from the parse cache are not read from the CSV
+        parts.append(f"{progress['rows_read']:,} rows loaded from cache")
+    if job.get('eta_seconds') is not None:
+        parts.append(f"ETA {job['eta_seconds']:.0f}s")
+    summary = ", ".join(parts)
+    if job['state'] == 'running' and progress['stage']:
+        summary = f"{progress['stage']}: {summary}" if summary else progress['stage']
+    return summary
+
+def job_summary(job):
+    """
+    Describes the state and timing of a job in one line.
+
+    Args:
+        job (dict): A job snapshot as returned by get_job.
+
+    Returns:
+        str: e.g. 'Queued (2 ahead)', 'Running for 3.1s (render: 12/24 wells, ETA 5s)' or
+            'Done in 4.2s (waited 0.5s), 24/24 wells'.
+    """
+    if job['state'] == 'queued':
+        return f"Queued ({job['queue_position']} ahead)"
+    if job['state'] == 'running':
+        if job['cancel'].is_set():
+            return f"Cancelling after {job['run_seconds']:.1f}s"
+        progress = progress_summary(job)
+        return f"Running for {job['run_seconds']:.1f}s" + (f" ({progress})" if progress else "")
+    progress = progress_summary(job)
+    return (f"{job['state'].capitalize()} in {job['run_seconds']:.1f}s (waited {job['wait_seconds']:.1f}s)"
+            + (f", {progress}" if progress else ""))
+
+def poll_interval_ms(job):
+    """
+    Chooses how often a status screen polls a job. A fresh job is polled every STATUS_POLL_MS; the
+    period then grows to about a tenth of the job's age, up to STATUS_POLL_MAX_MS.
+
+    Args:
+        job (dict): A job snapshot as returned by get_job.
+
+    Returns:
+        int: The polling period in milliseconds, or None once the job is finished and polling can stop.
+    """
+    if job['state'] not in ('queued', 'running'):
+        return None
+    age_seconds = job['wait_seconds'] + job['run_seconds']
+    return int(min(STATUS_POLL_MAX_MS, max(STATUS_POLL_MS, age_seconds * 100)))
@@ -0,0 +1,322 @@
+# Itai Alcalai
+# multiplex_actions.py
+
+import dash
+from dash.dependencies import Input, Output, State
+from dash import html, dcc
+import dash_bootstrap_components as dbc
+import os
+from itertools import combinations
+from math import comb
+import workspace
+from utils import get_color
+from alignment import load_channels, missing_report, select_channels
+from render_pool import throughput_report
+from job_scheduler import STATUS_POLL_MS, add_progress, cancel_job, check_cancelled, get_job, job_summary, poll_interval_ms, set_progress, submit_job
+from plot2_actions import plot_aligned2
+from plot3_actions import plot_aligned3
+
+def list_files(session_id):
+    """
+    Lists all files in the session's input directory.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        list: A list of filenames uploaded to the session's workspace.
+    """
+    return workspace.list_input_files(session_id)
+
+def plot_multiplex_layout(session_id):
+    """
+    Generates the layout for the multiplex screen.
+
+    Args:
+        session_id (str): The session id, whose uploaded files are offered.
+
+    Returns:
+        html.Div: A Dash HTML component containing the layout for multiplex plotting.
+    """
+    files = list_files(session_id)
+    return html.Div([
+        html.H3("Multiplex", style={"textAlign": "center", "marginTop": "20px"}),
+        html.Div("Choose the probe files (every pair is plotted in 2D and every triple in 3D):", style={"textAlign": "center", "marginTop": "20px"}),
+        dcc.Dropdown(
+            id='multiplex-files-dropdown',
+            options=[{'label': file, 'value': file} for file in files],
+            placeholder="Select two or more files",
+            multi=True,
+            style={"width": "50%", "margin": "0 auto"}
+        ),
+        dbc.Row([
+            dbc.Col(dbc.Button("Plot All", id="multiplex-plot-button", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 4}),
+            dbc.Col(dbc.Button("Counts Only", id="multiplex-counts-button", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+        ]),
+        html.Div(id="plot-output-multiplex", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Button("Cancel", id="multiplex-cancel-button", color="danger", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"}),
+        dcc.Store(id="multiplex-status-store"),  # Store for plot status
+        dcc.Interval(id="multiplex-check-interval", interval=STATUS_POLL_MS, n_intervals=0, disabled=True),  # Interval to check the plot status
+        dbc.Button("Back to Plot Menu", id="back-to-main-menu-4", color="secondary", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"})
+    ])
+
+def plot_multiplex(job, file_paths, well_data, counts_only=False, output_root='.'):
+    """
+    Reads every probe file once and generates every pairwise 2D result and every triple 3D result from
+    the loaded columns. Every combination is aligned on its own channels only, so its results match the
+    2D or 3D screen for the same files. Runs as a job_scheduler job; any exception marks the job failed.
+    A cancelled job stops between combinations or wells; the combinations already written are kept.
+
+    Args:
+        job (dict): The job record, whose 'message' and progress figures show the progress.
+        file_paths (list): Paths to the probe files.
+        well_data (tuple): Tuple containing well names and control wells.
+        counts_only (bool, optional): Only write the class counts tables, without rendering plots. Default is False.
+        output_root (str, optional): Directory the plots and the counts tables are written to. Default is the working directory.
+
+    Returns:
+        list: Rendering statistics of every rendered combination, as returned by render_pool.render_wells.
+    """
+    well_names = well_data[0]
+    probes = [get_color(file_path) for file_path in file_paths]
+
+    # Load every probe file once; the combinations are joined from the loaded columns
+    set_progress(job, 'parse')
+    all_columns = load_channels(file_paths, progress=lambda rows, size: add_progress(job, rows_read=rows, bytes_read=size))
+
+    # Every combination intersects the partitions of its own channels only, so no file is read again
+    render_stats = []
+    combination_count = comb(len(file_paths), 2) + comb(len(file_paths), 3)
+
+    def combination_progress(wells_done, wells_total):
+        # Count the wells of the finished combinations, and expect the remaining ones to have as many wells as this one
+        wells_before = sum(stats['wells'] for stats in render_stats if stats)
+        remaining = combination_count - len(render_stats) - 1
+        set_progress(job, wells_done=wells_before + wells_done, wells_total=wells_before + wells_total * (1 + remaining))
+
+    set_progress(job, 'write' if counts_only else 'render')
+    for channels in combinations(range(len(file_paths)), 2):
+        check_cancelled(job['cancel'])
+        aligned = select_channels(all_columns, channels)
+        report = missing_report(aligned, [probes[channel] for channel in channels])
+        job['message'] = f"{report} - processing 2D {probes[channels[0]]} vs {probes[channels[1]]}..."
+        render_stats.append(plot_aligned2(aligned, *[probes[channel] for channel in channels],
+                                          well_names, counts_only, cancel=job['cancel'], progress=combination_progress,
+                                          output_root=output_root))
+    for channels in combinations(range(len(file_paths)), 3):
+        check_cancelled(job['cancel'])
+        aligned = select_channels(all_columns, channels)
+        report = missing_report(aligned, [probes[channel] for channel in channels])
+        job['message'] = f"{report} - processing 3D {' vs '.join(probes[channel] for channel in channels)}..."
+        render_stats.append(plot_aligned3(aligned, *[probes[channel] for channel in channels],
+                                          well_names, counts_only, cancel=job['cancel'], progress=combination_progress,
+                                          output_root=output_root))
+    report = f"Processed {combination_count} combinations of {len(file_paths)} probe files"
+    job['message'] = report
+
+    # Report the throughput over all the rendered combinations
+    render_stats = [stats for stats in render_stats if stats]
+    if render_stats:
+        wells = sum(stats['wells'] for stats in render_stats)
+        seconds = sum(stats['seconds'] for stats in render_stats)
+        job['message'] = f"{report} | " + throughput_report({
+            'wells': wells,
+            'workers': render_stats[0]['workers'],
+            'seconds': seconds,
+            'wells_per_sec': wells / seconds if seconds > 0 else 0.0
+        })
+    return render_stats
+
+def register_multiplex_callbacks(app):
+    """
+    Registers callbacks for the multiplex feature in the Dash app.
+
+    Args:
+        app (Dash): The Dash app instance.
+    """
+    @app.callback(
+        Output("initial-screen", "children", allow_duplicate=True),
+        Input("plot-multiplex", "n_clicks"),
+        [State("well-names-store", "data"),
+         State("session-store", "data")],
+        prevent_initial_call=True
+    )
+    def plot_multiplex_screen(n_clicks, data, session_id):
+        """
+        Callback to update the screen layout when the 'Multiplex' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The layout for the multiplex screen.
+        """
+        if n_clicks:
+            return plot_multiplex_layout(session_id)
+        return dash.no_update
+
+    @app.callback(
+        Output("initial-screen", "children", allow_duplicate=True),
+        Input("back-to-main-menu-4", "n_clicks"),
+        [State("well-names-store", "data"),
+         State("multiplex-status-store", "data"),
+         State("session-store", "data")],
+        prevent_initial_call=True
+    )
+    def back_to_main_menu(n_clicks, data, multiplex_status_store, session_id):
+        """
+        Callback to return to the main menu when the 'Back to Main Menu' button is clicked.
+        A job still running on this screen is cancelled.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            data (dict): Stored well names and control wells data.
+            multiplex_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The layout for the main menu screen.
+        """
+        if n_clicks:
+            well_names, control_wells = data
+
+            # Stop the screen's job, releasing its workers for the next one
+            if multiplex_status_store:
+                cancel_job(multiplex_status_store.get("job_id"), session_id)
+
+            return html.Div([
+                html.H3("Init Complete Successfully!", style={"color": "green", "textAlign": "center", "marginTop": "20px"}),
+                html.Div(f"Positive Control Well: {control_wells['positive']}", style={"textAlign": "center"}),
+                html.Div(f"Mix Positive Control Well: {control_wells['mix_positive']}", style={"textAlign": "center"}),
+                html.Div(f"Negative Control Well: {control_wells['negative']}", style={"textAlign": "center"}),
+                html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
+                dbc.Row([
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
+                    dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                ])
+            ])
+        return dash.no_update
+
+    @app.callback(
+        [Output("plot-output-multiplex", "children"),
+         Output("multiplex-status-store", "data"),
+         Output("multiplex-check-interval", "disabled"),
+         Output("multiplex-check-interval", "interval")],
+        [Input("multiplex-plot-button", "n_clicks"),
+         Input("multiplex-counts-button", "n_clicks")],
+        [State("multiplex-files-dropdown", "value"),
+         State("well-names-store", "data"),
+         State("session-store", "data")],
+        prevent_initial_call=True
+    )
+    def plot_multiplex_start(n_clicks_plot, n_clicks_counts, selected_files, well_names, session_id):
+        """
+        Callback to initiate the multiplex process based on user inputs.
+
+        Args:
+            n_clicks_plot (int): Number of times the 'Plot All' button has been clicked.
+            n_clicks_counts (int): Number of times the 'Counts Only' button has been clicked.
+            selected_files (list): The selected probe files.
+            well_names (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            tuple: HTML div with plot status, plot status store data, and the status polling switch and period.
+        """
+        ctx = dash.callback_context
+        if not ctx.triggered:
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+        if not selected_files or len(selected_files) < 2:
+            return html.Div("Please select at least two files.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
+
+        if not well_names:
+            return html.Div("Well names not provided.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
+
+        counts_only = ctx.triggered[0]['prop_id'].split('.')[0] == "multiplex-counts-button"
+        file_paths = [os.path.join(workspace.input_dir(session_id), selected_file) for selected_file in selected_files]
+        probe_names = ", ".join(get_color(selected_file) for selected_file in selected_files)
+
+        action_text = "counts" if counts_only else "plots"
+        description = f"multiplex {action_text} for probes {probe_names}"
+
+        # Queue the multiplex job on the shared worker pool, writing into the session's workspace
+        workspace.evict_workspaces(session_id)
+        try:
+            job_id = submit_job('Multiplex', description, plot_multiplex, file_paths, well_names, counts_only,
+                                workspace.output_dir(session_id), session=session_id)
+        except RuntimeError as e:
+            return html.Div(str(e), style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
+
+        return (html.Div(f"Processing {description}...", id="multiplex-status", style={"color": "blue"}),
+                {"status": "processing", "job_id": job_id},
+                False, STATUS_POLL_MS)
+
+    @app.callback(
+        Output("multiplex-status", "children"),
+        Output("multiplex-check-interval", "disabled", allow_duplicate=True),
+        Output("multiplex-check-interval", "interval", allow_duplicate=True),
+        Input("multiplex-check-interval", "n_intervals"),
+        State("multiplex-status-store", "data"),
+        State("session-store", "data"),
+        prevent_initial_call=True
+    )
+    def update_multiplex_status(n_intervals, multiplex_status_store, session_id):
+        """
+        Callback to update the multiplex status. Polling starts when a job is submitted, backs off while it runs
+        and stops once it is finished.
+
+        Args:
+            n_intervals (int): Number of intervals passed.
+            multiplex_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            tuple: Updated plot status message, whether polling stops (once the job is finished) and the next polling period.
+        """
+        if multiplex_status_store and multiplex_status_store.get("status") == "processing":
+            job = get_job(multiplex_status_store.get("job_id"), session_id)
+            if job is None:
+                return dash.no_update, True, dash.no_update
+            if job['state'] == 'failed':
+                return html.Div(f"Error: {job['description']} - {job['error']}", style={"color": "red"}), True, dash.no_update
+            if job['state'] == 'cancelled':
+                return html.Div(f"Cancelled {job['description']}.", style={"color": "orange"}), True, dash.no_update
+            if job['state'] == 'done':
+                return html.Div([
+                    html.Div(f"Completed {job['description']}!", style={"color": "green"}),
+                    html.Div(f"{job_summary(job)} | {job['message'] or ''}")
+                ]), True, dash.no_update
+            return html.Div(f"{job_summary(job)} | {job['message'] or 'Processing ' + job['description'] + '...'}", style={"color": "blue"}), False, poll_interval_ms(job)
+        return dash.no_update, True, dash.no_update
+
+    @app.callback(
+        Output("plot-output-multiplex", "children", allow_duplicate=True),
+        Input("multiplex-cancel-button", "n_clicks"),
+        State("multiplex-status-store", "data"),
+        State("session-store", "data"),
+        prevent_initial_call=True
+    )
+    def cancel_multiplex_job(n_clicks, multiplex_status_store, session_id):
+        """
+        Callback to cancel the multiplex job of this screen when the 'Cancel' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            multiplex_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The status message while the job stops.
+        """
+        if not n_clicks or not multiplex_status_store:
+            return dash.no_update
+        job_id = multiplex_status_store.get("job_id")
+        if not cancel_job(job_id, session_id):
+            return dash.no_update
+        return html.Div(f"Cancelling {get_job(job_id, session_id)['description']}...", id="multiplex-status", style={"color": "orange"})
@@ -0,0 +1,111 @@
+# Itai Alcalai
+# parse_cache.py
+
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from utils import file_digest
+from ingest import read_columns
+
+# Directory holding the binary columnar form of every parsed probe file, shared by all the session workspaces
+PARSE_CACHE_DIR = 'parse_cache'
+# Version of the cache layout, bumped whenever the stored arrays change
+PARSE_CACHE_FORMAT = 2
+
+# Arrays stored in an entry, each in its own .npy file so it can be memory-mapped
+_ARRAY_NAMES = ['well_codes', 'rfu', 'block_starts', 'block_stops', 'block_thresholds']
+
+_convert_lock = threading.Lock()
+
+def _entry_dir(file_path):
+    """
+    Gets the cache directory of a file, keyed by the hash of its content and the cache layout version.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        str: Path of the cache entry directory.
+    """
+    return os.path.join(PARSE_CACHE_DIR, f"{file_digest(file_path)}-{PARSE_CACHE_FORMAT}")
+
+def is_cached(file_path):
+    """
+    Checks if a file has already been converted to the binary columnar form.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        bool: True if the file has a cache entry, False otherwise.
+    """
+    return os.path.exists(os.path.join(_entry_dir(file_path), 'meta.json'))
+
+def _convert(file_path, entry_dir):
+    """
+    Parses a probe CSV once and writes its compact binary columnar form: categorical well codes,
+    float32 RFU, one threshold per contiguous well block and the partition numbers if the file has them.
+
+    Args:
+        file_path (str): Path to the data file.
+        entry_dir (str): Path of the cache entry directory to create.
+    """
+    columns = read_columns(file_path)
+    columns['rfu'] = columns['rfu'].astype(np.float32)
+
+    # Write into a temporary directory first so readers never see a partial entry
+    temp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name in _ARRAY_NAMES:
+        np.save(os.path.join(temp_dir, f"{name}.npy"), columns[name])
+    has_partition = columns['partition'] is not None
+    if has_partition:
+        np.save(os.path.join(temp_dir, 'partition.npy'), columns['partition'])
+    with open(os.path.join(temp_dir, 'meta.json'), 'w') as file:
+        json.dump({'format': PARSE_CACHE_FORMAT, 'wells': [str(well) for well in columns['wells']],
+                   'has_partition': has_partition}, file)
+    try:
+        os.replace(temp_dir, entry_dir)
+    except OSError:
+        # Another process converted the same file in the meantime
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def _touch(path):
+    """
+    Marks a cache entry as used now; its modification time orders the least recently used entries evicted by workspace.py.
+
+    Args:
+        path (str): Path to the cache entry.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass  # Evicted in the meantime
+
+def load_columns(file_path):
+    """
+    Loads the column arrays of a probe file through the parse cache. The first load converts the CSV;
+    later loads memory-map the stored arrays and do not parse any text.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        dict: Column arrays in the format returned by ingest.read_columns, with float32 RFU values.
+    """
+    entry_dir = _entry_dir(file_path)
+    meta_path = os.path.join(entry_dir, 'meta.json')
+    with _convert_lock:
+        if not os.path.exists(meta_path):
+            _convert(file_path, entry_dir)
+
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    _touch(entry_dir)
+    columns = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode='r') for name in _ARRAY_NAMES}
+    columns['wells'] = np.asarray(meta['wells'], dtype=object)
+    columns['partition'] = np.load(os.path.join(entry_dir, 'partition.npy'), mmap_mode='r') if meta['has_partition'] else None
+    return columns
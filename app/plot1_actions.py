@@ -6,43 +6,49 @@ from dash.dependencies import Input, Output, State
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import os
-import pandas as pd
+import numpy as np
 import matplotlib
 # Set Matplotlib to use the 'Agg' backend for non-GUI environments
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import threading
-import shutil
+import time
 from utils import get_color
+from ingest import iter_wells
+import parse_cache
+import well_index
 from threshold_calibration import get_calibrated_threshold
+from render_pool import discard_staged, publish_staged, render_wells, staging_dir, throughput_report
+from job_scheduler import STATUS_POLL_MS, add_progress, cancel_job, check_cancelled, get_job, job_summary, poll_interval_ms, set_progress, submit_job
+from figure_renderer import fit_axes, log_render_time, new_figure, reusable_figure
+import workspace
 import warnings
 
 # Suppress specific Matplotlib warnings
 warnings.filterwarnings("ignore", message="Starting a Matplotlib GUI outside of the main thread will likely fail")
 
-# Dictionaries to manage plot events, errors, and print messages
-plot_events = {}
-plot_errors = {}
-plot_prints = {}
-plot_threads = {}
-
-def list_files():
+def list_files(session_id):
     """
-    Lists all files in the unzipped directory.
+    Lists all files in the session's input directory.
+
+    Args:
+        session_id (str): The session id.
 
     Returns:
-        list: A list of filenames present in the 'unzipped_dir' directory.
+        list: A list of filenames uploaded to the session's workspace.
     """
-    return os.listdir('unzipped_dir')
+    return workspace.list_input_files(session_id)
 
-def plot_1d_layout():
+def plot_1d_layout(session_id, well_names=None):
     """
     Generates the layout for the 1D plot screen.
 
+    Args:
+        session_id (str): The session id, whose uploaded files are offered.
+        well_names (dict, optional): Dictionary mapping well identifiers to their names, offered in the wells dropdown.
+
     Returns:
         html.Div: A Dash HTML component containing the layout for 1D plotting.
     """
-    files = list_files()
+    files = list_files(session_id)
     return html.Div([
         html.H3("Plot 1D", style={"textAlign": "center", "marginTop": "20px"}),
         html.Div("Choose a file:", style={"textAlign": "center", "marginTop": "20px"}),
@@ -52,106 +58,166 @@ def plot_1d_layout():
             placeholder="Select a file",
             style={"width": "50%", "margin": "0 auto"}
         ),
+        dcc.Dropdown(
+            id='wells-dropdown',
+            options=[{'label': f"{name} ({well})", 'value': well} for well, name in (well_names or {}).items()],
+            placeholder="All wells (or choose wells to re-plot)",
+            multi=True,
+            style={"width": "50%", "margin": "0 auto", "marginTop": "10px"}
+        ),
         html.H4("Please choose threshold:", style={"textAlign": "center", "marginTop": "20px"}),
         dbc.Row([
             dbc.Col(dbc.Button("Default", id="default-threshold", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 3}),
             dbc.Col(dbc.Button("Calibrated", id="calibrated-threshold", color="primary", style={"marginTop": "20px"}), width={"size": 2})
         ]),
+        html.Div("Calibration mode:", style={"textAlign": "center", "marginTop": "20px"}),
+        dcc.RadioItems(
+            id="calibration-mode",
+            options=[{'label': ' Exact', 'value': 'exact'}, {'label': ' Streaming histogram', 'value': 'histogram'}],
+            value='exact',
+            inline=True,
+            inputStyle={"marginLeft": "10px"},
+            style={"textAlign": "center"}
+        ),
         html.Div(id="plot-output", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Button("Cancel", id="cancel-plot-1d", color="danger", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"}),
         dcc.Store(id="plot-status-store"),
         dcc.Store(id="control-wells-store"),
-        dcc.Interval(id="plot-check-interval", interval=1000, n_intervals=0),
+        dcc.Interval(id="plot-check-interval", interval=STATUS_POLL_MS, n_intervals=0, disabled=True),
         dbc.Button("Back to Plot Menu", id="back-to-main-menu-1", color="secondary", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"})
     ])
 
-def plot_data1(file_path, well_names, threshold_type, control_wells=None):
+def _build_1d_figure():
+    """
+    Builds the reusable 1D figure: an empty scatter of rasterized markers and the threshold line.
+
+    Returns:
+        dict: The figure, its axes and the artists updated for every well.
+    """
+    figure, axes = new_figure(figsize=(10, 6))
+    axes.set_xlabel('Sample Index')
+    axes.set_ylabel('RFU')
+    return {
+        'figure': figure,
+        'axes': axes,
+        'points': axes.scatter(np.empty(0), np.empty(0), alpha=0.5, rasterized=True),
+        'threshold': axes.axhline(y=0, color='r', linestyle='-')
+    }
+
+def plot_1d_scatter(well_name, rfus, threshold, output_dir, plot_count):
+    """
+    Generates a 1D scatter plot for the given well, reusing this process's 1D figure.
+
+    Args:
+        well_name (str): The well name.
+        rfus (numpy.ndarray): Valid RFU values of the well.
+        threshold (float): Threshold value drawn on the plot.
+        output_dir (str): Directory to save the plot.
+        plot_count (int): Plot number, the position of the well's block in the file.
+
+    Returns:
+        float: The render time in seconds.
+    """
+    start = time.perf_counter()
+    plot = reusable_figure(('1d',), _build_1d_figure)
+
+    # Update the RFU data, threshold and title of the figure
+    points = np.column_stack((np.arange(len(rfus)) % 80 + 1, rfus))
+    plot['points'].set_offsets(points)
+    plot['threshold'].set_ydata([threshold, threshold])
+    plot['axes'].set_title(f'Probe Scatter Plot for Well {well_name}')
+    fit_axes(plot['axes'], points, y_lines=(threshold,))
+    plot['figure'].savefig(os.path.join(output_dir, f'plot_{plot_count}_{well_name}.png'))
+
+    seconds = time.perf_counter() - start
+    log_render_time('1D', well_name, seconds)
+    return seconds
+
+def plot_data1(job, file_path, well_names, threshold_type, control_wells=None, calibration_mode='exact', selected_wells=None,
+               output_root='.', max_workers=None):
     """
     Processes data from the selected file to generate 1D plots with either default or calibrated thresholds.
+    Runs as a job_scheduler job; any exception marks the job failed. A cancelled job stops between its
+    steps and wells, and discards the plots it staged, leaving the output directory of earlier runs untouched.
 
     Args:
+        job (dict): The job record, whose 'message' and progress figures show the progress.
         file_path (str): Path to the file containing the data.
         well_names (dict): Dictionary mapping well identifiers to their names.
         threshold_type (str): Type of threshold to use ('default' or 'calibrated').
         control_wells (dict, optional): Dictionary containing control well names. Default is None.
+        calibration_mode (str, optional): Calibration mode ('exact' or 'histogram'). Default is 'exact'.
+        selected_wells (list, optional): Wells to plot. Default is None, which plots all wells.
+        output_root (str, optional): Directory the plot directory is created in. Default is the working directory.
+        max_workers (int, optional): Number of render processes. Defaults to render_pool.RENDER_WORKERS.
 
     Returns:
-        bool: True if plotting is successful, False otherwise.
+        dict: Rendering statistics as returned by render_pool.render_wells.
     """
+    # Re-plotting a few wells of a file that is not in the parse cache seeks straight to them through
+    # the well index; otherwise load the columns once through the parse cache and split them into per-well slices
+    set_progress(job, 'parse')
+    columns = None
+    wells = None
+    if selected_wells and not parse_cache.is_cached(file_path):
+        index = well_index.load_well_index(file_path)
+        blocks = well_index.read_well_blocks(file_path, selected_wells, index)
+        if blocks is not None:
+            # Blocks come back in file order, so they pair up with their positions in the index
+            positions = [position for position, block in enumerate(index['blocks']) if block['well'] in selected_wells]
+            wells = [(position, *block) for position, block in zip(positions, blocks)]
+            add_progress(job, rows_read=sum(len(rfus) for _, _, _, rfus in wells),
+                         bytes_read=index['header_length'] + sum(block['length'] for block in index['blocks']
+                                                                 if block['well'] in selected_wells))
+    if wells is None:
+        # Only a first load parses the CSV; later loads memory-map the cached columns without reading any text
+        parsed_bytes = 0 if parse_cache.is_cached(file_path) else os.path.getsize(file_path)
+        columns = parse_cache.load_columns(file_path)
+        add_progress(job, rows_read=len(columns['rfu']), bytes_read=parsed_bytes)
+        wells = [(position, *well) for position, well in enumerate(iter_wells(columns))
+                 if not selected_wells or well[0] in selected_wells]
+    set_progress(job, wells_total=sum(1 for _, _, _, rfus in wells if len(rfus)))
+    check_cancelled(job['cancel'])
+
+    threshold = None
+
+    # The calibrated threshold is shared by all the wells of the file
+    if threshold_type != 'default' and control_wells:
+        set_progress(job, 'calibrate')
+        job['message'] = "Calibrating threshold..."
+        try:
+            calibration_start = time.perf_counter()
+            threshold = get_calibrated_threshold(file_path, well_names, control_wells, columns, calibration_mode)
+            calibration_time = time.perf_counter() - calibration_start
+        except Exception as e:
+            raise ValueError("Error calibrating threshold: " + str(e))
+        job['message'] = f"Calibrated successfully ({threshold:.2f} RFU in {calibration_time:.2f}s), continuing to plot..."
+        check_cancelled(job['cancel'])
+
+    output_dir = os.path.join(output_root, f"1D_plots_{os.path.splitext(os.path.basename(get_color(file_path)))[0]}_{threshold_type}")
+    # Render into a private staging directory, so a cancelled job never touches the plots of earlier runs
+    staging = staging_dir(output_dir)
+
+    def render_tasks():
+        # Every render worker only receives its own well's RFU values. Plots are numbered by the well's
+        # block position in the whole file, so re-plotting a few wells overwrites their own plots.
+        for position, well, well_threshold, rfus in wells:
+            if not len(rfus):
+                continue
+            yield (well_names.get(well, well), np.asarray(rfus),
+                   well_threshold if threshold_type == 'default' else threshold, staging, position)
+
+    set_progress(job, 'render')
     try:
-        # Check if the file contains a 'sep=' line
-        with open(file_path, 'r') as file:
-            first_line = file.readline().strip()
-            skip_first_line = 'sep=' in first_line
-
-        # Read the file in chunks to manage memory usage
-        reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0, chunksize=10000)
-        output_dir = f"1D_plots_{os.path.splitext(os.path.basename(get_color(file_path)))[0]}_{threshold_type}"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        current_well = None
-        rfus = []
-        threshold = None
-        plot_count = 0
-
-        for chunk in reader:
-            for index, row in chunk.iterrows():
-                # If we have moved to a new well, process the current RFUs
-                if current_well is None or row['Well'] != current_well:
-                    if rfus:
-                        well_name = well_names.get(current_well, current_well)
-                        # Handle threshold
-                        if threshold_type == 'default':
-                            if threshold is None and 'Threshold' in chunk.columns:
-                                threshold = row['Threshold']
-                        else:
-                            if threshold is None and control_wells:
-                                plot_prints[file_path] = "Calibrating threshold..."
-                                try:
-                                    threshold = get_calibrated_threshold(file_path, well_names, control_wells)
-                                    plot_prints[file_path] = "Calibrated successfully, continuing to plot..."
-                                except Exception as e:
-                                    plot_errors[file_path] = "Error calibrating threshold: " + str(e)
-                                    plot_events[file_path].set()
-                                    return False
-                        # Plot the RFU data
-                        x_indices = [(i % 80) + 1 for i in range(len(rfus))]
-                        plt.figure(figsize=(10, 6))
-                        plt.scatter(x_indices, rfus, alpha=0.5)
-                        plt.axhline(y=threshold, color='r', linestyle='-')
-                        plt.title(f'Probe Scatter Plot for Well {well_name}')
-                        plt.xlabel('Sample Index')
-                        plt.ylabel('RFU')
-                        plt.savefig(os.path.join(output_dir, f'plot_{plot_count}_{well_name}.png'))
-                        plt.close()
-                        rfus = []
-                        plot_count += 1
-                    current_well = row['Well']
-                    if threshold_type == 'default':
-                        if row['Threshold'] != threshold:
-                            threshold = row['Threshold']
-
-                if 'RFU' in row and pd.notna(row['RFU']):
-                    rfus.append(row['RFU'])
-        # Handle the last set of RFUs collected
-        if rfus:
-            x_indices = [(i % 80) + 1 for i in range(len(rfus))]
-            plt.figure(figsize=(10, 6))
-            plt.scatter(x_indices, rfus, alpha=0.5)
-            plt.axhline(y=threshold, color='r', linestyle='-')
-            plt.title(f'Probe Scatter Plot for Well {current_well}')
-            plt.xlabel('Sample Index')
-            plt.ylabel('RFU')
-            well_name = well_names.get(current_well, current_well)
-            plt.savefig(os.path.join(output_dir, f'plot_{plot_count}_{well_name}.png'))
-            plt.close()
-
-        # Set the event to indicate completion
-        plot_events[file_path].set()
-    except Exception as e:
-        plot_events[file_path].set()
-        plot_errors[file_path] = str(e)
-    return True
+        render_stats = render_wells(plot_1d_scatter, render_tasks(), max_workers, job['cancel'],
+                                    lambda wells_done: set_progress(job, wells_done=wells_done))
+    except BaseException:
+        # A partly rendered plot set is not kept
+        discard_staged(staging)
+        raise
+    publish_staged(staging, output_dir)
+    job['message'] = throughput_report(render_stats)
+    return render_stats
 
 def register_plot1_callbacks(app):
     """
@@ -164,15 +230,17 @@ def register_plot1_callbacks(app):
         Output("initial-screen", "children", allow_duplicate=True),
         Input("plot-1d", "n_clicks"),
         State("well-names-store", "data"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
-    def plot_1d_screen(n_clicks, data):
+    def plot_1d_screen(n_clicks, data, session_id):
         """
         Callback to update the screen layout when the 'Plot 1D' button is clicked.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the 1D plot screen.
@@ -180,22 +248,27 @@ def register_plot1_callbacks(app):
         if n_clicks:
             control_wells = data[1]
             names = data[0]
-            return plot_1d_layout()
+            return plot_1d_layout(session_id, names)
         return dash.no_update
 
     @app.callback(
         Output("initial-screen", "children", allow_duplicate=True),
         Input("back-to-main-menu-1", "n_clicks"),
-        State("well-names-store", "data"),
+        [State("well-names-store", "data"),
+         State("plot-status-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def back_to_main_menu(n_clicks, data):
+    def back_to_main_menu(n_clicks, data, plot_status_store, session_id):
         """
         Callback to return to the main menu when the 'Back to Main Menu' button is clicked.
+        A job still running on this screen is cancelled.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            plot_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the main menu screen.
@@ -203,10 +276,9 @@ def register_plot1_callbacks(app):
         if n_clicks:
             well_names, control_wells = data
 
-            # Clean up resources
-            for file_path in list(plot_threads.keys()):
-                plot_threads[file_path].join(timeout=1)  # Attempt to stop the thread gracefully
-                del plot_threads[file_path]
+            # Stop the screen's job, releasing its workers for the next one
+            if plot_status_store:
+                cancel_job(plot_status_store.get("job_id"), session_id)
 
             return html.Div([
                 html.H3("Init Complete Successfully!", style={"color": "green", "textAlign": "center", "marginTop": "20px"}),
@@ -215,23 +287,30 @@ def register_plot1_callbacks(app):
                 html.Div(f"Negative Control Well: {control_wells['negative']}", style={"textAlign": "center"}),
                 html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
                 dbc.Row([
-                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 3}),
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
                     dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
-                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
                 ])
             ])
         return dash.no_update
 
     @app.callback(
         [Output("plot-output", "children"),
-         Output("plot-status-store", "data")],
+         Output("plot-status-store", "data"),
+         Output("plot-check-interval", "disabled"),
+         Output("plot-check-interval", "interval")],
         [Input("default-threshold", "n_clicks"),
          Input("calibrated-threshold", "n_clicks")],
         [State("file-dropdown", "value"),
-         State("well-names-store", "data")],
+         State("wells-dropdown", "value"),
+         State("calibration-mode", "value"),
+         State("well-names-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def plot_1d(n_clicks_default, n_clicks_calibrated, selected_file, data):
+    def plot_1d(n_clicks_default, n_clicks_calibrated, selected_file, selected_wells, calibration_mode, data, session_id):
         """
         Callback to initiate the 1D plotting process based on user inputs.
 
@@ -239,83 +318,111 @@ def register_plot1_callbacks(app):
             n_clicks_default (int): Number of times the 'Default' threshold button has been clicked.
             n_clicks_calibrated (int): Number of times the 'Calibrated' threshold button has been clicked.
             selected_file (str): The selected file for plotting.
+            selected_wells (list): The wells selected for re-plotting, empty for all wells.
+            calibration_mode (str): The selected calibration mode ('exact' or 'histogram').
             data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            tuple: HTML div with plot status and plot status store data.
+            tuple: HTML div with plot status, plot status store data, and the status polling switch and period.
         """
         control_wells = data[1]
         well_names = data[0]
 
         ctx = dash.callback_context
         if not ctx.triggered:
-            plot_prints[selected_file] = "No button clicks detected."
-            return (html.Div("No button clicks detected.", style={"color": "red"}), dash.no_update)
+            return (html.Div("No button clicks detected.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update)
 
         if not selected_file:
-            plot_prints[selected_file] = "No file selected."
-            return (html.Div("No file selected.", style={"color": "red"}), dash.no_update)
+            return (html.Div("No file selected.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update)
 
         if not well_names:
-            plot_prints[selected_file] = "Well names not provided."
-            return (html.Div("Well names not provided.", style={"color": "red"}), dash.no_update)
+            return (html.Div("Well names not provided.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update)
 
         if not control_wells:
-            plot_prints[selected_file] = "Control wells not provided."
-            return (html.Div("Control wells not provided.", style={"color": "red"}), dash.no_update)
+            return (html.Div("Control wells not provided.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update)
 
-        plot_prints[selected_file] = "Button clicked, checking states..."
         button_id = ctx.triggered[0]['prop_id'].split('.')[0]
         threshold_type = 'default' if button_id == 'default-threshold' else 'calibrated'
 
-        file_path = os.path.join('unzipped_dir', selected_file)
+        file_path = os.path.join(workspace.input_dir(session_id), selected_file)
         probe_name = get_color(selected_file)
+        threshold_type_text = "default" if threshold_type == 'default' else 'calibrated'
+        description = f"1D plot with {threshold_type_text} threshold for probe {probe_name}"
 
-        plot_event = threading.Event()
-        plot_events[file_path] = plot_event
-        plot_errors[file_path] = None
+        # Queue the plotting job on the shared worker pool, writing into the session's workspace
+        workspace.evict_workspaces(session_id)
+        try:
+            job_id = submit_job('1D', description, plot_data1, file_path, well_names, threshold_type,
+                                control_wells, calibration_mode, selected_wells, workspace.output_dir(session_id),
+                                session=session_id)
+        except RuntimeError as e:
+            return (html.Div(str(e), style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update)
 
-        plot_thread = threading.Thread(target=plot_data1, args=(file_path, well_names, threshold_type, control_wells))
-        plot_thread.start()
-        plot_threads[file_path] = plot_thread
-
-        threshold_type_text = "default" if threshold_type == 'default' else 'calibrated'
-        return (html.Div(f"Processing 1D plot with {threshold_type_text} threshold for probe {probe_name}...", id="plot-status", style={"color": "blue"}),
-                {"status": "processing", "file_path": file_path, "threshold_type": threshold_type})
+        return (html.Div(f"Processing {description}...", id="plot-status", style={"color": "blue"}),
+                {"status": "processing", "job_id": job_id},
+                False, STATUS_POLL_MS)
 
     @app.callback(
         Output("plot-status", "children"),
+        Output("plot-check-interval", "disabled", allow_duplicate=True),
+        Output("plot-check-interval", "interval", allow_duplicate=True),
         Input("plot-check-interval", "n_intervals"),
         State("plot-status-store", "data"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
-    def update_plot_status(n_intervals, plot_status_store):
+    def update_plot_status(n_intervals, plot_status_store, session_id):
         """
-        Callback to update the plot status at regular intervals.
+        Callback to update the plot status. Polling starts when a job is submitted, backs off while it runs
+        and stops once it is finished.
 
         Args:
             n_intervals (int): Number of intervals passed.
             plot_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            html.Div: Updated plot status message.
+            tuple: Updated plot status message, whether polling stops (once the job is finished) and the next polling period.
         """
         if plot_status_store and plot_status_store.get("status") == "processing":
-            file_path = plot_status_store.get("file_path")
-            probe_name = get_color(file_path)
-            threshold_type = plot_status_store.get("threshold_type")
-            threshold_type_text = "default" if threshold_type == 'default' else 'calibrated'
-            if plot_events[file_path].is_set():
-                if file_path in plot_errors and plot_errors[file_path]:
-                    error_message = html.Div(f"Error: 1D plot with {threshold_type_text} threshold for probe {probe_name} - {plot_errors[file_path]}", style={"color": "red"})
-                    return error_message
-                elif file_path in plot_prints and plot_prints[file_path] in ["No button clicks detected.", "No file selected.", "Well names not provided.", "Control wells not provided."]:
-                    print_message = html.Div(f"{plot_prints[file_path]}", style={"color": "red"})
-                    return print_message
-                else:
-                    output_message = html.Div(f"Completed 1D plot with {threshold_type_text} threshold for probe {probe_name}!", style={"color": "green"})
-                    return output_message
-            elif file_path in plot_prints and plot_prints[file_path]:
-                print_message = html.Div(f"{plot_prints[file_path]}", style={"color": "blue"})
-                return print_message
-        return dash.no_update
+            job = get_job(plot_status_store.get("job_id"), session_id)
+            if job is None:
+                return dash.no_update, True, dash.no_update
+            if job['state'] == 'failed':
+                return html.Div(f"Error: {job['description']} - {job['error']}", style={"color": "red"}), True, dash.no_update
+            if job['state'] == 'cancelled':
+                return html.Div(f"Cancelled {job['description']}.", style={"color": "orange"}), True, dash.no_update
+            if job['state'] == 'done':
+                return html.Div([
+                    html.Div(f"Completed {job['description']}!", style={"color": "green"}),
+                    html.Div(f"{job_summary(job)} | {job['message'] or ''}")
+                ]), True, dash.no_update
+            return html.Div(f"{job_summary(job)} | {job['message'] or 'Processing ' + job['description'] + '...'}", style={"color": "blue"}), False, poll_interval_ms(job)
+        return dash.no_update, True, dash.no_update
+
+    @app.callback(
+        Output("plot-output", "children", allow_duplicate=True),
+        Input("cancel-plot-1d", "n_clicks"),
+        State("plot-status-store", "data"),
+        State("session-store", "data"),
+        prevent_initial_call=True
+    )
+    def cancel_1d_job(n_clicks, plot_status_store, session_id):
+        """
+        Callback to cancel the 1D job of this screen when the 'Cancel' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            plot_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The status message while the job stops.
+        """
+        if not n_clicks or not plot_status_store:
+            return dash.no_update
+        job_id = plot_status_store.get("job_id")
+        if not cancel_job(job_id, session_id):
+            return dash.no_update
+        return html.Div(f"Cancelling {get_job(job_id, session_id)['description']}...", id="plot-status", style={"color": "orange"})
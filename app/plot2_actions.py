@@ -6,39 +6,50 @@ from dash.dependencies import Input, Output, State
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import os
-import pandas as pd
+import time
+import numpy as np
 import matplotlib
 # Set Matplotlib to use the 'Agg' backend for non-GUI environments
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import threading
+from matplotlib.colors import LogNorm, is_color_like
 from utils import get_color
+from render_pool import discard_staged, publish_staged, render_wells, staging_dir, throughput_report
+from job_scheduler import STATUS_POLL_MS, add_progress, cancel_job, check_cancelled, get_job, job_summary, poll_interval_ms, set_progress, submit_job
+from figure_renderer import fit_axes, log_render_time, new_figure, reusable_figure
+from alignment import align_channels, missing_report
+from classification import classify_aligned, counts_table, write_counts_table
+import workspace
 import warnings
 
 # Suppress specific Matplotlib warnings
 warnings.filterwarnings("ignore", message="Starting a Matplotlib GUI outside of the main thread will likely fail")
 
-# Dictionaries to manage plot events and threads for different files
-plot_events = {}
-plot_threads = {}
+# Number of bins per axis of the density plots
+DENSITY_BINS = 200
 
-def list_files():
+def list_files(session_id):
     """
-    Lists all files in the unzipped directory.
+    Lists all files in the session's input directory.
+
+    Args:
+        session_id (str): The session id.
 
     Returns:
-        list: A list of filenames present in the 'unzipped_dir' directory.
+        list: A list of filenames uploaded to the session's workspace.
     """
-    return os.listdir('unzipped_dir')
+    return workspace.list_input_files(session_id)
 
-def plot_2d_layout():
+def plot_2d_layout(session_id):
     """
     Generates the layout for the 2D plot screen.
 
+    Args:
+        session_id (str): The session id, whose uploaded files are offered.
+
     Returns:
         html.Div: A Dash HTML component containing the layout for 2D plotting.
     """
-    files = list_files()
+    files = list_files(session_id)
     # Generate the 2D plot layout with dropdowns for file selection and a button to initiate plotting
     return html.Div([
         html.H3("Plot 2D", style={"textAlign": "center", "marginTop": "20px"}),
@@ -55,183 +66,350 @@ def plot_2d_layout():
             placeholder="Select the second file",
             style={"width": "50%", "margin": "0 auto", "marginTop": "10px"}
         ),
+        html.Div("Plot style:", style={"textAlign": "center", "marginTop": "20px"}),
+        dcc.RadioItems(
+            id="plot-style-2d",
+            options=[{'label': ' Scatter', 'value': 'scatter'}, {'label': ' Density', 'value': 'density'}],
+            value='scatter',
+            inline=True,
+            inputStyle={"marginLeft": "10px"},
+            style={"textAlign": "center"}
+        ),
         html.Button("Plot Default", id="plot-default-button", n_clicks=0, style={"marginTop": "20px", "display": "block", "margin": "0 auto"}),
+        html.Button("Counts Only", id="counts-only-button-2d", n_clicks=0, style={"marginTop": "10px", "display": "block", "margin": "0 auto"}),
         html.Div(id="plot-output-2d", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Button("Cancel", id="cancel-plot-2d", color="danger", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"}),
         dcc.Store(id="plot2d-status-store"),  # Store for plot status
-        dcc.Interval(id="plot2d-check-interval", interval=1000, n_intervals=0),  # Interval to check the plot status
+        dcc.Interval(id="plot2d-check-interval", interval=STATUS_POLL_MS, n_intervals=0, disabled=True),  # Interval to check the plot status
         dbc.Button("Back to Plot Menu", id="back-to-main-menu-2", color="secondary", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"})
     ])
 
-def plot_data2(file_path1, file_path2, well_data, plot_event):
+def probe_color(probe):
+    """
+    Picks the Matplotlib color of a probe from its name, e.g. 'Crimson' -> 'crimson'.
+
+    Args:
+        probe (str): The probe name.
+
+    Returns:
+        str: The probe name if it is a color name, otherwise its first letter if that is a color code, otherwise 'blue'.
+    """
+    for color in (probe.lower(), probe[:1].lower()):
+        if color and is_color_like(color):
+            return color
+    return 'blue'
+
+def _build_2d_figure(probe1, probe2):
+    """
+    Builds the reusable 2D figure of a probe pair: one scatter of rasterized markers per quadrant,
+    the two threshold lines and the legend.
+
+    Args:
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+
+    Returns:
+        dict: The figure, its axes and the artists updated for every well.
+    """
+    figure, axes = new_figure()
+    color1 = probe_color(probe1)
+    color2 = probe_color(probe2)
+    empty = np.empty(0)
+
+    # Quadrants in drawing order: double positive, first probe only, second probe only, double negative
+    quadrants = [
+        axes.scatter(empty, empty, color='red', alpha=0.8, rasterized=True),
+        axes.scatter(empty, empty, color=color1, alpha=0.5, rasterized=True),
+        axes.scatter(empty, empty, color=color2, alpha=0.5, rasterized=True),
+        axes.scatter(empty, empty, color='gray', alpha=0.3, rasterized=True)
+    ]
+    threshold2 = axes.axhline(y=0, color=color2, linestyle='--', linewidth=1)
+    threshold1 = axes.axvline(x=0, color=color1, linestyle='--', linewidth=1)
+    axes.set_xlabel(f'{probe1} Probe RFU')
+    axes.set_ylabel(f'{probe2} Probe RFU')
+
+    # Empty scatter points carry the legend entries; only their labels change from well to well
+    colors = ['red', color1, color2, 'gray', 'white', 'white']
+    for color in colors:
+        axes.scatter(empty, empty, color=color, label=' ')
+    legend = axes.legend()
+    return {
+        'figure': figure,
+        'axes': axes,
+        'quadrants': quadrants,
+        'threshold1': threshold1,
+        'threshold2': threshold2,
+        'legend_texts': legend.get_texts()
+    }
+
+def plot_2d_scatter(well, probe1, probe2, rfus, classes, class_counts, invalid_counts, threshold1, threshold2, output_dir, plot_count):
+    """
+    Generates a 2D scatter plot for the given well, reusing this process's figure of the probe pair.
+
+    Args:
+        well (str): The well identifier.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        rfus (numpy.ndarray): Valid droplets x 2 channels RFU matrix.
+        classes (numpy.ndarray): Positivity class bitmask of every valid droplet.
+        class_counts (numpy.ndarray): Count of droplets in each of the 4 positivity classes.
+        invalid_counts (numpy.ndarray): Count of droplets invalid in the first probe, and in the second probe only.
+        threshold1 (float): Threshold value for the first file.
+        threshold2 (float): Threshold value for the second file.
+        output_dir (str): Directory to save the plot.
+        plot_count (int): Counter for the plot number.
+
+    Returns:
+        float: The render time in seconds.
+    """
+    start = time.perf_counter()
+    plot = reusable_figure(('2d', probe1, probe2), lambda: _build_2d_figure(probe1, probe2))
+
+    # Bit 0 is the first probe, bit 1 the second probe
+    for quadrant, class_bits in zip(plot['quadrants'], (3, 1, 2, 0)):
+        quadrant.set_offsets(rfus[classes == class_bits])
+    plot['threshold1'].set_xdata([threshold1, threshold1])
+    plot['threshold2'].set_ydata([threshold2, threshold2])
+    plot['axes'].set_title(f'{probe1} vs {probe2} 2D Scatter Plot for Well {well}')
+    fit_axes(plot['axes'], rfus, x_lines=(threshold1,), y_lines=(threshold2,))
+
+    # Update the legend labels with this well's counts
+    ab_ab, ab_bl, bl_ab, bl_bl = class_counts[3], class_counts[1], class_counts[2], class_counts[0]
+    invalid_x, invalid_y = invalid_counts
+    legend_labels = [
+        f'+ {probe1} + {probe2} | {ab_ab}',
+        f'+ {probe1}, - {probe2} | {ab_bl}',
+        f'- {probe1}, + {probe2} | {bl_ab}',
+        f'- {probe1}, - {probe2} | {bl_bl}',
+        f'Invalid {probe1} | {invalid_x}',
+        f'Invalid {probe2} | {invalid_y}'
+    ]
+    for text, label in zip(plot['legend_texts'], legend_labels):
+        text.set_text(label)
+
+    # Save the plot to the output directory
+    plot['figure'].savefig(os.path.join(output_dir, f'{probe1}_{probe2}_plot_{plot_count}_{well}.png'))
+
+    seconds = time.perf_counter() - start
+    log_render_time('2D', well, seconds)
+    return seconds
+
+def _density_range(values, threshold):
+    """
+    Gets the binning range of one channel: its data range, widened to the threshold if that falls outside, plus a 5% margin.
+
+    Args:
+        values (numpy.ndarray): RFU values of the channel.
+        threshold (float): Threshold of the channel.
+
+    Returns:
+        tuple: The low and high edges of the range.
+    """
+    low, high = values.min(), values.max()
+    if np.isfinite(threshold):
+        low, high = min(low, threshold), max(high, threshold)
+    margin = (high - low) * 0.05 or 1.0
+    return low - margin, high + margin
+
+def _build_2d_density_figure(probe1, probe2):
+    """
+    Builds the reusable 2D density figure of a probe pair: the droplet count image with its color bar,
+    the two threshold lines and the quadrant count labels.
+
+    Args:
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+
+    Returns:
+        dict: The figure, its axes and the artists updated for every well.
+    """
+    figure, axes = new_figure()
+    color1 = probe_color(probe1)
+    color2 = probe_color(probe2)
+
+    # Empty bins are masked by the log scale and left blank
+    image = axes.imshow(np.zeros((DENSITY_BINS, DENSITY_BINS)), origin='lower', aspect='auto',
+                        interpolation='nearest', cmap='viridis', norm=LogNorm(vmin=1, vmax=2))
+    figure.colorbar(image, ax=axes, label='Droplets')
+    threshold2 = axes.axhline(y=0, color=color2, linestyle='--', linewidth=1)
+    threshold1 = axes.axvline(x=0, color=color1, linestyle='--', linewidth=1)
+    axes.set_xlabel(f'{probe1} Probe RFU')
+    axes.set_ylabel(f'{probe2} Probe RFU')
+
+    # Quadrant labels in the corners: double positive, first probe only, second probe only, double negative
+    label_style = dict(transform=axes.transAxes, fontsize=8, bbox=dict(facecolor='white', alpha=0.7, edgecolor='none'))
+    quadrant_labels = [
+        axes.text(0.98, 0.98, '', ha='right', va='top', **label_style),
+        axes.text(0.98, 0.02, '', ha='right', va='bottom', **label_style),
+        axes.text(0.02, 0.98, '', ha='left', va='top', **label_style),
+        axes.text(0.02, 0.02, '', ha='left', va='bottom', **label_style)
+    ]
+    return {
+        'figure': figure,
+        'axes': axes,
+        'image': image,
+        'threshold1': threshold1,
+        'threshold2': threshold2,
+        'quadrant_labels': quadrant_labels
+    }
+
+def plot_2d_density(well, probe1, probe2, rfus, classes, class_counts, invalid_counts, threshold1, threshold2, output_dir, plot_count):
+    """
+    Generates a 2D density plot for the given well: the droplets are binned into a DENSITY_BINS x DENSITY_BINS
+    histogram and drawn as one image, so the drawing cost does not depend on the droplet count.
+
+    Args:
+        well (str): The well identifier.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        rfus (numpy.ndarray): Valid droplets x 2 channels RFU matrix.
+        classes (numpy.ndarray): Positivity class bitmask of every valid droplet.
+        class_counts (numpy.ndarray): Count of droplets in each of the 4 positivity classes.
+        invalid_counts (numpy.ndarray): Count of droplets invalid in the first probe, and in the second probe only.
+        threshold1 (float): Threshold value for the first file.
+        threshold2 (float): Threshold value for the second file.
+        output_dir (str): Directory to save the plot.
+        plot_count (int): Counter for the plot number.
+
+    Returns:
+        float: The render time in seconds.
+    """
+    start = time.perf_counter()
+    plot = reusable_figure(('2d-density', probe1, probe2), lambda: _build_2d_density_figure(probe1, probe2))
+
+    # Bin the droplets; the histogram is indexed [x, y] and the image [row = y, column = x]
+    x_range = _density_range(rfus[:, 0], threshold1)
+    y_range = _density_range(rfus[:, 1], threshold2)
+    density, _, _ = np.histogram2d(rfus[:, 0], rfus[:, 1], bins=DENSITY_BINS, range=[x_range, y_range])
+    plot['image'].set_data(density.T)
+    plot['image'].set_extent((*x_range, *y_range))
+    plot['image'].set_clim(1, max(density.max(), 2))
+    plot['threshold1'].set_xdata([threshold1, threshold1])
+    plot['threshold2'].set_ydata([threshold2, threshold2])
+    plot['axes'].set_xlim(x_range)
+    plot['axes'].set_ylim(y_range)
+    plot['axes'].set_title(f'{probe1} vs {probe2} 2D Density Plot for Well {well}\n'
+                           f'Invalid {probe1} | {invalid_counts[0]}, Invalid {probe2} | {invalid_counts[1]}', fontsize=10)
+
+    # Overlay the quadrant counts; bit 0 is the first probe, bit 1 the second probe
+    quadrant_texts = [
+        f'+ {probe1} + {probe2} | {class_counts[3]}',
+        f'+ {probe1}, - {probe2} | {class_counts[1]}',
+        f'- {probe1}, + {probe2} | {class_counts[2]}',
+        f'- {probe1}, - {probe2} | {class_counts[0]}'
+    ]
+    for label, text in zip(plot['quadrant_labels'], quadrant_texts):
+        label.set_text(text)
+
+    # Save the plot to the output directory
+    plot['figure'].savefig(os.path.join(output_dir, f'{probe1}_{probe2}_density_{plot_count}_{well}.png'))
+
+    seconds = time.perf_counter() - start
+    log_render_time('2D density', well, seconds)
+    return seconds
+
+def plot_aligned2(aligned, probe1, probe2, well_names, counts_only=False, max_workers=None, density=False, cancel=None,
+                  progress=None, output_root='.'):
+    """
+    Generates the 2D plots, or only the class counts table, of two aligned probe channels.
+    The per-well plots are rendered in parallel on a process pool into a staging directory, and moved
+    into the output directory once all of them are rendered. On cancellation only the staged plots are removed.
+
+    Args:
+        aligned (dict): Aligned data of the two channels, as returned by alignment.align_channels.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        well_names (dict): Dictionary mapping well identifiers to their names.
+        counts_only (bool, optional): Only write the per-well class counts table, without rendering plots. Default is False.
+        max_workers (int, optional): Number of render processes. Defaults to render_pool.RENDER_WORKERS.
+        density (bool, optional): Render density images instead of per-droplet scatter plots. Default is False.
+        cancel (threading.Event, optional): The calling job's cancel token, checked between wells.
+        progress (callable, optional): Called with the number of wells rendered and the number of wells to render.
+        output_root (str, optional): Directory the plots and the counts table are written to. Default is the working directory.
+
+    Returns:
+        dict: Rendering statistics as returned by render_pool.render_wells, or None in counts only mode.
+    """
+    # Classify every droplet and count the 4 positivity classes of every well in one pass
+    classification = classify_aligned(aligned)
+
+    # In counts only mode the table of class counts is the only output
+    if counts_only:
+        write_counts_table(counts_table(aligned, classification, [probe1, probe2], well_names),
+                           os.path.join(output_root, f"2D_counts_{probe1}_{probe2}.csv"))
+        return None
+
+    # Output directory for plots, shared by every run of the same plot
+    output_dir = os.path.join(output_root, f"2D_plots_{probe1}_{probe2}_density" if density else f"2D_plots_{probe1}_{probe2}")
+    # Render into a private staging directory, so a cancelled job never touches the plots of earlier runs
+    staging = staging_dir(output_dir)
+
+    def render_tasks():
+        # Slice out every well's own arrays, so each render worker only receives the data it plots
+        plot_count = 0
+        for index, (well, start, stop) in enumerate(zip(aligned['wells'], aligned['well_starts'], aligned['well_stops'])):
+            classes = classification['classes'][start:stop]
+            valid = classes >= 0
+            # Wells without a single valid droplet are not plotted
+            if not valid.any():
+                continue
+            well_name = well_names.get(well, well)
+            threshold1, threshold2 = aligned['thresholds'][index]
+            yield (well_name, probe1, probe2, aligned['rfu'][start:stop][valid], classes[valid],
+                   classification['class_counts'][index], classification['invalid_counts'][index],
+                   threshold1, threshold2, staging, plot_count)
+            plot_count += 1
+
+    # Only the wells with valid droplets are rendered
+    wells_total = int(np.count_nonzero(classification['class_counts'].sum(axis=1)))
+    if progress is not None:
+        progress(0, wells_total)
+    try:
+        render_stats = render_wells(plot_2d_density if density else plot_2d_scatter, render_tasks(), max_workers, cancel,
+                                    None if progress is None else lambda wells_done: progress(wells_done, wells_total))
+    except BaseException:
+        discard_staged(staging)
+        raise
+    publish_staged(staging, output_dir)
+    return render_stats
+
+def plot_data2(job, file_path1, file_path2, well_data, counts_only=False, density=False, output_root='.'):
     """
     Processes data from the selected files to generate 2D plots.
+    Runs as a job_scheduler job; any exception marks the job failed. A cancelled job stops after the
+    alignment or between wells.
 
     Args:
+        job (dict): The job record, whose 'message' and progress figures show the progress.
         file_path1 (str): Path to the first file containing the data.
         file_path2 (str): Path to the second file containing the data.
         well_data (tuple): Tuple containing well names and control wells.
-        plot_event (threading.Event): Event to signal completion of the plotting process.
+        counts_only (bool, optional): Only write the per-well class counts table, without rendering plots. Default is False.
+        density (bool, optional): Render density images instead of per-droplet scatter plots. Default is False.
+        output_root (str, optional): Directory the plots and the counts table are written to. Default is the working directory.
 
     Returns:
-        bool: True if plotting is successful, False otherwise.
+        dict: Rendering statistics as returned by render_pool.render_wells, or None in counts-only mode.
     """
-    try:
-        well_names = well_data[0]
-        control_wells = well_data[1]
-
-        def read_file(file_path):
-            """
-            Reads a CSV file in chunks.
-
-            Args:
-                file_path (str): Path to the file to be read.
-
-            Returns:
-                pandas.io.parsers.TextFileReader: An iterator to read the file in chunks.
-            """
-            with open(file_path, 'r') as file:
-                first_line = file.readline().strip()
-                skip_first_line = 'sep=' in first_line
-
-            # Read the CSV file in chunks to handle large files
-            reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0, chunksize=10000)
-            return reader
-
-        # Initialize readers for the two selected files
-        reader1 = read_file(file_path1)
-        reader2 = read_file(file_path2)
-        probe1 = get_color(file_path1)
-        probe2 = get_color(file_path2)
-
-        # Create output directory for plots
-        output_dir = f"2D_plots_{probe1}_{probe2}"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # Initialize variables for data processing
-        current_well = None
-        rfus1_above = []
-        rfus2_above = []
-        rfus1_below = []
-        rfus2_below = []
-        rfus1_above_below = []
-        rfus2_above_below = []
-        rfus1_below_above = []
-        rfus2_below_above = []
-        ab_ab = 0
-        ab_bl = 0
-        bl_ab = 0
-        bl_bl = 0
-        invalid_x = 0
-        invalid_y = 0
-        threshold1 = None
-        threshold2 = None
-        plot_count = 0
-
-        def plot_2d_scatter(well, threshold1, threshold2, output_dir, plot_count):
-            """
-            Generates a 2D scatter plot for the given well.
-
-            Args:
-                well (str): The well identifier.
-                threshold1 (float): Threshold value for the first file.
-                threshold2 (float): Threshold value for the second file.
-                output_dir (str): Directory to save the plot.
-                plot_count (int): Counter for the plot number.
-            """
-            # Generate the scatter plot with RFU values and thresholds
-            plt.figure()
-            plt.scatter(rfus1_above, rfus2_above, color='red', alpha=0.8)
-            plt.scatter(rfus1_above_below, rfus2_above_below, color=probe1[0], alpha=0.5)
-            plt.scatter(rfus1_below_above, rfus2_below_above, color=probe2[0], alpha=0.5)
-            plt.scatter(rfus1_below, rfus2_below, color='gray', alpha=0.3)
-            plt.axhline(y=threshold2, color=probe2[0], linestyle='--', linewidth=1)
-            plt.axvline(x=threshold1, color=probe1[0], linestyle='--', linewidth=1)
-            plt.xlabel(f'{probe1} Probe RFU')
-            plt.ylabel(f'{probe2} Probe RFU')
-            plt.title(f'{probe1} vs {probe2} 2D Scatter Plot for Well {well}')
-
-            # Create legend labels for the plot
-            legend_labels = [
-                f'+ {probe1} + {probe2} | {ab_ab}',
-                f'+ {probe1}, - {probe2} | {ab_bl}',
-                f'- {probe1}, + {probe2} | {bl_ab}',
-                f'- {probe1}, - {probe2} | {bl_bl}',
-                f'Invalid {probe1} | {invalid_x}',
-                f'Invalid {probe2} | {invalid_y}'
-            ]
-
-            # Colors for the legend
-            colors = ['red', probe1[0], probe2[0], 'gray', 'white', 'white']
-
-            # Plot empty scatter points for the legend
-            for label, color in zip(legend_labels, colors):
-                plt.scatter([], [], color=color, label=label)
-            plt.legend()
-            # Save the plot to the output directory
-            plt.savefig(os.path.join(output_dir, f'{probe1}_{probe2}_plot_{plot_count}_{well}.png'))
-            plt.close()
-
-        # Process each chunk of data from the readers
-        for chunk1, chunk2 in zip(reader1, reader2):
-            for index, (row1, row2) in enumerate(zip(chunk1.iterrows(), chunk2.iterrows())):
-                row1 = row1[1]
-                row2 = row2[1]
-
-                # If a new well is encountered, plot the data for the previous well
-                if current_well is None or row1['Well'] != current_well:
-                    if rfus1_above or rfus1_below or rfus1_above_below or rfus1_below_above:
-                        well_name = well_names.get(current_well, current_well)
-                        plot_2d_scatter(well_name, threshold1, threshold2, output_dir, plot_count)
-                        rfus1_above = []
-                        rfus2_above = []
-                        rfus1_below = []
-                        rfus2_below = []
-                        rfus1_above_below = []
-                        rfus2_above_below = []
-                        rfus1_below_above = []
-                        rfus2_below_above = []
-                        invalid_x = invalid_y = ab_ab = ab_bl = bl_ab = bl_bl = 0
-                        plot_count += 1
-                    current_well = row1['Well']
-                    threshold1 = row1['Threshold']
-                    threshold2 = row2['Threshold']
-
-                # Categorize RFU values based on thresholds
-                if 'RFU' in row1 and pd.notna(row1['RFU']) and 'RFU' in row2 and pd.notna(row2['RFU']):
-                    if row1['RFU'] > threshold1 and row2['RFU'] > threshold2:
-                        rfus1_above.append(row1['RFU'])
-                        rfus2_above.append(row2['RFU'])
-                        ab_ab += 1
-                    elif row1['RFU'] > threshold1 and row2['RFU'] <= threshold2:
-                        rfus1_above_below.append(row1['RFU'])
-                        rfus2_above_below.append(row2['RFU'])
-                        ab_bl += 1
-                    elif row1['RFU'] <= threshold1 and row2['RFU'] > threshold2:
-                        rfus1_below_above.append(row1['RFU'])
-                        rfus2_below_above.append(row2['RFU'])
-                        bl_ab += 1
-                    else:
-                        rfus1_below.append(row1['RFU'])
-                        rfus2_below.append(row2['RFU'])
-                        bl_bl += 1
-                elif 'RFU' in row1 and not pd.notna(row1['RFU']):
-                    invalid_x += 1
-                elif 'RFU' in row2 and not pd.notna(row2['RFU']):
-                    invalid_y += 1
-
-        # Plot the data for the last well
-        if rfus1_above or rfus1_below or rfus1_above_below or rfus1_below_above:
-            well_name = well_names.get(current_well, current_well)
-            plot_2d_scatter(well_name, threshold1, threshold2, output_dir, plot_count)
-        
-        plot_event.set()
-        return True
-
-    except Exception as e:
-        # print(f"Error in plotting 2D data: {e}")
-        plot_event.set()
-        return False
+    well_names = well_data[0]
+    probe1 = get_color(file_path1)
+    probe2 = get_color(file_path2)
+
+    # Join the two probe files on (Well, partition index) into one droplets x 2 matrix
+    set_progress(job, 'parse')
+    aligned = align_channels([file_path1, file_path2],
+                             progress=lambda rows, size: add_progress(job, rows_read=rows, bytes_read=size))
+    report = missing_report(aligned, [probe1, probe2])
+    job['message'] = report
+    check_cancelled(job['cancel'])
+
+    set_progress(job, 'write' if counts_only else 'render')
+    render_stats = plot_aligned2(aligned, probe1, probe2, well_names, counts_only, density=density, cancel=job['cancel'],
+                                 progress=lambda wells_done, wells_total: set_progress(job, wells_done=wells_done, wells_total=wells_total),
+                                 output_root=output_root)
+    if render_stats:
+        job['message'] = f"{report} | {throughput_report(render_stats)}"
+    return render_stats
 
 def register_plot2_callbacks(app):
     """
@@ -243,37 +421,44 @@ def register_plot2_callbacks(app):
     @app.callback(
         Output("initial-screen", "children", allow_duplicate=True),
         Input("plot-2d", "n_clicks"),
-        [State("well-names-store", "data")],
+        [State("well-names-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def plot_2d_screen(n_clicks, data):
+    def plot_2d_screen(n_clicks, data, session_id):
         """
         Callback to update the screen layout when the 'Plot 2D' button is clicked.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the 2D plot screen.
         """
         if n_clicks:
-            return plot_2d_layout()
+            return plot_2d_layout(session_id)
         return dash.no_update
 
     @app.callback(
         Output("initial-screen", "children", allow_duplicate=True),
         Input("back-to-main-menu-2", "n_clicks"),
-        State("well-names-store", "data"),
+        [State("well-names-store", "data"),
+         State("plot2d-status-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def back_to_main_menu(n_clicks, data):
+    def back_to_main_menu(n_clicks, data, plot2d_status_store, session_id):
         """
         Callback to return to the main menu when the 'Back to Main Menu' button is clicked.
+        A job still running on this screen is cancelled.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            plot2d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the main menu screen.
@@ -281,10 +466,9 @@ def register_plot2_callbacks(app):
         if n_clicks:
             well_names, control_wells = data
 
-            # Clean up resources
-            for file_path in list(plot_threads.keys()):
-                plot_threads[file_path].join(timeout=1)  # Attempt to stop the thread gracefully
-                del plot_threads[file_path]
+            # Stop the screen's job, releasing its workers for the next one
+            if plot2d_status_store:
+                cancel_job(plot2d_status_store.get("job_id"), session_id)
 
             return html.Div([
                 html.H3("Init Complete Successfully!", style={"color": "green", "textAlign": "center", "marginTop": "20px"}),
@@ -293,82 +477,136 @@ def register_plot2_callbacks(app):
                 html.Div(f"Negative Control Well: {control_wells['negative']}", style={"textAlign": "center"}),
                 html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
                 dbc.Row([
-                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 3}),
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
                     dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
-                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
                 ])
             ])
         return dash.no_update
 
     @app.callback(
         [Output("plot-output-2d", "children"),
-         Output("plot2d-status-store", "data")],
-        Input("plot-default-button", "n_clicks"),
+         Output("plot2d-status-store", "data"),
+         Output("plot2d-check-interval", "disabled"),
+         Output("plot2d-check-interval", "interval")],
+        [Input("plot-default-button", "n_clicks"),
+         Input("counts-only-button-2d", "n_clicks")],
         [State("file1-dropdown", "value"),
          State("file2-dropdown", "value"),
-         State("well-names-store", "data")],
+         State("plot-style-2d", "value"),
+         State("well-names-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def plot_2d(n_clicks, selected_file1, selected_file2, well_names):
+    def plot_2d(n_clicks, n_clicks_counts, selected_file1, selected_file2, plot_style, well_names, session_id):
         """
         Callback to initiate the 2D plotting process based on user inputs.
 
         Args:
             n_clicks (int): Number of times the 'Plot Default' button has been clicked.
+            n_clicks_counts (int): Number of times the 'Counts Only' button has been clicked.
             selected_file1 (str): The selected first file for plotting.
             selected_file2 (str): The selected second file for plotting.
+            plot_style (str): The selected plot style ('scatter' or 'density').
             well_names (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            tuple: HTML div with plot status and plot status store data.
+            tuple: HTML div with plot status, plot status store data, and the status polling switch and period.
         """
         ctx = dash.callback_context
-        if n_clicks == 0:
-            return dash.no_update, dash.no_update
+        if not n_clicks and not n_clicks_counts:
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        counts_only = ctx.triggered[0]['prop_id'].split('.')[0] == "counts-only-button-2d"
+        action_text = "counts" if counts_only else "plot"
 
         if not selected_file1 or not selected_file2:
-            return html.Div("Please select two files.", style={"color": "red"}), dash.no_update
+            return html.Div("Please select two files.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
         if not well_names:
-            return html.Div("Well names not provided.", style={"color": "red"}), dash.no_update
+            return html.Div("Well names not provided.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
-        file_path1 = os.path.join('unzipped_dir', selected_file1)
-        file_path2 = os.path.join('unzipped_dir', selected_file2)
+        file_path1 = os.path.join(workspace.input_dir(session_id), selected_file1)
+        file_path2 = os.path.join(workspace.input_dir(session_id), selected_file2)
         probe_name1 = get_color(selected_file1)
         probe_name2 = get_color(selected_file2)
 
-        plot_event = threading.Event()
-        plot_events[(file_path1, file_path2)] = plot_event
+        description = f"2D {action_text} for probes {probe_name1} and {probe_name2}"
 
-        # Start the plotting process in a new thread
-        plot_thread = threading.Thread(target=plot_data2, args=(file_path1, file_path2, well_names, plot_event))
-        plot_thread.start()
-        plot_threads[(file_path1, file_path2)] = plot_thread
+        # Queue the plotting job on the shared worker pool, writing into the session's workspace
+        workspace.evict_workspaces(session_id)
+        try:
+            job_id = submit_job('2D', description, plot_data2, file_path1, file_path2, well_names,
+                                counts_only, plot_style == 'density', workspace.output_dir(session_id), session=session_id)
+        except RuntimeError as e:
+            return html.Div(str(e), style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
-        return html.Div(f"Processing 2D plot for probes {probe_name1} and {probe_name2}...", id="plot2d-status", style={"color": "blue"}), {"status": "processing", "file_paths": (file_path1, file_path2)}
+        return (html.Div(f"Processing {description}...", id="plot2d-status", style={"color": "blue"}),
+                {"status": "processing", "job_id": job_id},
+                False, STATUS_POLL_MS)
 
     @app.callback(
         Output("plot2d-status", "children"),
+        Output("plot2d-check-interval", "disabled", allow_duplicate=True),
+        Output("plot2d-check-interval", "interval", allow_duplicate=True),
         Input("plot2d-check-interval", "n_intervals"),
         State("plot2d-status-store", "data"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
-    def update_plot2d_status(n_intervals, plot2d_status_store):
+    def update_plot2d_status(n_intervals, plot2d_status_store, session_id):
         """
-        Callback to update the plot status at regular intervals.
+        Callback to update the plot status. Polling starts when a job is submitted, backs off while it runs
+        and stops once it is finished.
 
         Args:
             n_intervals (int): Number of intervals passed.
             plot2d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            html.Div: Updated plot status message.
+            tuple: Updated plot status message, whether polling stops (once the job is finished) and the next polling period.
         """
         if plot2d_status_store and plot2d_status_store.get("status") == "processing":
-            file_paths = tuple(plot2d_status_store.get("file_paths"))
-            probe_name1 = get_color(file_paths[0])
-            probe_name2 = get_color(file_paths[1])
-            if plot_events[file_paths].is_set():
-                output_message = html.Div(f"Completed 2D plot for probes {probe_name1} and {probe_name2}!", style={"color": "green"})
-                return output_message
-        return dash.no_update
+            job = get_job(plot2d_status_store.get("job_id"), session_id)
+            if job is None:
+                return dash.no_update, True, dash.no_update
+            if job['state'] == 'failed':
+                return html.Div(f"Error: {job['description']} - {job['error']}", style={"color": "red"}), True, dash.no_update
+            if job['state'] == 'cancelled':
+                return html.Div(f"Cancelled {job['description']}.", style={"color": "orange"}), True, dash.no_update
+            if job['state'] == 'done':
+                return html.Div([
+                    html.Div(f"Completed {job['description']}!", style={"color": "green"}),
+                    html.Div(f"{job_summary(job)} | {job['message'] or ''}")
+                ]), True, dash.no_update
+            return html.Div(f"{job_summary(job)} | {job['message'] or 'Processing ' + job['description'] + '...'}", style={"color": "blue"}), False, poll_interval_ms(job)
+        return dash.no_update, True, dash.no_update
+
+    @app.callback(
+        Output("plot-output-2d", "children", allow_duplicate=True),
+        Input("cancel-plot-2d", "n_clicks"),
+        State("plot2d-status-store", "data"),
+        State("session-store", "data"),
+        prevent_initial_call=True
+    )
+    def cancel_2d_job(n_clicks, plot2d_status_store, session_id):
+        """
+        Callback to cancel the 2D job of this screen when the 'Cancel' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            plot2d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The status message while the job stops.
+        """
+        if not n_clicks or not plot2d_status_store:
+            return dash.no_update
+        job_id = plot2d_status_store.get("job_id")
+        if not cancel_job(job_id, session_id):
+            return dash.no_update
+        return html.Div(f"Cancelling {get_job(job_id, session_id)['description']}...", id="plot2d-status", style={"color": "orange"})
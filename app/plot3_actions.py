@@ -6,37 +6,49 @@ from dash.dependencies import Input, Output, State
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import os
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-import threading
+from plotly.offline import get_plotlyjs
 from utils import get_color
+from render_pool import discard_staged, publish_staged, render_wells, staging_dir, throughput_report
+from job_scheduler import STATUS_POLL_MS, add_progress, cancel_job, check_cancelled, get_job, job_summary, poll_interval_ms, set_progress, submit_job
+from alignment import align_channels, missing_report
+from classification import classify_aligned, counts_table, write_counts_table
+import workspace
 import warnings
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", message="Starting a Matplotlib GUI outside of the main thread will likely fail")
 
-# Dictionaries to manage plot events and errors for different files
-plot_events = {}
-plot_errors = {}
-plot_threads = {}
+# Maximum number of droplets drawn in one well's 3D plot; larger wells are drawn from a class-preserving sample
+POINT_BUDGET_3D = 20000
 
-def list_files():
+# Number of bins per channel of the 3D density plots
+VOLUME_BINS = 32
+
+def list_files(session_id):
     """
-    Lists all files in the unzipped directory.
+    Lists all files in the session's input directory.
+
+    Args:
+        session_id (str): The session id.
 
     Returns:
-        list: A list of filenames present in the 'unzipped_dir' directory.
+        list: A list of filenames uploaded to the session's workspace.
     """
-    return os.listdir('unzipped_dir')
+    return workspace.list_input_files(session_id)
 
-def plot_3d_layout():
+def plot_3d_layout(session_id):
     """
     Generates the layout for the 3D plot screen.
 
+    Args:
+        session_id (str): The session id, whose uploaded files are offered.
+
     Returns:
         html.Div: A Dash HTML component containing the layout for 3D plotting.
     """
-    files = list_files()
+    files = list_files(session_id)
     # Generate the layout for 3D plot with dropdowns for file selection
     return html.Div([
         html.H3("Plot 3D", style={"textAlign": "center", "marginTop": "20px"}),
@@ -59,173 +71,349 @@ def plot_3d_layout():
             placeholder="Select the third file",
             style={"width": "50%", "margin": "0 auto", "marginTop": "10px"}
         ),
+        html.Div("Plot style:", style={"textAlign": "center", "marginTop": "20px"}),
+        dcc.RadioItems(
+            id="plot-style-3d",
+            options=[{'label': ' Scatter', 'value': 'scatter'}, {'label': ' Density', 'value': 'density'}],
+            value='scatter',
+            inline=True,
+            inputStyle={"marginLeft": "10px"},
+            style={"textAlign": "center"}
+        ),
+        html.Button("Plot", id="plot-button-3d", n_clicks=0, style={"marginTop": "20px", "display": "block", "margin": "0 auto"}),
+        html.Button("Counts Only", id="counts-only-button-3d", n_clicks=0, style={"marginTop": "10px", "display": "block", "margin": "0 auto"}),
         html.Div(id="plot-output-3d", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Button("Cancel", id="cancel-plot-3d", color="danger", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"}),
         dcc.Store(id="plot3d-status-store"),  # Store for plot status
-        dcc.Interval(id="plot3d-check-interval", interval=1000, n_intervals=0),  # Interval to check the plot status
+        dcc.Interval(id="plot3d-check-interval", interval=STATUS_POLL_MS, n_intervals=0, disabled=True),  # Interval to check the plot status
         dbc.Button("Back to Plot Menu", id="back-to-main-menu-3", color="secondary", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"})
     ])
 
-def plot_data3(file_path1, file_path2, file_path3, well_data, plot_event, plot_error):
+def downsample_droplets(classes, point_budget, priority_class=7, seed=0):
+    """
+    Picks at most point_budget droplets to draw, preserving the rare classes. The classes are visited
+    with the priority class (triple-positive by default) first, then from the rarest up. Each one gets
+    its proportional share of the remaining budget, but never less than a floor that keeps the rare
+    classes whole. Larger classes (typically the negative cloud) are randomly subsampled within their
+    class, so the relative density of the clouds is kept.
+
+    Args:
+        classes (numpy.ndarray): Positivity class bitmask of every droplet.
+        point_budget (int): Maximum number of droplets to keep.
+        priority_class (int, optional): Class allotted first. Default is 7 (positive in all three channels).
+        seed (int, optional): Seed of the subsampling, so re-plotting a well draws the same points. Default is 0.
+
+    Returns:
+        numpy.ndarray: Sorted indices of the kept droplets.
+    """
+    if len(classes) <= point_budget:
+        return np.arange(len(classes))
+    class_ids, class_sizes = np.unique(classes, return_counts=True)
+    order = sorted(range(len(class_ids)), key=lambda i: (class_ids[i] != priority_class, class_sizes[i]))
+    rng = np.random.default_rng(seed)
+    remaining = point_budget
+    remaining_size = len(classes)
+    kept = []
+    for position, i in enumerate(order):
+        # The floor is half an equal split, so the proportional shares of the larger classes stay within budget
+        floor = remaining // (2 * (len(order) - position))
+        share = max(floor, remaining * class_sizes[i] // remaining_size)
+        take = min(class_sizes[i], share)
+        members = np.flatnonzero(classes == class_ids[i])
+        kept.append(members if take == class_sizes[i] else rng.choice(members, take, replace=False))
+        remaining -= take
+        remaining_size -= class_sizes[i]
+    return np.sort(np.concatenate(kept))
+
+def plot_3d_scatter(well, probe1, probe2, probe3, rfus, classes, class_counts, threshold1, threshold2, threshold3, output_dir, plot_count,
+                    point_budget=POINT_BUDGET_3D):
+    """
+    Generates a 3D scatter plot for the given well. Wells with more valid droplets than the point budget
+    are drawn from a class-preserving sample (see downsample_droplets); the legend keeps the exact counts.
+
+    Args:
+        well (str): The well identifier.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        probe3 (str): Name of the third probe.
+        rfus (numpy.ndarray): Valid droplets x 3 channels RFU matrix.
+        classes (numpy.ndarray): Positivity class bitmask of every valid droplet.
+        class_counts (numpy.ndarray): Count of droplets in each of the 8 positivity classes.
+        threshold1 (float): Threshold value for the first file.
+        threshold2 (float): Threshold value for the second file.
+        threshold3 (float): Threshold value for the third file.
+        output_dir (str): Directory to save the plot.
+        plot_count (int): Counter for the plot number.
+        point_budget (int, optional): Maximum number of droplets drawn. Default is POINT_BUDGET_3D.
+    """
+    rfus1_all, rfus2_all, rfus3_all = rfus[:, 0], rfus[:, 1], rfus[:, 2]
+    positive_count = class_counts[7]
+
+    # Keep the drawn droplets within the point budget
+    shown = downsample_droplets(classes, point_budget)
+    rfus_shown = rfus[shown]
+    # Triple-positive droplets have all three channel bits set
+    positive = classes[shown] == 7
+    sample_note = f' (showing {len(shown)} of {len(rfus)})' if len(shown) < len(rfus) else ''
+    positive_note = f' (showing {positive.sum()})' if positive.sum() < positive_count else ''
+
+    fig = go.Figure()
+    
+    # Plot all valid samples in gray
+    fig.add_trace(go.Scatter3d(
+        x=rfus_shown[:, 0], y=rfus_shown[:, 1], z=rfus_shown[:, 2], mode='markers',
+        marker=dict(size=5, color='gray', opacity=0.5),
+        name=f'All Valid Samples | {len(rfus)}{sample_note}'
+    ))
+
+    # Plot positive samples in red
+    fig.add_trace(go.Scatter3d(
+        x=rfus_shown[positive, 0], y=rfus_shown[positive, 1], z=rfus_shown[positive, 2], mode='markers',
+        marker=dict(size=5, color='red', opacity=0.8),
+        name=f'+ {probe1} + {probe2} + {probe3} | {positive_count}{positive_note}'
+    ))
+
+    # Add threshold lines
+    fig.add_trace(go.Scatter3d(
+        x=[threshold1, threshold1], y=[rfus2_all.min(), rfus2_all.max()], z=[rfus3_all.min(), rfus3_all.max()],
+        mode='lines', line=dict(color=probe1, width=2), name=f'Threshold {probe1}'
+    ))
+
+    fig.add_trace(go.Scatter3d(
+        x=[rfus1_all.min(), rfus1_all.max()], y=[threshold2, threshold2], z=[rfus3_all.min(), rfus3_all.max()],
+        mode='lines', line=dict(color=probe2, width=2), name=f'Threshold {probe2}'
+    ))
+
+    fig.add_trace(go.Scatter3d(
+        x=[rfus1_all.min(), rfus1_all.max()], y=[rfus2_all.min(), rfus2_all.max()], z=[threshold3, threshold3],
+        mode='lines', line=dict(color=probe3, width=2), name=f'Threshold {probe3}'
+    ))
+
+    fig.update_layout(
+        scene=dict(
+            xaxis_title=f'{probe1} Probe RFU',
+            yaxis_title=f'{probe2} Probe RFU',
+            zaxis_title=f'{probe3} Probe RFU'
+        ),
+        title=f'{probe1} vs {probe2} vs {probe3} 3D Scatter Plot for Well {well}'
+    )
+    
+    # Save the plot to the output directory
+    # The plot references the plotly.js bundle shared by the output directory instead of embedding it
+    fig.write_html(os.path.join(output_dir, f'{probe1}_{probe2}_{probe3}_plot_{plot_count}_{well}.html'),
+                   include_plotlyjs='directory')
+
+def _threshold_plane(axis, threshold, ranges, color, name):
+    """
+    Builds a translucent plane through a channel's threshold, spanning the other two channels' ranges.
+
+    Args:
+        axis (int): The channel of the threshold (0, 1 or 2).
+        threshold (float): The threshold value.
+        ranges (list): The (low, high) range of every channel.
+        color (str): Color of the plane.
+        name (str): Legend name of the plane.
+
+    Returns:
+        plotly.graph_objects.Surface: The plane.
+    """
+    other1, other2 = [other for other in range(3) if other != axis]
+    grid1, grid2 = np.meshgrid(ranges[other1], ranges[other2])
+    coordinates = [None, None, None]
+    coordinates[axis] = np.full(grid1.shape, threshold)
+    coordinates[other1] = grid1
+    coordinates[other2] = grid2
+    return go.Surface(x=coordinates[0], y=coordinates[1], z=coordinates[2], surfacecolor=np.zeros(grid1.shape),
+                      colorscale=[[0, color], [1, color]], showscale=False, opacity=0.25, name=name, showlegend=True)
+
+def plot_3d_density(well, probe1, probe2, probe3, rfus, classes, class_counts, threshold1, threshold2, threshold3, output_dir, plot_count):
+    """
+    Generates a 3D density plot for the given well: the droplets are binned into a VOLUME_BINS^3 grid
+    and drawn as log-scaled isosurfaces with the three threshold planes, so the figure size depends
+    only on the grid resolution.
+
+    Args:
+        well (str): The well identifier.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        probe3 (str): Name of the third probe.
+        rfus (numpy.ndarray): Valid droplets x 3 channels RFU matrix.
+        classes (numpy.ndarray): Positivity class bitmask of every valid droplet.
+        class_counts (numpy.ndarray): Count of droplets in each of the 8 positivity classes.
+        threshold1 (float): Threshold value for the first file.
+        threshold2 (float): Threshold value for the second file.
+        threshold3 (float): Threshold value for the third file.
+        output_dir (str): Directory to save the plot.
+        plot_count (int): Counter for the plot number.
+    """
+    probes = [probe1, probe2, probe3]
+    thresholds = [threshold1, threshold2, threshold3]
+
+    # Bin every channel over its data range, widened to its threshold
+    ranges = []
+    for channel, threshold in enumerate(thresholds):
+        low, high = rfus[:, channel].min(), rfus[:, channel].max()
+        if np.isfinite(threshold):
+            low, high = min(low, threshold), max(high, threshold)
+        ranges.append((low, high if high > low else low + 1))
+    density, edges = np.histogramdd(rfus, bins=VOLUME_BINS, range=ranges)
+    centers = [(channel_edges[:-1] + channel_edges[1:]) / 2 for channel_edges in edges]
+    x, y, z = np.meshgrid(*centers, indexing='ij')
+
+    fig = go.Figure()
+
+    # Log-scaled counts keep the sparse positive clusters visible next to the dense negative cloud
+    log_density = np.log10(density + 1)
+    fig.add_trace(go.Volume(
+        x=x.ravel(), y=y.ravel(), z=z.ravel(), value=log_density.ravel(),
+        isomin=log_density.max() * 0.1, isomax=log_density.max(), opacity=0.15, surface_count=12,
+        colorscale='Viridis', colorbar=dict(title='log10(droplets + 1)'),
+        name=f'All Valid Samples | {len(rfus)}'
+    ))
+
+    for channel, (probe, threshold) in enumerate(zip(probes, thresholds)):
+        if np.isfinite(threshold):
+            fig.add_trace(_threshold_plane(channel, threshold, ranges, probe, f'Threshold {probe}'))
+
+    fig.update_layout(
+        scene=dict(
+            xaxis_title=f'{probe1} Probe RFU',
+            yaxis_title=f'{probe2} Probe RFU',
+            zaxis_title=f'{probe3} Probe RFU'
+        ),
+        title=f'{probe1} vs {probe2} vs {probe3} 3D Density Plot for Well {well}'
+              f' (+ {probe1} + {probe2} + {probe3} | {class_counts[7]})'
+    )
+
+    # The plot references the plotly.js bundle shared by the output directory instead of embedding it
+    fig.write_html(os.path.join(output_dir, f'{probe1}_{probe2}_{probe3}_density_{plot_count}_{well}.html'),
+                   include_plotlyjs='directory')
+
+def write_plotly_bundle(output_dir):
+    """
+    Writes the plotly.js bundle shared by all the 3D plots of an output directory, if it is not there yet.
+    It is written once before rendering, so parallel render workers never write it concurrently.
+
+    Args:
+        output_dir (str): Directory of the 3D plots.
+    """
+    bundle_path = os.path.join(output_dir, 'plotly.min.js')
+    if os.path.exists(bundle_path):
+        return
+    temp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(get_plotlyjs())
+    os.replace(temp_path, bundle_path)
+
+def plot_aligned3(aligned, probe1, probe2, probe3, well_names, counts_only=False, max_workers=None, point_budget=POINT_BUDGET_3D,
+                  density=False, cancel=None, progress=None, output_root='.'):
+    """
+    Generates the 3D plots, or only the class counts table, of three aligned probe channels.
+    The per-well plots are rendered in parallel on a process pool into a staging directory, and moved
+    into the output directory once all of them are rendered. On cancellation only the staged plots are removed.
+
+    Args:
+        aligned (dict): Aligned data of the three channels, as returned by alignment.align_channels.
+        probe1 (str): Name of the first probe.
+        probe2 (str): Name of the second probe.
+        probe3 (str): Name of the third probe.
+        well_names (dict): Dictionary mapping well identifiers to their names.
+        counts_only (bool, optional): Only write the per-well class counts table, without rendering plots. Default is False.
+        max_workers (int, optional): Number of render processes. Defaults to render_pool.RENDER_WORKERS.
+        point_budget (int, optional): Maximum number of droplets drawn per well. Default is POINT_BUDGET_3D.
+        density (bool, optional): Render density isosurfaces instead of per-droplet scatter plots. Default is False.
+        cancel (threading.Event, optional): The calling job's cancel token, checked between wells.
+        progress (callable, optional): Called with the number of wells rendered and the number of wells to render.
+        output_root (str, optional): Directory the plots and the counts table are written to. Default is the working directory.
+
+    Returns:
+        dict: Rendering statistics as returned by render_pool.render_wells, or None in counts only mode.
+    """
+    # Classify every droplet and count the 8 positivity classes of every well in one pass
+    classification = classify_aligned(aligned)
+
+    # In counts only mode the table of class counts is the only output
+    if counts_only:
+        write_counts_table(counts_table(aligned, classification, [probe1, probe2, probe3], well_names),
+                           os.path.join(output_root, f"3D_counts_{probe1}_{probe2}_{probe3}.csv"))
+        return None
+
+    # Output directory for plots, shared by every run of the same plot
+    output_dir = os.path.join(output_root, f"3D_plots_{probe1}_{probe2}_{probe3}_density" if density else f"3D_plots_{probe1}_{probe2}_{probe3}")
+    # Render into a private staging directory, so a cancelled job never touches the plots of earlier runs
+    staging = staging_dir(output_dir)
+    # The bundle is shared by all the plots of the output directory, so it is only staged if it is not there yet
+    if not os.path.exists(os.path.join(output_dir, 'plotly.min.js')):
+        write_plotly_bundle(staging)
+
+    def render_tasks():
+        # Slice out every well's own arrays, so each render worker only receives the data it plots
+        plot_count = 0
+        for index, (well, start, stop) in enumerate(zip(aligned['wells'], aligned['well_starts'], aligned['well_stops'])):
+            classes = classification['classes'][start:stop]
+            valid = classes >= 0
+            # Wells without a single valid droplet are not plotted
+            if not valid.any():
+                continue
+            well_name = well_names.get(well, well)
+            threshold1, threshold2, threshold3 = aligned['thresholds'][index]
+            yield (well_name, probe1, probe2, probe3, aligned['rfu'][start:stop][valid], classes[valid],
+                   classification['class_counts'][index], threshold1, threshold2, threshold3,
+                   staging, plot_count) + (() if density else (point_budget,))
+            plot_count += 1
+
+    # Only the wells with valid droplets are rendered
+    wells_total = int(np.count_nonzero(classification['class_counts'].sum(axis=1)))
+    if progress is not None:
+        progress(0, wells_total)
+    try:
+        render_stats = render_wells(plot_3d_density if density else plot_3d_scatter, render_tasks(), max_workers, cancel,
+                                    None if progress is None else lambda wells_done: progress(wells_done, wells_total))
+    except BaseException:
+        discard_staged(staging)
+        raise
+    publish_staged(staging, output_dir)
+    return render_stats
+
+def plot_data3(job, file_path1, file_path2, file_path3, well_data, counts_only=False, density=False, output_root='.'):
     """
     Processes data from the selected files to generate 3D plots.
+    Runs as a job_scheduler job; any exception marks the job failed. A cancelled job stops after the
+    alignment or between wells.
 
     Args:
+        job (dict): The job record, whose 'message' and progress figures show the progress.
         file_path1 (str): Path to the first file containing the data.
         file_path2 (str): Path to the second file containing the data.
         file_path3 (str): Path to the third file containing the data.
         well_data (tuple): Tuple containing well names and control wells.
-        plot_event (threading.Event): Event to signal completion of the plotting process.
-        plot_error (threading.Event): Event to signal an error in the plotting process.
-    """
-    try:
-        well_names = well_data[0]
-        control_wells = well_data[1]
-
-        def read_file(file_path):
-            """
-            Reads a CSV file in chunks.
-
-            Args:
-                file_path (str): Path to the file to be read.
-
-            Returns:
-                pandas.io.parsers.TextFileReader: An iterator to read the file in chunks.
-            """
-            with open(file_path, 'r') as file:
-                first_line = file.readline().strip()
-                skip_first_line = 'sep=' in first_line
-
-            # Read the CSV file in chunks to handle large files
-            reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0, chunksize=10000)
-            return reader
-
-        # Initialize readers for the three selected files
-        reader1 = read_file(file_path1)
-        reader2 = read_file(file_path2)
-        reader3 = read_file(file_path3)
-        probe1 = get_color(file_path1)
-        probe2 = get_color(file_path2)
-        probe3 = get_color(file_path3)
-
-        # Create output directory for plots
-        output_dir = f"3D_plots_{probe1}_{probe2}_{probe3}"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # Initialize variables for data processing
-        current_well = None
-        rfus1_all = []
-        rfus2_all = []
-        rfus3_all = []
-        rfus1_positive = []
-        rfus2_positive = []
-        rfus3_positive = []
-        positive_count = 0
-        threshold1 = None
-        threshold2 = None
-        threshold3 = None
-        plot_count = 0
+        counts_only (bool, optional): Only write the per-well class counts table, without rendering plots. Default is False.
+        density (bool, optional): Render density isosurfaces instead of per-droplet scatter plots. Default is False.
+        output_root (str, optional): Directory the plots and the counts table are written to. Default is the working directory.
 
-        def plot_3d_scatter(well, threshold1, threshold2, threshold3, output_dir, plot_count):
-            """
-            Generates a 3D scatter plot for the given well.
-
-            Args:
-                well (str): The well identifier.
-                threshold1 (float): Threshold value for the first file.
-                threshold2 (float): Threshold value for the second file.
-                threshold3 (float): Threshold value for the third file.
-                output_dir (str): Directory to save the plot.
-                plot_count (int): Counter for the plot number.
-            """
-            fig = go.Figure()
-            
-            # Plot all valid samples in gray
-            fig.add_trace(go.Scatter3d(
-                x=rfus1_all, y=rfus2_all, z=rfus3_all, mode='markers',
-                marker=dict(size=5, color='gray', opacity=0.5),
-                name='All Valid Samples'
-            ))
-
-            # Plot positive samples in red
-            fig.add_trace(go.Scatter3d(
-                x=rfus1_positive, y=rfus2_positive, z=rfus3_positive, mode='markers',
-                marker=dict(size=5, color='red', opacity=0.8),
-                name=f'+ {probe1} + {probe2} + {probe3} | {positive_count}'
-            ))
-
-            # Add threshold lines
-            fig.add_trace(go.Scatter3d(
-                x=[threshold1, threshold1], y=[min(rfus2_all), max(rfus2_all)], z=[min(rfus3_all), max(rfus3_all)],
-                mode='lines', line=dict(color=probe1, width=2), name=f'Threshold {probe1}'
-            ))
-
-            fig.add_trace(go.Scatter3d(
-                x=[min(rfus1_all), max(rfus1_all)], y=[threshold2, threshold2], z=[min(rfus3_all), max(rfus3_all)],
-                mode='lines', line=dict(color=probe2, width=2), name=f'Threshold {probe2}'
-            ))
-
-            fig.add_trace(go.Scatter3d(
-                x=[min(rfus1_all), max(rfus1_all)], y=[min(rfus2_all), max(rfus2_all)], z=[threshold3, threshold3],
-                mode='lines', line=dict(color=probe3, width=2), name=f'Threshold {probe3}'
-            ))
-
-            fig.update_layout(
-                scene=dict(
-                    xaxis_title=f'{probe1} Probe RFU',
-                    yaxis_title=f'{probe2} Probe RFU',
-                    zaxis_title=f'{probe3} Probe RFU'
-                ),
-                title=f'{probe1} vs {probe2} vs {probe3} 3D Scatter Plot for Well {well}'
-            )
-            
-            # Save the plot to the output directory
-            fig.write_html(os.path.join(output_dir, f'{probe1}_{probe2}_{probe3}_plot_{plot_count}_{well}.html'))
-
-        # Process each chunk of data from the readers
-        for chunk1, chunk2, chunk3 in zip(reader1, reader2, reader3):
-            for index, (row1, row2, row3) in enumerate(zip(chunk1.iterrows(), chunk2.iterrows(), chunk3.iterrows())):
-                row1 = row1[1]
-                row2 = row2[1]
-                row3 = row3[1]
-
-                # If a new well is encountered, plot the data for the previous well
-                if current_well is None or row1['Well'] != current_well:
-                    if rfus1_all:
-                        well_name = well_names.get(current_well, current_well)
-                        plot_3d_scatter(well_name, threshold1, threshold2, threshold3, output_dir, plot_count)
-                        rfus1_all = []
-                        rfus2_all = []
-                        rfus3_all = []
-                        rfus1_positive = []
-                        rfus2_positive = []
-                        rfus3_positive = []
-                        positive_count = 0
-                        plot_count += 1
-                    current_well = row1['Well']
-                    threshold1 = row1['Threshold']
-                    threshold2 = row2['Threshold']
-                    threshold3 = row3['Threshold']
-                    
-                if 'RFU' in row1 and pd.notna(row1['RFU']) and 'RFU' in row2 and pd.notna(row2['RFU']) and 'RFU' in row3 and pd.notna(row3['RFU']):
-                    rfus1_all.append(row1['RFU'])
-                    rfus2_all.append(row2['RFU'])
-                    rfus3_all.append(row3['RFU'])
-                    if row1['RFU'] > threshold1 and row2['RFU'] > threshold2 and row3['RFU'] > threshold3:
-                        rfus1_positive.append(row1['RFU'])
-                        rfus2_positive.append(row2['RFU'])
-                        rfus3_positive.append(row3['RFU'])
-                        positive_count += 1
-
-        # Plot the data for the last well
-        if rfus1_all:
-            well_name = well_names.get(current_well, current_well)
-            plot_3d_scatter(well_name, threshold1, threshold2, threshold3, output_dir, plot_count)
-
-        plot_event.set()
-    except Exception as e:
-        plot_error.set()
-        plot_events[(file_path1, file_path2, file_path3)] = f"Error: {str(e)}"
+    Returns:
+        dict: Rendering statistics as returned by render_pool.render_wells, or None in counts-only mode.
+    """
+    well_names = well_data[0]
+    probe1 = get_color(file_path1)
+    probe2 = get_color(file_path2)
+    probe3 = get_color(file_path3)
+
+    # Join the three probe files on (Well, partition index) into one droplets x 3 matrix
+    set_progress(job, 'parse')
+    aligned = align_channels([file_path1, file_path2, file_path3],
+                             progress=lambda rows, size: add_progress(job, rows_read=rows, bytes_read=size))
+    report = missing_report(aligned, [probe1, probe2, probe3])
+    job['message'] = report
+    check_cancelled(job['cancel'])
+
+    set_progress(job, 'write' if counts_only else 'render')
+    render_stats = plot_aligned3(aligned, probe1, probe2, probe3, well_names, counts_only, density=density, cancel=job['cancel'],
+                                 progress=lambda wells_done, wells_total: set_progress(job, wells_done=wells_done, wells_total=wells_total),
+                                 output_root=output_root)
+    if render_stats:
+        job['message'] = f"{report} | {throughput_report(render_stats)}"
+    return render_stats
 
 def register_plot3_callbacks(app):
     """
@@ -237,37 +425,44 @@ def register_plot3_callbacks(app):
     @app.callback(
         Output("initial-screen", "children", allow_duplicate=True),
         Input("plot-3d", "n_clicks"),
-        [State("well-names-store", "data")],
+        [State("well-names-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def plot_3d_screen(n_clicks, data):
+    def plot_3d_screen(n_clicks, data, session_id):
         """
         Callback to update the screen layout when the 'Plot 3D' button is clicked.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the 3D plot screen.
         """
         if n_clicks:
-            return plot_3d_layout()
+            return plot_3d_layout(session_id)
         return dash.no_update
 
     @app.callback(
         Output("initial-screen", "children", allow_duplicate=True),
         Input("back-to-main-menu-3", "n_clicks"),
-        State("well-names-store", "data"),
+        [State("well-names-store", "data"),
+         State("plot3d-status-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def back_to_main_menu(n_clicks, data):
+    def back_to_main_menu(n_clicks, data, plot3d_status_store, session_id):
         """
         Callback to return to the main menu when the 'Back to Main Menu' button is clicked.
+        A job still running on this screen is cancelled.
 
         Args:
             n_clicks (int): Number of times the button has been clicked.
             data (dict): Stored well names and control wells data.
+            plot3d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
             html.Div: The layout for the main menu screen.
@@ -275,10 +470,9 @@ def register_plot3_callbacks(app):
         if n_clicks:
             well_names, control_wells = data
 
-            # Clean up resources
-            for file_path in list(plot_threads.keys()):
-                plot_threads[file_path].join(timeout=1)  # Attempt to stop the thread gracefully
-                del plot_threads[file_path]
+            # Stop the screen's job, releasing its workers for the next one
+            if plot3d_status_store:
+                cancel_job(plot3d_status_store.get("job_id"), session_id)
 
             return html.Div([
                 html.H3("Init Complete Successfully!", style={"color": "green", "textAlign": "center", "marginTop": "20px"}),
@@ -287,91 +481,140 @@ def register_plot3_callbacks(app):
                 html.Div(f"Negative Control Well: {control_wells['negative']}", style={"textAlign": "center"}),
                 html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
                 dbc.Row([
-                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 3}),
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
                     dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
-                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
                 ])
             ])
         return dash.no_update
 
     @app.callback(
         [Output("plot-output-3d", "children"),
-         Output("plot3d-status-store", "data")],
-        [Input("file1-dropdown", "value"),
-         Input("file2-dropdown", "value"),
-         Input("file3-dropdown", "value")],
-        [State("well-names-store", "data")],
+         Output("plot3d-status-store", "data"),
+         Output("plot3d-check-interval", "disabled"),
+         Output("plot3d-check-interval", "interval")],
+        [Input("plot-button-3d", "n_clicks"),
+         Input("counts-only-button-3d", "n_clicks")],
+        [State("file1-dropdown", "value"),
+         State("file2-dropdown", "value"),
+         State("file3-dropdown", "value"),
+         State("plot-style-3d", "value"),
+         State("well-names-store", "data"),
+         State("session-store", "data")],
         prevent_initial_call=True
     )
-    def plot_3d(selected_file1, selected_file2, selected_file3, well_names):
+    def plot_3d(n_clicks, n_clicks_counts, selected_file1, selected_file2, selected_file3, plot_style, well_names, session_id):
         """
         Callback to initiate the 3D plotting process based on user inputs.
 
         Args:
+            n_clicks (int): Number of times the 'Plot' button has been clicked.
+            n_clicks_counts (int): Number of times the 'Counts Only' button has been clicked.
             selected_file1 (str): The selected first file for plotting.
             selected_file2 (str): The selected second file for plotting.
             selected_file3 (str): The selected third file for plotting.
+            plot_style (str): The selected plot style ('scatter' or 'density').
             well_names (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            tuple: HTML div with plot status and plot status store data.
+            tuple: HTML div with plot status, plot status store data, and the status polling switch and period.
         """
         ctx = dash.callback_context
-        if not ctx.triggered:
-            return dash.no_update, dash.no_update
+        if not n_clicks and not n_clicks_counts:
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        counts_only = ctx.triggered[0]['prop_id'].split('.')[0] == "counts-only-button-3d"
+        action_text = "counts" if counts_only else "plot"
 
         if not selected_file1 or not selected_file2 or not selected_file3:
-            return html.Div("Please select all three files to proceed.", style={"color": "red"}), dash.no_update
+            return html.Div("Please select all three files to proceed.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
         if not well_names:
-            return html.Div("Well names data is missing. Please ensure the well names are initialized.", style={"color": "red"}), dash.no_update
+            return html.Div("Well names data is missing. Please ensure the well names are initialized.", style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
-        file_path1 = os.path.join('unzipped_dir', selected_file1)
-        file_path2 = os.path.join('unzipped_dir', selected_file2)
-        file_path3 = os.path.join('unzipped_dir', selected_file3)
+        file_path1 = os.path.join(workspace.input_dir(session_id), selected_file1)
+        file_path2 = os.path.join(workspace.input_dir(session_id), selected_file2)
+        file_path3 = os.path.join(workspace.input_dir(session_id), selected_file3)
         probe_name1 = get_color(selected_file1)
         probe_name2 = get_color(selected_file2)
         probe_name3 = get_color(selected_file3)
 
-        plot_event = threading.Event()
-        plot_error = threading.Event()
-        plot_events[(file_path1, file_path2, file_path3)] = plot_event
-        plot_errors[(file_path1, file_path2, file_path3)] = plot_error
+        description = f"3D {action_text} for probes {probe_name1}, {probe_name2}, and {probe_name3}"
 
-        # Start the plotting process in a new thread
-        plot_thread = threading.Thread(target=plot_data3, args=(file_path1, file_path2, file_path3, well_names, plot_event, plot_error))
-        plot_thread.start()
-        plot_threads[(file_path1, file_path2, file_path3)] = plot_thread
+        # Queue the plotting job on the shared worker pool, writing into the session's workspace
+        workspace.evict_workspaces(session_id)
+        try:
+            job_id = submit_job('3D', description, plot_data3, file_path1, file_path2, file_path3, well_names,
+                                counts_only, plot_style == 'density', workspace.output_dir(session_id), session=session_id)
+        except RuntimeError as e:
+            return html.Div(str(e), style={"color": "red"}), dash.no_update, dash.no_update, dash.no_update
 
-        return (html.Div(f"Processing 3D plot for probes {probe_name1}, {probe_name2}, and {probe_name3}...", id="plot3d-status", style={"color": "blue"}),
-                {"status": "processing", "file_paths": (file_path1, file_path2, file_path3)})
+        return (html.Div(f"Processing {description}...", id="plot3d-status", style={"color": "blue"}),
+                {"status": "processing", "job_id": job_id},
+                False, STATUS_POLL_MS)
 
     @app.callback(
         Output("plot3d-status", "children"),
+        Output("plot3d-check-interval", "disabled", allow_duplicate=True),
+        Output("plot3d-check-interval", "interval", allow_duplicate=True),
         Input("plot3d-check-interval", "n_intervals"),
         State("plot3d-status-store", "data"),
+        State("session-store", "data"),
         prevent_initial_call=True
     )
-    def update_plot3d_status(n_intervals, plot3d_status_store):
+    def update_plot3d_status(n_intervals, plot3d_status_store, session_id):
         """
-        Callback to update the plot status at regular intervals.
+        Callback to update the plot status. Polling starts when a job is submitted, backs off while it runs
+        and stops once it is finished.
 
         Args:
             n_intervals (int): Number of intervals passed.
             plot3d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
 
         Returns:
-            html.Div: Updated plot status message.
+            tuple: Updated plot status message, whether polling stops (once the job is finished) and the next polling period.
         """
         if plot3d_status_store and plot3d_status_store.get("status") == "processing":
-            file_paths = tuple(plot3d_status_store.get("file_paths"))
-            probe_name1 = get_color(file_paths[0])
-            probe_name2 = get_color(file_paths[1])
-            probe_name3 = get_color(file_paths[2])
-            if plot_errors[file_paths].is_set():
-                output_message = html.Div(f"Error occurred while processing 3D plot for probes {probe_name1}, {probe_name2}, and {probe_name3}: {plot_events[file_paths]}", style={"color": "red"})
-                return output_message
-            if plot_events[file_paths].is_set():
-                output_message = html.Div(f"Completed 3D plot for probes {probe_name1}, {probe_name2}, and {probe_name3}!", style={"color": "green"})
-                return output_message
-        return dash.no_update
+            job = get_job(plot3d_status_store.get("job_id"), session_id)
+            if job is None:
+                return dash.no_update, True, dash.no_update
+            if job['state'] == 'failed':
+                return html.Div(f"Error occurred while processing {job['description']}: {job['error']}", style={"color": "red"}), True, dash.no_update
+            if job['state'] == 'cancelled':
+                return html.Div(f"Cancelled {job['description']}.", style={"color": "orange"}), True, dash.no_update
+            if job['state'] == 'done':
+                return html.Div([
+                    html.Div(f"Completed {job['description']}!", style={"color": "green"}),
+                    html.Div(f"{job_summary(job)} | {job['message'] or ''}")
+                ]), True, dash.no_update
+            return html.Div(f"{job_summary(job)} | {job['message'] or 'Processing ' + job['description'] + '...'}", style={"color": "blue"}), False, poll_interval_ms(job)
+        return dash.no_update, True, dash.no_update
+
+    @app.callback(
+        Output("plot-output-3d", "children", allow_duplicate=True),
+        Input("cancel-plot-3d", "n_clicks"),
+        State("plot3d-status-store", "data"),
+        State("session-store", "data"),
+        prevent_initial_call=True
+    )
+    def cancel_3d_job(n_clicks, plot3d_status_store, session_id):
+        """
+        Callback to cancel the 3D job of this screen when the 'Cancel' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            plot3d_status_store (dict): Stored plot status data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The status message while the job stops.
+        """
+        if not n_clicks or not plot3d_status_store:
+            return dash.no_update
+        job_id = plot3d_status_store.get("job_id")
+        if not cancel_job(job_id, session_id):
+            return dash.no_update
+        return html.Div(f"Cancelling {get_job(job_id, session_id)['description']}...", id="plot3d-status", style={"color": "orange"})
@@ -0,0 +1,171 @@
+# Itai Alcalai
+# quantification.py
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from utils import get_color
+from ingest import is_probe_file
+import parse_cache
+from classification import write_counts_table
+
+# Volume of one partition in nanoliters (QIAcuity 26k nanoplate; the 8.5k nanoplate is 0.34 nL)
+PARTITION_VOLUME_NL = 0.91
+# Two-sided normal quantile of the confidence intervals (95%)
+CONFIDENCE_Z = 1.96
+
+def well_positive_counts(columns, threshold=None):
+    """
+    Counts the positive and valid partitions of every well of a probe file in one pass.
+
+    Args:
+        columns (dict): Column arrays as returned by parse_cache.load_columns.
+        threshold (float, optional): Threshold shared by all wells (e.g. a calibrated one). Defaults to
+            the file's own threshold of every well block.
+
+    Returns:
+        tuple: Arrays with the well labels (in order of first appearance), their thresholds (the first
+            block's, or the shared one), positive partition counts and valid partition counts.
+    """
+    well_codes = np.asarray(columns['well_codes'])
+    rfu = np.asarray(columns['rfu'], dtype=np.float64)
+    block_starts = np.asarray(columns['block_starts'])
+    block_sizes = np.asarray(columns['block_stops']) - block_starts
+    block_thresholds = np.asarray(columns['block_thresholds'], dtype=np.float64)
+    if threshold is not None:
+        block_thresholds = np.full(len(block_starts), float(threshold))
+
+    # Every row is compared with the threshold of its own block
+    row_thresholds = np.repeat(block_thresholds, block_sizes)
+    valid = (well_codes >= 0) & ~np.isnan(rfu)
+    positive = valid & (rfu > row_thresholds)
+    well_count = len(columns['wells'])
+    positives = np.bincount(well_codes[positive], minlength=well_count)
+    totals = np.bincount(well_codes[valid], minlength=well_count)
+
+    # Report the wells in file order, with the threshold of their first block
+    block_codes = well_codes[block_starts]
+    labelled = block_codes >= 0
+    present, first_blocks = np.unique(block_codes[labelled], return_index=True)
+    order = np.argsort(first_blocks)
+    present = present[order]
+    thresholds = block_thresholds[labelled][first_blocks[order]]
+    return np.asarray(columns['wells'])[present], thresholds, positives[present], totals[present]
+
+def poisson_estimates(positives, totals, partition_volume_nl=PARTITION_VOLUME_NL, z=CONFIDENCE_Z):
+    """
+    Computes the Poisson-corrected concentration of any number of wells at once. The mean copies per
+    partition is -ln(1 - p) for a positive fraction p; its confidence interval is the Wilson score
+    interval of p mapped through the same transform. Wells with no valid partitions, or with every
+    partition positive (saturated), get NaN where the estimate is undefined.
+
+    Args:
+        positives (numpy.ndarray): Positive partition count of every well.
+        totals (numpy.ndarray): Valid partition count of every well.
+        partition_volume_nl (float, optional): Volume of one partition in nanoliters. Default is PARTITION_VOLUME_NL.
+        z (float, optional): Normal quantile of the confidence intervals. Default is CONFIDENCE_Z.
+
+    Returns:
+        dict: Arrays of 'copies_per_partition', 'copies_per_partition_low', 'copies_per_partition_high',
+            'copies_per_ul', 'copies_per_ul_low' and 'copies_per_ul_high'.
+    """
+    positives = np.asarray(positives, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = positives / totals
+        # Wilson score interval of the positive fraction
+        z_squared = z * z
+        denominator = 1 + z_squared / totals
+        center = (fraction + z_squared / (2 * totals)) / denominator
+        half_width = z * np.sqrt(fraction * (1 - fraction) / totals + z_squared / (4 * totals * totals)) / denominator
+        bounds = {
+            'copies_per_partition': fraction,
+            'copies_per_partition_low': np.clip(center - half_width, 0, 1),
+            'copies_per_partition_high': np.clip(center + half_width, 0, 1)
+        }
+        estimates = {}
+        for name, bound in bounds.items():
+            copies = -np.log1p(-bound)
+            copies[~np.isfinite(copies)] = np.nan
+            estimates[name] = copies
+    # nL to µL
+    for name in list(estimates):
+        estimates[name.replace('per_partition', 'per_ul')] = estimates[name] * 1000 / partition_volume_nl
+    return estimates
+
+def quantify_files(file_paths, well_names, thresholds=None, partition_volume_nl=PARTITION_VOLUME_NL, errors=None):
+    """
+    Builds the plate quantification table of a set of probe files: per well and probe, the positive and
+    valid partition counts and the Poisson-corrected copies per partition and per µL with confidence intervals.
+    A file that cannot be quantified gets one row with its error instead of failing the whole plate.
+
+    Args:
+        file_paths (list): Paths to the probe files.
+        well_names (dict): Dictionary mapping well identifiers to their names.
+        thresholds (dict, optional): Threshold of every file path (e.g. calibrated ones). Files missing
+            from it use their own per-well thresholds.
+        partition_volume_nl (float, optional): Volume of one partition in nanoliters. Default is PARTITION_VOLUME_NL.
+        errors (dict, optional): Error message of every file path that already failed (e.g. its calibration).
+            These files are reported without being read.
+
+    Returns:
+        pandas.DataFrame: One row per well and probe, and one row per failed file with its 'Error'.
+    """
+    thresholds = thresholds or {}
+    errors = errors or {}
+    parts = []
+    for file_path in file_paths:
+        error = errors.get(file_path)
+        if error is None:
+            try:
+                probe = get_color(file_path)
+                wells, well_thresholds, positives, totals = well_positive_counts(parse_cache.load_columns(file_path),
+                                                                                 thresholds.get(file_path))
+            except (OSError, ValueError, KeyError) as e:
+                error = str(e)
+        if error is not None:
+            parts.append(pd.DataFrame({'Well': [''], 'Well Name': [''], 'Probe': [os.path.basename(file_path)],
+                                       'Threshold': [np.nan], 'Positive': [pd.NA], 'Valid': [pd.NA], 'Error': [error]}))
+            continue
+        parts.append(pd.DataFrame({
+            'Well': wells,
+            'Well Name': [well_names.get(well, well) for well in wells],
+            'Probe': probe,
+            'Threshold': well_thresholds,
+            'Positive': positives,
+            'Valid': totals,
+            'Error': ''
+        }))
+    table = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=['Well', 'Well Name', 'Probe', 'Threshold', 'Positive', 'Valid', 'Error'])
+    # Failed files have no counts, so the counts are nullable integers
+    table['Positive'] = table['Positive'].astype('Int64')
+    table['Valid'] = table['Valid'].astype('Int64')
+
+    # The estimates of all wells and probes are computed together
+    estimates = poisson_estimates(table['Positive'].to_numpy(dtype=np.float64, na_value=np.nan),
+                                  table['Valid'].to_numpy(dtype=np.float64, na_value=np.nan), partition_volume_nl)
+    table['Copies/Partition'] = estimates['copies_per_partition']
+    table['Copies/Partition Low'] = estimates['copies_per_partition_low']
+    table['Copies/Partition High'] = estimates['copies_per_partition_high']
+    table['Copies/µL'] = estimates['copies_per_ul']
+    table['Copies/µL Low'] = estimates['copies_per_ul_low']
+    table['Copies/µL High'] = estimates['copies_per_ul_high']
+    return table
+
+if __name__ == "__main__":
+    # Usage: python quantification.py <output .csv> <probe file or directory> [...]
+    output_path = sys.argv[1]
+    paths = []
+    for path in sys.argv[2:]:
+        if os.path.isdir(path):
+            paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if is_probe_file(os.path.join(path, name))))
+        else:
+            paths.append(path)
+    start = time.perf_counter()
+    plate = quantify_files(paths, {})
+    write_counts_table(plate, output_path)
+    print(f"Quantified {len(plate)} wells/probes from {len(paths)} files in {time.perf_counter() - start:.2f}s -> {output_path}")
@@ -0,0 +1,214 @@
+# Itai Alcalai
+# quantify_actions.py
+
+import dash
+from dash.dependencies import Input, Output, State
+from dash import html, dcc
+import dash_bootstrap_components as dbc
+import os
+import time
+import numpy as np
+import workspace
+from ingest import is_probe_file
+from threshold_calibration import calibrate_directory
+from quantification import PARTITION_VOLUME_NL, quantify_files
+from classification import write_counts_table
+
+# Number of significant digits shown in the on-screen table (the written table keeps full precision)
+DISPLAY_DIGITS = 4
+
+def list_files(session_id):
+    """
+    Lists all files in the session's input directory.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        list: A list of filenames uploaded to the session's workspace.
+    """
+    return workspace.list_input_files(session_id)
+
+def quantify_layout():
+    """
+    Generates the layout for the quantification screen.
+
+    Returns:
+        html.Div: A Dash HTML component containing the layout for the plate quantification.
+    """
+    return html.Div([
+        html.H3("Quantify", style={"textAlign": "center", "marginTop": "20px"}),
+        html.Div("Partition volume (nL):", style={"textAlign": "center", "marginTop": "20px"}),
+        dcc.Input(id="partition-volume", type="number", value=PARTITION_VOLUME_NL, min=0, step=0.01,
+                  style={"display": "block", "margin": "0 auto"}),
+        html.H4("Please choose threshold:", style={"textAlign": "center", "marginTop": "20px"}),
+        dbc.Row([
+            dbc.Col(dbc.Button("Default", id="quantify-default", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 4}),
+            dbc.Col(dbc.Button("Calibrated", id="quantify-calibrated", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+        ]),
+        dcc.Loading(html.Div(id="quantify-output", style={"textAlign": "center", "marginTop": "20px"})),
+        dbc.Button("Back to Plot Menu", id="back-to-main-menu-5", color="secondary", style={"marginTop": "20px", "display": "block", "marginLeft": "auto", "marginRight": "auto"})
+    ])
+
+def display_table(table):
+    """
+    Formats the floating point columns of the plate table to DISPLAY_DIGITS significant digits for the screen,
+    so that small copies per partition and large copies per µL both keep their precision. Missing values are blank.
+
+    Args:
+        table (pandas.DataFrame): The plate table.
+
+    Returns:
+        pandas.DataFrame: A copy of the table with the floating point values as strings.
+    """
+    display = table.copy()
+    for column in display.select_dtypes(include='float').columns:
+        display[column] = display[column].map(lambda value: np.format_float_positional(
+            value, precision=DISPLAY_DIGITS, unique=False, fractional=False, trim='-'))
+    # Values that are undefined or missing (e.g. the counts of a failed file) are left blank
+    return display.astype(object).where(table.notna(), '')
+
+def quantify_plate(session_id, well_names, control_wells, threshold_type, partition_volume_nl):
+    """
+    Quantifies every probe file in the session's input directory and writes the plate table to its output directory.
+
+    Args:
+        session_id (str): The session id.
+        well_names (dict): Dictionary mapping well identifiers to their names.
+        control_wells (dict): Dictionary containing control well names.
+        threshold_type (str): Type of threshold to use ('default' or 'calibrated').
+        partition_volume_nl (float): Volume of one partition in nanoliters.
+
+    Returns:
+        tuple: The plate table and the path it was written to.
+    """
+    input_dir = workspace.input_dir(session_id)
+    # Files that are not probe CSVs (notes, run reports) are skipped, as by the batch calibration
+    file_paths = sorted(os.path.join(input_dir, file) for file in list_files(session_id)
+                        if is_probe_file(os.path.join(input_dir, file)))
+    thresholds = None
+    errors = {}
+    if threshold_type == 'calibrated':
+        # Calibrated thresholds come from the calibration cache, so this is instant after the batch calibration.
+        # A file that fails to calibrate is reported in the table instead of failing the plate.
+        thresholds = {}
+        for result in calibrate_directory(input_dir, well_names, control_wells):
+            file_path = os.path.join(input_dir, result['file'])
+            if result['error']:
+                errors[file_path] = f"Error calibrating: {result['error']}"
+            else:
+                thresholds[file_path] = result['threshold']
+    table = quantify_files(file_paths, well_names, thresholds, partition_volume_nl, errors)
+    output_path = os.path.join(workspace.output_dir(session_id), f"quantification_{threshold_type}.csv")
+    write_counts_table(table, output_path)
+    return table, output_path
+
+def register_quantify_callbacks(app):
+    """
+    Registers callbacks for the quantification feature in the Dash app.
+
+    Args:
+        app (Dash): The Dash app instance.
+    """
+    @app.callback(
+        Output("initial-screen", "children", allow_duplicate=True),
+        Input("quantify", "n_clicks"),
+        prevent_initial_call=True
+    )
+    def quantify_screen(n_clicks):
+        """
+        Callback to update the screen layout when the 'Quantify' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+
+        Returns:
+            html.Div: The layout for the quantification screen.
+        """
+        if n_clicks:
+            return quantify_layout()
+        return dash.no_update
+
+    @app.callback(
+        Output("initial-screen", "children", allow_duplicate=True),
+        Input("back-to-main-menu-5", "n_clicks"),
+        State("well-names-store", "data"),
+        prevent_initial_call=True
+    )
+    def back_to_main_menu(n_clicks, data):
+        """
+        Callback to return to the main menu when the 'Back to Main Menu' button is clicked.
+
+        Args:
+            n_clicks (int): Number of times the button has been clicked.
+            data (dict): Stored well names and control wells data.
+
+        Returns:
+            html.Div: The layout for the main menu screen.
+        """
+        if n_clicks:
+            well_names, control_wells = data
+            return html.Div([
+                html.H3("Init Complete Successfully!", style={"color": "green", "textAlign": "center", "marginTop": "20px"}),
+                html.Div(f"Positive Control Well: {control_wells['positive']}", style={"textAlign": "center"}),
+                html.Div(f"Mix Positive Control Well: {control_wells['mix_positive']}", style={"textAlign": "center"}),
+                html.Div(f"Negative Control Well: {control_wells['negative']}", style={"textAlign": "center"}),
+                html.H3("Choose Action", style={"textAlign": "center", "marginTop": "40px"}),
+                dbc.Row([
+                    dbc.Col(dbc.Button("Plot 1D", id="plot-1d", color="primary", style={"marginTop": "20px"}), width={"size": 2, "offset": 1}),
+                    dbc.Col(dbc.Button("Plot 2D", id="plot-2d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Plot 3D", id="plot-3d", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Multiplex", id="plot-multiplex", color="primary", style={"marginTop": "20px"}), width={"size": 2}),
+                    dbc.Col(dbc.Button("Quantify", id="quantify", color="primary", style={"marginTop": "20px"}), width={"size": 2})
+                ])
+            ])
+        return dash.no_update
+
+    @app.callback(
+        Output("quantify-output", "children"),
+        [Input("quantify-default", "n_clicks"),
+         Input("quantify-calibrated", "n_clicks")],
+        [State("partition-volume", "value"),
+         State("well-names-store", "data"),
+         State("session-store", "data")],
+        prevent_initial_call=True
+    )
+    def quantify(n_clicks_default, n_clicks_calibrated, partition_volume, data, session_id):
+        """
+        Callback to quantify the plate with the chosen threshold type and show the table.
+
+        Args:
+            n_clicks_default (int): Number of times the 'Default' button has been clicked.
+            n_clicks_calibrated (int): Number of times the 'Calibrated' button has been clicked.
+            partition_volume (float): Volume of one partition in nanoliters.
+            data (dict): Stored well names and control wells data.
+            session_id (str): The session id of the browser tab.
+
+        Returns:
+            html.Div: The quantification table, or an error message.
+        """
+        ctx = dash.callback_context
+        if not ctx.triggered:
+            return dash.no_update
+
+        if not partition_volume or partition_volume <= 0:
+            return html.Div("Please enter a positive partition volume.", style={"color": "red"})
+
+        if not data:
+            return html.Div("Well names not provided.", style={"color": "red"})
+
+        well_names, control_wells = data
+        threshold_type = 'calibrated' if ctx.triggered[0]['prop_id'].split('.')[0] == "quantify-calibrated" else 'default'
+        start = time.perf_counter()
+        try:
+            table, output_path = quantify_plate(session_id, well_names, control_wells, threshold_type, partition_volume)
+        except Exception as e:
+            return html.Div(f"Error: {e}", style={"color": "red"})
+        elapsed = time.perf_counter() - start
+        failed = table.loc[table['Error'] != '', 'Probe'].tolist()
+
+        return html.Div([
+            html.Div(f"Quantified {len(table) - len(failed)} wells/probes in {elapsed:.2f}s, written to {output_path}", style={"color": "green"}),
+            html.Div(f"Could not quantify {', '.join(failed)}, see the Error column.", style={"color": "red"}) if failed else None,
+            dbc.Table.from_dataframe(display_table(table), bordered=True, size="sm", style={"marginTop": "20px"})
+        ])
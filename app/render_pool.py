@@ -0,0 +1,194 @@
+# Itai Alcalai
+# render_pool.py
+
+"""
+Per-well rendering on a process pool shared by every job, and the staging of the rendered plots.
+
+The 1D, 2D, 3D and multiplex actions prepare each well's arrays in the calling thread and send every well's
+savefig/write_html to a worker process. All jobs share one lazily created pool of RENDER_WORKERS processes
+(one per CPU by default), so concurrent jobs never use more render processes than that.
+
+A job renders into a private staging directory next to its output directory (staging_dir). Only once every
+well is rendered are the plots moved into the shared output directory (publish_staged), replacing the files
+of earlier runs with the same names. A cancelled or failed job discards its staging directory (discard_staged),
+so the plots of earlier runs are never touched.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from job_scheduler import check_cancelled
+
+# Number of render worker processes shared by all jobs; None uses one per CPU
+RENDER_WORKERS = None
+# Seconds between cancel token checks while waiting for the wells being rendered
+CANCEL_CHECK_SECONDS = 0.2
+
+# The shared render pool, created on first use
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def render_pool_size():
+    """
+    Gets the number of worker processes of the shared render pool.
+
+    Returns:
+        int: The number of worker processes.
+    """
+    return RENDER_WORKERS or os.cpu_count() or 1
+
+def get_render_pool():
+    """
+    Gets the process pool shared by every rendering job, creating it on first use. Workers live as long as
+    the app, so each keeps its reusable figures across jobs, and RENDER_WORKERS bounds the rendering CPU use
+    however many jobs run at once.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The shared render pool.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=render_pool_size())
+        return _render_pool
+
+def _discard_render_pool(pool):
+    """
+    Drops a broken render pool (e.g. after a worker process died), so the next job creates a new one.
+
+    Args:
+        pool (concurrent.futures.ProcessPoolExecutor): The broken pool.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def render_wells(render, tasks, max_workers=None, cancel=None, progress=None):
+    """
+    Renders per-well plots in parallel on the shared render pool. Every task holds only the arrays of its own
+    well, so each worker receives just the data it draws. Tasks are submitted as they are produced, so the
+    caller can keep preparing wells while the first ones render, but at most max_workers wells of one call
+    are in the pool at a time, so concurrent jobs share the workers. The cancel token is checked between
+    wells; on cancellation or error the wells not started yet are dropped, and the call returns as soon as
+    the wells already rendering finish.
+
+    Args:
+        render (callable): Module-level function that renders and saves one well's plot, optionally
+            returning its own render time in seconds.
+        tasks (iterable): Argument tuples of render, one per well.
+        max_workers (int, optional): Number of wells rendered at a time, at most the pool size.
+            Defaults to the pool size.
+        cancel (threading.Event, optional): The calling job's cancel token.
+        progress (callable, optional): Called with the number of wells rendered so far whenever wells finish.
+
+    Returns:
+        dict: The number of rendered 'wells', the 'workers' used, the elapsed 'seconds', the 'wells_per_sec'
+            and the 'mean_render_seconds' of one well (None if render does not report it).
+
+    Raises:
+        job_scheduler.JobCancelled: If the cancel token is set before all the wells are rendered.
+    """
+    workers = min(max_workers or render_pool_size(), render_pool_size())
+    start = time.perf_counter()
+    pool = get_render_pool()
+    futures = []
+    pending = set()
+
+    def wait_for_wells(pending):
+        check_cancelled(cancel)
+        done, pending = wait(pending, timeout=CANCEL_CHECK_SECONDS, return_when=FIRST_COMPLETED)
+        # Re-raise the first rendering error in the calling thread
+        for future in done:
+            future.result()
+        if done and progress is not None:
+            progress(len(futures) - len(pending))
+        return pending
+
+    try:
+        for task in tasks:
+            check_cancelled(cancel)
+            while len(pending) >= workers:
+                pending = wait_for_wells(pending)
+            future = pool.submit(render, *task)
+            futures.append(future)
+            pending.add(future)
+        while pending:
+            pending = wait_for_wells(pending)
+    except BaseException as e:
+        # Drop this call's queued wells and let the ones already rendering finish; the pool stays up for other jobs
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        if isinstance(e, BrokenProcessPool):
+            _discard_render_pool(pool)
+        raise
+    render_times = [future.result() for future in futures]
+    seconds = time.perf_counter() - start
+    render_times = [render_time for render_time in render_times if render_time is not None]
+    return {
+        'wells': len(futures),
+        'workers': workers,
+        'seconds': seconds,
+        'wells_per_sec': len(futures) / seconds if seconds > 0 else 0.0,
+        'mean_render_seconds': sum(render_times) / len(render_times) if render_times else None
+    }
+
+def staging_dir(output_dir):
+    """
+    Creates a private directory next to an output directory for one job to render into. Output directories
+    are shared by every run of the same plot, so a job only touches them once it has finished.
+
+    Args:
+        output_dir (str): The output directory the plots are published to.
+
+    Returns:
+        str: Path to the new staging directory.
+    """
+    parent = os.path.dirname(output_dir) or '.'
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{os.path.basename(output_dir)}.", suffix='.partial', dir=parent)
+
+def publish_staged(staging, output_dir):
+    """
+    Moves the files rendered in a staging directory into the output directory, replacing the files of earlier
+    runs with the same names and keeping the others, then removes the staging directory.
+
+    Args:
+        staging (str): The staging directory created by staging_dir.
+        output_dir (str): The output directory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(output_dir, name))
+    shutil.rmtree(staging, ignore_errors=True)
+
+def discard_staged(staging):
+    """
+    Removes a staging directory with everything rendered into it, e.g. when its job was cancelled.
+
+    Args:
+        staging (str): The staging directory created by staging_dir.
+    """
+    shutil.rmtree(staging, ignore_errors=True)
+
+def throughput_report(stats):
+    """
+    Describes the throughput of a rendering job.
+
+    Args:
+        stats (dict): Rendering statistics as returned by render_wells.
+
+    Returns:
+        str: A one-line report of the rendered wells and the wells/sec throughput.
+    """
+    report = (f"Rendered {stats['wells']} wells in {stats['seconds']:.2f}s "
+              f"({stats['wells_per_sec']:.1f} wells/sec on {stats['workers']} workers)")
+    if stats.get('mean_render_seconds') is not None:
+        report += f", {stats['mean_render_seconds'] * 1000:.0f} ms/well"
+    return report
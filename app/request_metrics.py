@@ -0,0 +1,72 @@
+# Itai Alcalai
+# request_metrics.py
+
+import threading
+import time
+from flask import jsonify, request
+
+# Number of requests served per client address and path since the server started
+_counts = {}
+_counts_lock = threading.Lock()
+_started = time.time()
+
+def _count_request():
+    """
+    Counts the current request against its client and path. Registered as a Flask before_request hook.
+    """
+    client = request.remote_addr or 'unknown'
+    with _counts_lock:
+        paths = _counts.setdefault(client, {})
+        paths[request.path] = paths.get(request.path, 0) + 1
+
+def request_stats():
+    """
+    Summarizes the request load of every client, e.g. the status polling callbacks that reach the
+    server through /_dash-update-component.
+
+    Returns:
+        dict: The server 'uptime_seconds' and, per client address, its total 'requests', its
+            'requests_per_minute' over the uptime and the request count of every 'paths'.
+    """
+    uptime_seconds = time.time() - _started
+    with _counts_lock:
+        counts = {client: dict(paths) for client, paths in _counts.items()}
+    return {
+        'uptime_seconds': round(uptime_seconds, 1),
+        'clients': {
+            client: {
+                'requests': sum(paths.values()),
+                'requests_per_minute': round(sum(paths.values()) * 60 / uptime_seconds, 1) if uptime_seconds > 0 else 0.0,
+                'paths': paths
+            }
+            for client, paths in counts.items()
+        }
+    }
+
+def reset_request_stats():
+    """
+    Forgets the counted requests and restarts the uptime, so a load measurement starts from zero.
+    """
+    global _started
+    with _counts_lock:
+        _counts.clear()
+        _started = time.time()
+
+def register_request_metrics(server):
+    """
+    Counts every request of the Flask server and serves the counts as JSON at /request-stats.
+    GET returns the counts; POST returns them and starts a new measurement. Only meant for the debug server,
+    as the counts expose the client addresses.
+
+    Args:
+        server (flask.Flask): The Flask server of the Dash app.
+    """
+    server.before_request(_count_request)
+
+    def serve_request_stats():
+        stats = request_stats()
+        if request.method == 'POST':
+            reset_request_stats()
+        return jsonify(stats)
+
+    server.add_url_rule('/request-stats', 'request_stats', serve_request_stats, methods=['GET', 'POST'])
@@ -0,0 +1,78 @@
+# Itai Alcalai
+# test_threshold_calibration.py
+
+import numpy as np
+import pytest
+from threshold_calibration import (MAX_FPR, FPR_STEP, adjust_threshold_for_fpr, adjust_threshold_for_fpr_histogram,
+                                   new_histogram, two_cluster_centers, update_histogram)
+
+def droplet_mixture(rng):
+    """
+    Draws the RFU values of a synthetic mixed positive control well: a negative and a positive droplet cloud.
+
+    Args:
+        rng (numpy.random.Generator): The random generator.
+
+    Returns:
+        numpy.ndarray: The RFU values.
+    """
+    negative_count = int(rng.integers(2000, 20000))
+    positive_count = int(rng.integers(50, 5000))
+    negative = rng.normal(rng.uniform(500, 2000), rng.uniform(50, 200), negative_count)
+    positive = rng.normal(rng.uniform(4000, 9000), rng.uniform(100, 600), positive_count)
+    return rng.permutation(np.concatenate([negative, positive]))
+
+def adjust_threshold_for_fpr_loop(threshold, nc_values):
+    """
+    The original threshold adjustment, raising the threshold one FPR_STEP at a time and rescanning the values.
+
+    Args:
+        threshold (float): The threshold to validate.
+        nc_values (numpy.ndarray): RFU values of the negative control well.
+
+    Returns:
+        float: The adjusted threshold.
+    """
+    nc_false_positives = np.sum(nc_values >= threshold) / len(nc_values)
+    while nc_false_positives > MAX_FPR:
+        threshold += FPR_STEP
+        nc_false_positives = np.sum(nc_values >= threshold) / len(nc_values)
+    return threshold
+
+def test_two_cluster_centers_match_kmeans():
+    KMeans = pytest.importorskip('sklearn.cluster').KMeans
+    rng = np.random.default_rng(4)
+    for _ in range(50):
+        values = droplet_mixture(rng)
+        kmeans = KMeans(n_clusters=2, n_init=10, random_state=0).fit(values.reshape(-1, 1))
+        expected = sorted(kmeans.cluster_centers_.flatten())
+        assert two_cluster_centers(values) == pytest.approx(expected, rel=1e-9)
+
+def test_two_cluster_centers_with_weights_match_repeated_values():
+    rng = np.random.default_rng(5)
+    values = np.round(droplet_mixture(rng), 1)
+    unique_values, counts = np.unique(values, return_counts=True)
+    assert two_cluster_centers(unique_values, counts) == pytest.approx(two_cluster_centers(values), rel=1e-9)
+
+def test_adjust_threshold_for_fpr_matches_step_loop():
+    rng = np.random.default_rng(6)
+    for _ in range(300):
+        nc_values = rng.normal(rng.uniform(500, 2000), rng.uniform(5, 200), int(rng.integers(1, 5000)))
+        # Start close to the top of the negative cloud, so the step loop stays short
+        threshold = float(rng.uniform(np.sort(nc_values)[-3:][0] - 20, nc_values.max() + 5))
+        assert adjust_threshold_for_fpr(threshold, nc_values) == pytest.approx(
+            adjust_threshold_for_fpr_loop(threshold, nc_values), abs=1e-6)
+
+def test_histogram_fpr_adjustment_is_within_one_bin_of_exact():
+    rng = np.random.default_rng(7)
+    for resolution in (0.01, 0.1, 1.0):
+        for _ in range(50):
+            # Some negative clouds reach past the histogram range into the overflow bin
+            nc_values = rng.normal(rng.uniform(50, 900), rng.uniform(5, 100), int(rng.integers(1, 5000)))
+            threshold = float(rng.uniform(np.sort(nc_values)[-3:][0] - 20, nc_values.max() + 5))
+            histogram = new_histogram(resolution)
+            update_histogram(histogram, nc_values)
+            adjusted = adjust_threshold_for_fpr_histogram(threshold, histogram)
+            exact = adjust_threshold_for_fpr(threshold, nc_values)
+            assert np.sum(nc_values >= adjusted) <= MAX_FPR * len(nc_values)
+            assert exact - 1e-6 <= adjusted <= exact + resolution + FPR_STEP + 1e-6
@@ -1,25 +1,96 @@
 # Itai Alcalai
 # threshold_calibration.py
 
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from sklearn.cluster import KMeans
 import pandas as pd
-from utils import default_well_matrix
+from utils import default_well_matrix, get_color
+from ingest import has_sep_line, is_probe_file
+import parse_cache
+import well_index
+import calibration_cache
 
-def get_calibrated_threshold(file, names, ds):
+# Version of the calibration algorithm, part of the calibration cache key.
+# Bump it whenever a change to the algorithm can change the calibrated thresholds.
+CALIBRATION_VERSION = '4'
+
+# Maximum false positive rate (0.01%) allowed in the negative control well
+MAX_FPR = 0.0001
+# Step by which the threshold is raised until the false positive rate is acceptable
+FPR_STEP = 0.01
+
+# Calibration modes: 'exact' keeps every control well RFU in memory, 'histogram' streams the
+# file once into fixed-resolution histograms and uses constant memory
+CALIBRATION_MODES = ('exact', 'histogram')
+# Default bin width (RFU) of the streaming histograms. The histogram mode matches the exact mode
+# within this tolerance plus one FPR_STEP.
+HISTOGRAM_RESOLUTION = 0.01
+# RFU range covered by the histogram bins; values outside it are counted in one underflow and one overflow bin
+HISTOGRAM_RANGE = (0.0, 1000.0)
+# Number of rows fed to the streaming histograms at a time, whatever the source of the RFU values
+HISTOGRAM_CHUNK_ROWS = 10000
+
+def get_calibrated_threshold(file, names, ds, columns=None, mode='exact', resolution=HISTOGRAM_RESOLUTION):
     """
     Calibrates the threshold based on positive, mixed positive, and negative control wells.
+    Thresholds are cached on disk by file content and control wells, so repeat calibrations are instant.
 
     Args:
         file (str): Path to the data file.
         names (dict): Dictionary of well names.
         ds (dict): Dictionary containing control well names.
+        columns (dict, optional): Column arrays of the file already loaded by parse_cache.load_columns.
+            When given, the control wells are taken from them instead of re-reading the file.
+        mode (str, optional): Calibration mode, one of CALIBRATION_MODES. Default is 'exact'.
+        resolution (float, optional): Histogram bin width in RFU, used by the 'histogram' mode.
+            Default is HISTOGRAM_RESOLUTION.
 
     Returns:
         float: The calibrated threshold value.
     """
-    threshold = None
+    chosen_well_names = get_control_well_names(names, ds)
+
+    # Serve the threshold from the cache if this file and these control wells were calibrated before
+    cache_key = calibration_cache.calibration_key(file, chosen_well_names, _cache_version(mode, resolution))
+    threshold = calibration_cache.lookup(cache_key)
+    if threshold is not None:
+        return threshold
+
+    threshold = compute_calibrated_threshold(file, chosen_well_names, columns, mode, resolution)
+    calibration_cache.store(cache_key, threshold)
+
+    return threshold
+
+def _cache_version(mode, resolution=HISTOGRAM_RESOLUTION):
+    """
+    Builds the algorithm version part of the calibration cache key for a calibration mode.
+
+    Args:
+        mode (str): Calibration mode, one of CALIBRATION_MODES.
+        resolution (float, optional): Histogram bin width in RFU. Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        str: The version string.
+    """
+    if mode not in CALIBRATION_MODES:
+        raise ValueError(f"Unknown calibration mode {mode}.")
+    if mode == 'histogram':
+        return f"{CALIBRATION_VERSION}-histogram-{resolution}-{HISTOGRAM_RANGE[0]}-{HISTOGRAM_RANGE[1]}"
+    return CALIBRATION_VERSION
 
+def get_control_well_names(names, ds):
+    """
+    Extracts the control well names and validates them against the provided well names.
+
+    Args:
+        names (dict): Dictionary of well names.
+        ds (dict): Dictionary containing control well names.
+
+    Returns:
+        list: The positive, mixed positive and negative control well names.
+    """
     # Extracting control well names from the dictionary
     pc = ds.get('positive')
     mixpc = ds.get('mix_positive')
@@ -33,14 +104,115 @@ def get_calibrated_threshold(file, names, ds):
     if nc not in names:
         raise ValueError(f"Well name {nc} is not in the list of provided well names.")
 
-    chosen_well_names = [pc, mixpc, nc]
+    return [pc, mixpc, nc]
 
-    # Extract RFU values for the chosen wells
-    data = extract_rfu_values(file, chosen_well_names)
+def compute_calibrated_threshold(file, chosen_well_names, columns=None, mode='exact', resolution=HISTOGRAM_RESOLUTION):
+    """
+    Calibrates the threshold of a file from its control wells, without going through the cache.
+
+    Args:
+        file (str): Path to the data file.
+        chosen_well_names (list): The positive, mixed positive and negative control well names.
+        columns (dict, optional): Column arrays of the file already loaded by parse_cache.load_columns.
+        mode (str, optional): Calibration mode, one of CALIBRATION_MODES. Default is 'exact'.
+        resolution (float, optional): Histogram bin width in RFU, used by the 'histogram' mode.
+            Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        float: The calibrated threshold value.
+    """
+    if mode == 'histogram':
+        # Files already in the parse cache are memory-mapped, and indexed files can be read
+        # well by well, so neither needs to be streamed as text. Every source is fed to the
+        # histograms in slices of HISTOGRAM_CHUNK_ROWS rows.
+        if columns is None and parse_cache.is_cached(file):
+            columns = parse_cache.load_columns(file)
+        if columns is not None:
+            histograms = column_control_histograms(columns, chosen_well_names, resolution)
+        else:
+            histograms = indexed_control_histograms(file, chosen_well_names, resolution)
+            if histograms is None:
+                histograms = stream_control_histograms(file, chosen_well_names, resolution)
+        return calibrate_threshold_from_histograms(histograms, chosen_well_names)
+
+    # Extract RFU values for the chosen wells, reusing the parsed columns when available
+    if columns is not None:
+        data = select_rfu_values(columns, chosen_well_names)
+    else:
+        data = extract_rfu_values(file, chosen_well_names)
     # Calibrate the threshold based on the extracted data
-    threshold = calibrate_threshold(data, chosen_well_names)
+    return calibrate_threshold(data, chosen_well_names)
 
-    return threshold
+def _timed_calibration(file, chosen_well_names, mode, resolution):
+    """
+    Calibrates one file and measures how long it took. Runs inside the batch calibration process pool.
+
+    Args:
+        file (str): Path to the data file.
+        chosen_well_names (list): The positive, mixed positive and negative control well names.
+        mode (str): Calibration mode, one of CALIBRATION_MODES.
+        resolution (float): Histogram bin width in RFU, used by the 'histogram' mode.
+
+    Returns:
+        tuple: The calibrated threshold (None on failure), the elapsed seconds and the error message (None on success).
+    """
+    start = time.perf_counter()
+    try:
+        threshold = compute_calibrated_threshold(file, chosen_well_names, mode=mode, resolution=resolution)
+        return threshold, time.perf_counter() - start, None
+    except Exception as e:
+        return None, time.perf_counter() - start, str(e)
+
+def calibrate_directory(directory, names, ds, max_workers=None, mode='exact', resolution=HISTOGRAM_RESOLUTION):
+    """
+    Calibrates every probe file of a directory in parallel on a process pool. Files that are not probe
+    CSVs are skipped. Cached thresholds are served directly; only the remaining files are sent to the pool.
+
+    Args:
+        directory (str): Directory holding one data file per probe.
+        names (dict): Dictionary of well names.
+        ds (dict): Dictionary containing control well names.
+        max_workers (int, optional): Number of worker processes. Defaults to one per file, up to the CPU count.
+        mode (str, optional): Calibration mode, one of CALIBRATION_MODES. Default is 'exact'.
+        resolution (float, optional): Histogram bin width in RFU, used by the 'histogram' mode.
+            Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        list: One dictionary per file with its 'probe', 'file', 'threshold', 'seconds', 'cached' and 'error'.
+    """
+    chosen_well_names = get_control_well_names(names, ds)
+    files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if is_probe_file(os.path.join(directory, name)))
+
+    results = []
+    pending = []
+    for file in files:
+        result = {'probe': os.path.basename(file), 'file': os.path.basename(file), 'threshold': None,
+                  'seconds': 0.0, 'cached': False, 'error': None}
+        results.append(result)
+        # A file named without its probe color is reported instead of failing the whole batch
+        try:
+            result['probe'] = get_color(file)
+        except ValueError as e:
+            result['error'] = str(e)
+            continue
+        cache_key = calibration_cache.calibration_key(file, chosen_well_names, _cache_version(mode, resolution))
+        result['threshold'] = calibration_cache.lookup(cache_key)
+        if result['threshold'] is not None:
+            result['cached'] = True
+        else:
+            pending.append((file, cache_key, result))
+
+    if pending:
+        workers = max_workers or min(len(pending), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_timed_calibration, file, chosen_well_names, mode, resolution) for file, _, _ in pending]
+            # The cache is only written from this process, so workers never race on the cache file
+            for (file, cache_key, result), future in zip(pending, futures):
+                result['threshold'], result['seconds'], result['error'] = future.result()
+                if result['error'] is None:
+                    calibration_cache.store(cache_key, result['threshold'])
+    return results
 
 def extract_rfu_values(file_path, chosen_wells):
     """
@@ -51,22 +223,65 @@ def extract_rfu_values(file_path, chosen_wells):
         chosen_wells (list): List of chosen well names.
 
     Returns:
-        dict: Dictionary with well names as keys and lists of RFU values as values.
+        dict: Dictionary with well names as keys and arrays of RFU values as values.
     """
-    with open(file_path, 'r') as file:
-        first_line = file.readline().strip()
-        skip_first_line = 'sep=' in first_line
+    # Without a parse cache entry, seek straight to the control wells through the well index
+    if not parse_cache.is_cached(file_path):
+        well_data = _indexed_rfu_values(file_path, chosen_wells)
+        if well_data is not None:
+            return well_data
+    return select_rfu_values(parse_cache.load_columns(file_path), chosen_wells)
 
-    # Read the CSV file in chunks to handle large file sizes
-    reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0, chunksize=10000)
-    well_data = {well: [] for well in chosen_wells}
-    
-    # Iterate through each chunk to extract RFU values for the chosen wells
-    for chunk in reader:
-        for index, row in chunk.iterrows():
-            well = row.iloc[0]
-            if well in chosen_wells and 'RFU' in row and pd.notna(row['RFU']):
-                well_data[well].append(row['RFU'])
+def _indexed_rfu_values(file_path, chosen_wells):
+    """
+    Reads the RFU values of the chosen wells through the file's well index, without touching other wells.
+
+    Args:
+        file_path (str): Path to the data file.
+        chosen_wells (list): List of chosen well names.
+
+    Returns:
+        dict: Dictionary with well names as keys and arrays of RFU values as values, or None if the file has no index.
+    """
+    blocks = well_index.read_well_blocks(file_path, chosen_wells)
+    if blocks is None:
+        return None
+    well_blocks = {well: [] for well in chosen_wells}
+    for well, _, rfus in blocks:
+        well_blocks[well].append(rfus)
+    return {well: _cache_precision(np.concatenate(parts) if parts else np.empty(0)) for well, parts in well_blocks.items()}
+
+def _cache_precision(rfus):
+    """
+    Rounds RFU values parsed from text to the float32 precision the parse cache stores, so a calibration
+    gives the same threshold whichever source its values came from (all sources share one cache key).
+
+    Args:
+        rfus (numpy.ndarray): RFU values.
+
+    Returns:
+        numpy.ndarray: The rounded values, in double precision.
+    """
+    return np.asarray(rfus, dtype=np.float32).astype(np.float64)
+
+def select_rfu_values(columns, chosen_wells):
+    """
+    Selects the valid RFU values of the chosen wells from already parsed column arrays.
+
+    Args:
+        columns (dict): Column arrays as returned by parse_cache.load_columns.
+        chosen_wells (list): List of chosen well names.
+
+    Returns:
+        dict: Dictionary with well names as keys and arrays of RFU values as values.
+    """
+    well_codes = {well: code for code, well in enumerate(columns['wells'])}
+    well_data = {}
+    for well in chosen_wells:
+        # Collect every row of the well, even if its rows are not contiguous in the file
+        rfus = columns['rfu'][columns['well_codes'] == well_codes.get(well, -2)]
+        # Compute the statistics in double precision even though the cache stores float32
+        well_data[well] = rfus[~np.isnan(rfus)].astype(np.float64)
     return well_data
 
 def calibrate_threshold(data, well_names):
@@ -91,17 +306,291 @@ def calibrate_threshold(data, well_names):
     initial_threshold = pc_mean + 2 * pc_std
     
     # Refine threshold using mixed positive control
-    kmeans = KMeans(n_clusters=2)
-    kmeans.fit(mixpc_values.reshape(-1, 1))
-    clusters = sorted(kmeans.cluster_centers_.flatten())
+    clusters = two_cluster_centers(mixpc_values)
     refined_threshold = max(initial_threshold, clusters[1])  # Ensure threshold is not lowered
     
-    # Validate threshold with negative control
-    nc_false_positives = np.sum(nc_values >= refined_threshold) / len(nc_values)
-    
-    # Adjust threshold if the false positive rate (FPR) is greater than 0.01%
-    while nc_false_positives > 0.0001:
-        refined_threshold += 0.01  # Incrementally increase threshold
-        nc_false_positives = np.sum(nc_values >= refined_threshold) / len(nc_values)
-    
-    return refined_threshold
+    # Validate threshold with negative control, raising it until the FPR is acceptable
+    return adjust_threshold_for_fpr(refined_threshold, nc_values)
+
+def two_cluster_centers(values, weights=None):
+    """
+    Splits one-dimensional data into two clusters with the minimal within-cluster sum of squares,
+    which is the optimum KMeans(n_clusters=2) searches for. In one dimension the optimal clusters
+    are contiguous in sorted order, so every split point is scored with prefix sums after a single sort.
+
+    Args:
+        values (numpy.ndarray): The values to cluster.
+        weights (numpy.ndarray, optional): Weight of every value, e.g. histogram bin counts. Default is 1 for all.
+
+    Returns:
+        tuple: The lower and the upper cluster centers.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        raise ValueError("Cannot cluster an empty set of values.")
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    sorted_weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)[order]
+    prefix_weights = np.cumsum(sorted_weights)
+    total_weight = prefix_weights[-1]
+
+    # Center the data so that the prefix sums keep their precision
+    mean = np.dot(sorted_weights, sorted_values) / total_weight
+    centered = sorted_values - mean
+    # Candidate splits lie between distinct consecutive values; left cluster is [0, split]
+    splits = np.flatnonzero(sorted_values[1:] > sorted_values[:-1])
+    if not len(splits):
+        return mean, mean
+    prefix_sums = np.cumsum(sorted_weights * centered)
+    left_weights = prefix_weights[splits]
+    right_weights = total_weight - left_weights
+    left_sums = prefix_sums[splits]
+    right_sums = prefix_sums[-1] - left_sums
+    # Minimizing the within-cluster sum of squares maximizes the between-cluster sum of squares
+    between = left_sums ** 2 / left_weights + right_sums ** 2 / right_weights
+    best = np.argmax(between)
+    low_center = left_sums[best] / left_weights[best] + mean
+    high_center = right_sums[best] / right_weights[best] + mean
+    return low_center, high_center
+
+def adjust_threshold_for_fpr(threshold, nc_values):
+    """
+    Raises the threshold in FPR_STEP increments until the false positive rate (FPR) of the
+    negative control is at most MAX_FPR. The number of increments is computed directly from
+    the sorted negative control values instead of rescanning the array for every step.
+
+    Args:
+        threshold (float): The threshold to validate.
+        nc_values (numpy.ndarray): RFU values of the negative control well.
+
+    Returns:
+        float: The smallest threshold on the FPR_STEP grid above the given one with an acceptable FPR.
+    """
+    sorted_nc = np.sort(nc_values)
+    count = len(sorted_nc)
+    if count == 0:
+        return threshold
+
+    def false_positive_rate(value):
+        # Fraction of negative control values at or above the value
+        return (count - np.searchsorted(sorted_nc, value, side='left')) / count
+
+    if false_positive_rate(threshold) <= MAX_FPR:
+        return threshold
+
+    # The threshold must end up above the largest negative value that cannot be tolerated
+    allowed = _allowed_false_positives(count)
+    boundary = sorted_nc[count - allowed - 1]
+    steps = max(1, int(np.floor((boundary - threshold) / FPR_STEP)) + 1)
+
+    # Correct for floating point rounding around the boundary
+    while steps > 1 and false_positive_rate(threshold + (steps - 1) * FPR_STEP) <= MAX_FPR:
+        steps -= 1
+    while false_positive_rate(threshold + steps * FPR_STEP) > MAX_FPR:
+        steps += 1
+    return threshold + steps * FPR_STEP
+
+def _allowed_false_positives(count):
+    """
+    Computes how many negative control values may lie at or above the threshold.
+
+    Args:
+        count (int): Number of negative control values.
+
+    Returns:
+        int: The largest number of false positives with a false positive rate of at most MAX_FPR.
+    """
+    allowed = int(MAX_FPR * count)
+    while allowed > 0 and allowed / count > MAX_FPR:
+        allowed -= 1
+    return allowed
+
+def new_histogram(resolution=HISTOGRAM_RESOLUTION):
+    """
+    Creates an empty streaming histogram: a fixed array of bin counts over HISTOGRAM_RANGE, plus one
+    underflow and one overflow bin. Its memory depends only on the range and resolution, not on the number of values.
+
+    Args:
+        resolution (float, optional): Bin width in RFU. Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        dict: Histogram with the bin 'counts' (underflow first, overflow last), its 'resolution' and 'low' edge,
+            the running 'count', 'sum' and 'sum_sq' of the values, the sums of the values in the underflow and
+            overflow bins and the largest value.
+    """
+    low, high = HISTOGRAM_RANGE
+    bin_count = int(np.ceil((high - low) / resolution))
+    return {'counts': np.zeros(bin_count + 2, dtype=np.int64), 'resolution': resolution, 'low': low,
+            'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'underflow_sum': 0.0, 'overflow_sum': 0.0, 'max': -np.inf}
+
+def update_histogram(histogram, values):
+    """
+    Adds values to a streaming histogram.
+
+    Args:
+        histogram (dict): Histogram created by new_histogram.
+        values (numpy.ndarray): RFU values to add.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return
+    counts = histogram['counts']
+    histogram['count'] += len(values)
+    histogram['sum'] += values.sum()
+    histogram['sum_sq'] += np.dot(values, values)
+    histogram['max'] = max(histogram['max'], values.max())
+    # Bin 0 holds the values below the range and the last bin the values above it
+    bins = np.clip(np.floor((values - histogram['low']) / histogram['resolution']) + 1, 0, len(counts) - 1).astype(np.int64)
+    histogram['underflow_sum'] += values[bins == 0].sum()
+    histogram['overflow_sum'] += values[bins == len(counts) - 1].sum()
+    counts += np.bincount(bins, minlength=len(counts))
+
+def stream_control_histograms(file_path, chosen_wells, resolution=HISTOGRAM_RESOLUTION):
+    """
+    Builds a streaming histogram of the RFU values of every chosen well in a single pass over the file.
+
+    Args:
+        file_path (str): Path to the data file.
+        chosen_wells (list): List of chosen well names.
+        resolution (float, optional): Bin width in RFU. Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        dict: Dictionary with well names as keys and histograms as values.
+    """
+    histograms = {well: new_histogram(resolution) for well in chosen_wells}
+    # Read the CSV file in chunks so only one chunk is held in memory at a time
+    reader = pd.read_csv(file_path, delimiter=',', skiprows=1 if has_sep_line(file_path) else 0,
+                         usecols=lambda column: column in ('Well', 'RFU'), chunksize=HISTOGRAM_CHUNK_ROWS)
+    for chunk in reader:
+        chunk = chunk[chunk['Well'].isin(histograms) & chunk['RFU'].notna()]
+        for well, rfus in chunk.groupby('Well')['RFU']:
+            update_histogram(histograms[well], _cache_precision(rfus.to_numpy()))
+    return histograms
+
+def column_control_histograms(columns, chosen_wells, resolution=HISTOGRAM_RESOLUTION):
+    """
+    Builds a streaming histogram of the RFU values of every chosen well from already parsed column arrays.
+    The arrays are walked in slices of HISTOGRAM_CHUNK_ROWS rows, so memory-mapped columns are never copied whole.
+
+    Args:
+        columns (dict): Column arrays as returned by parse_cache.load_columns.
+        chosen_wells (list): List of chosen well names.
+        resolution (float, optional): Bin width in RFU. Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        dict: Dictionary with well names as keys and histograms as values.
+    """
+    histograms = {well: new_histogram(resolution) for well in chosen_wells}
+    well_codes = {well: code for code, well in enumerate(columns['wells'])}
+    chosen_codes = {well: well_codes.get(well, -2) for well in chosen_wells}
+    for start in range(0, len(columns['rfu']), HISTOGRAM_CHUNK_ROWS):
+        codes = np.asarray(columns['well_codes'][start:start + HISTOGRAM_CHUNK_ROWS])
+        rfus = np.asarray(columns['rfu'][start:start + HISTOGRAM_CHUNK_ROWS])
+        for well, code in chosen_codes.items():
+            well_rfus = rfus[codes == code]
+            update_histogram(histograms[well], well_rfus[~np.isnan(well_rfus)])
+    return histograms
+
+def indexed_control_histograms(file_path, chosen_wells, resolution=HISTOGRAM_RESOLUTION):
+    """
+    Builds a streaming histogram of the RFU values of every chosen well through the file's well index,
+    parsing only the blocks of the chosen wells, HISTOGRAM_CHUNK_ROWS rows at a time.
+
+    Args:
+        file_path (str): Path to the data file.
+        chosen_wells (list): List of chosen well names.
+        resolution (float, optional): Bin width in RFU. Default is HISTOGRAM_RESOLUTION.
+
+    Returns:
+        dict: Dictionary with well names as keys and histograms as values, or None if the file has no index.
+    """
+    blocks = well_index.read_well_blocks(file_path, chosen_wells, chunk_rows=HISTOGRAM_CHUNK_ROWS)
+    if blocks is None:
+        return None
+    histograms = {well: new_histogram(resolution) for well in chosen_wells}
+    for well, _, rfus in blocks:
+        update_histogram(histograms[well], _cache_precision(rfus))
+    return histograms
+
+def _histogram_points(histogram):
+    """
+    Gets the weighted points a histogram stands for: the center of every non-empty bin, and the mean of
+    the values that fell below or above the range.
+
+    Args:
+        histogram (dict): Histogram created by new_histogram.
+
+    Returns:
+        tuple: The point values and their counts.
+    """
+    counts = histogram['counts']
+    centers = histogram['low'] + (np.arange(len(counts)) - 0.5) * histogram['resolution']
+    if counts[0]:
+        centers[0] = histogram['underflow_sum'] / counts[0]
+    if counts[-1]:
+        centers[-1] = histogram['overflow_sum'] / counts[-1]
+    filled = counts > 0
+    return centers[filled], counts[filled].astype(np.float64)
+
+def calibrate_threshold_from_histograms(histograms, well_names):
+    """
+    Calibrates the threshold like calibrate_threshold, using the streaming histograms of the control wells.
+
+    Args:
+        histograms (dict): Dictionary with well names as keys and histograms as values.
+        well_names (list): List of control well names.
+
+    Returns:
+        float: The refined threshold value.
+    """
+    for well in well_names:
+        if not histograms[well]['count']:
+            raise ValueError(f"No RFU values found for control well {well}.")
+    pc_histogram = histograms[well_names[0]]
+    mixpc_histogram = histograms[well_names[1]]
+    nc_histogram = histograms[well_names[2]]
+
+    # Initial threshold based on positive control, from the running moments
+    pc_mean = pc_histogram['sum'] / pc_histogram['count']
+    pc_std = np.sqrt(max(pc_histogram['sum_sq'] / pc_histogram['count'] - pc_mean ** 2, 0.0))
+    initial_threshold = pc_mean + 2 * pc_std
+
+    # Refine threshold using mixed positive control, clustering the bin centers weighted by their counts
+    clusters = two_cluster_centers(*_histogram_points(mixpc_histogram))
+    refined_threshold = max(initial_threshold, clusters[1])  # Ensure threshold is not lowered
+
+    # Validate threshold with negative control, raising it until the FPR is acceptable
+    return adjust_threshold_for_fpr_histogram(refined_threshold, nc_histogram)
+
+def adjust_threshold_for_fpr_histogram(threshold, nc_histogram):
+    """
+    Raises the threshold in FPR_STEP increments until the false positive rate of the negative control
+    histogram is at most MAX_FPR. Every value is assumed to sit at the upper edge of its bin (the largest
+    value for the overflow bin), so the FPR limit always holds and the result is at most one bin width plus
+    one step above the exact one.
+
+    Args:
+        threshold (float): The threshold to validate.
+        nc_histogram (dict): Histogram of the negative control well.
+
+    Returns:
+        float: The adjusted threshold.
+    """
+    count = nc_histogram['count']
+    allowed = _allowed_false_positives(count)
+    if allowed >= count:
+        return threshold
+
+    # Find the bin holding the largest negative value that cannot be tolerated
+    counts = nc_histogram['counts']
+    counts_from_top = np.cumsum(counts[::-1])
+    boundary_bin = len(counts) - 1 - np.searchsorted(counts_from_top, allowed + 1)
+    if boundary_bin == len(counts) - 1:
+        # Values above the range are only bounded by the largest one, which the threshold must exceed
+        upper_edge = np.nextafter(nc_histogram['max'], np.inf)
+    else:
+        upper_edge = nc_histogram['low'] + boundary_bin * nc_histogram['resolution']
+    if upper_edge <= threshold:
+        return threshold
+    steps = int(np.ceil((upper_edge - threshold) / FPR_STEP))
+    return threshold + steps * FPR_STEP
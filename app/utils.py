@@ -1,6 +1,14 @@
 # Itai Alcalai
 # utils.py
 
+import hashlib
+import os
+import threading
+
+# Digests already computed, keyed by (path, size, modification time)
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
 # Default well matrix used for creating well name dictionary
 default_well_matrix = [
     ["A1", "A2", "A3"],
@@ -40,6 +48,9 @@ def get_color(file_path: str) -> str:
 
     Returns:
         str: The extracted color code.
+
+    Raises:
+        ValueError: If the file name has fewer than three underscores before the color code.
     """
     # Remove all characters from the right to the last '\'
     last_slash_index = file_path.rfind('\\')
@@ -62,8 +73,36 @@ def get_color(file_path: str) -> str:
     i = 3
     while i > 0:
         next_underscore_index = file_path.find('_')
-        if next_underscore_index != -1:
-            file_path = file_path[next_underscore_index + 1:]
-            i -= 1
+        if next_underscore_index == -1:
+            raise ValueError(f"Cannot find the probe color in file name {file_path}: expected <plate>_<run>_<id>_<color>_...")
+        file_path = file_path[next_underscore_index + 1:]
+        i -= 1
 
     return file_path
+
+def file_digest(file_path):
+    """
+    Computes the SHA-256 digest of a file's content. The digest is remembered for as long
+    as the file keeps the same size and modification time, so repeated calls are free.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: The hexadecimal digest of the file content.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if memo_key in _digest_memo:
+            return _digest_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    hex_digest = digest.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[memo_key] = hex_digest
+    return hex_digest
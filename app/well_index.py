@@ -0,0 +1,219 @@
+# Itai Alcalai
+# well_index.py
+
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from utils import file_digest
+from ingest import has_sep_line, well_boundaries
+
+# Directory holding the well block index of every uploaded probe file, shared by all the session workspaces
+WELL_INDEX_DIR = 'well_index'
+# Version of the index layout, bumped whenever the stored fields change
+WELL_INDEX_FORMAT = 1
+# Size of the blocks read while scanning a file for line offsets
+_SCAN_BLOCK_SIZE = 1 << 24
+
+def _index_path(file_path):
+    """
+    Gets the path of a file's index, keyed by the hash of its content.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        str: Path of the index file.
+    """
+    return os.path.join(WELL_INDEX_DIR, f"{file_digest(file_path)}.json")
+
+def _line_offsets(file_path):
+    """
+    Finds the byte offset where every line of a file starts.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        tuple: Array with the start offset of every line and the size of the file.
+    """
+    newlines = []
+    position = 0
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(_SCAN_BLOCK_SIZE), b''):
+            newlines.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')) + position)
+            position += len(block)
+    starts = np.concatenate([[0]] + [found + 1 for found in newlines])
+    # A trailing newline does not start another line
+    return starts[starts < position], position
+
+def build_well_index(file_path):
+    """
+    Builds the index of a probe file: the byte offset, byte length, row count and threshold of every
+    contiguous well block. Readers use it to seek straight to the wells they need.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        dict: The index, or None if the file layout cannot be indexed (e.g. it contains blank lines).
+    """
+    skip_first_line = has_sep_line(file_path)
+    frame = pd.read_csv(file_path, delimiter=',', skiprows=1 if skip_first_line else 0,
+                        usecols=lambda column: column in ['Well', 'Threshold'],
+                        dtype={'Well': 'category', 'Threshold': 'float64'})
+    line_starts, file_size = _line_offsets(file_path)
+    header_lines = 2 if skip_first_line else 1
+    # Every data row must be exactly one line for the offsets to line up with the parsed rows
+    if len(line_starts) != len(frame) + header_lines:
+        return None
+
+    well_codes = frame['Well'].cat.codes.to_numpy()
+    wells = frame['Well'].cat.categories
+    block_starts, block_stops = well_boundaries(well_codes)
+    row_offsets = np.append(line_starts[header_lines:], file_size)
+    thresholds = frame['Threshold'].to_numpy() if 'Threshold' in frame.columns else np.full(len(frame), np.nan)
+
+    blocks = []
+    for start, stop in zip(block_starts, block_stops):
+        code = well_codes[start]
+        if code < 0:
+            continue
+        blocks.append({
+            'well': str(wells[code]),
+            'offset': int(row_offsets[start]),
+            'length': int(row_offsets[stop] - row_offsets[start]),
+            'rows': int(stop - start),
+            'threshold': None if np.isnan(thresholds[start]) else float(thresholds[start])
+        })
+    index = {
+        'format': WELL_INDEX_FORMAT,
+        'header_offset': int(line_starts[header_lines - 1]),
+        'header_length': int(line_starts[header_lines] - line_starts[header_lines - 1]) if len(frame) else 0,
+        'blocks': blocks
+    }
+
+    os.makedirs(WELL_INDEX_DIR, exist_ok=True)
+    index_path = _index_path(file_path)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(temp_path, index_path)
+    return index
+
+def load_well_index(file_path):
+    """
+    Loads the index of a probe file.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        dict: The index, or None if the file has not been indexed.
+    """
+    index_path = _index_path(file_path)
+    try:
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        # Mark the index as used now, for the least recently used eviction of workspace.py
+        os.utime(index_path)
+    except (OSError, ValueError):
+        return None
+    return index if index.get('format') == WELL_INDEX_FORMAT else None
+
+class _BlockReader(io.RawIOBase):
+    """
+    Read-only stream over one well block behind the file's header line, so pandas can parse the block
+    in chunks without the whole block being read into memory.
+    """
+
+    def __init__(self, file, header, offset, length):
+        self._file = file
+        self._header = header
+        self._offset = offset
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Serve the header line first, then the block's bytes up to its length
+        if self._header:
+            count = min(len(buffer), len(self._header))
+            buffer[:count] = self._header[:count]
+            self._header = self._header[count:]
+            return count
+        if self._remaining <= 0:
+            return 0
+        self._file.seek(self._offset)
+        data = self._file.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._offset += len(data)
+        self._remaining -= len(data)
+        return len(data)
+
+def _block_frames(file, header, block, chunk_rows=None):
+    """
+    Parses the RFU column of one well block, in one frame or in frames of chunk_rows rows.
+
+    Args:
+        file (file): The data file, opened in binary mode.
+        header (bytes): The file's header line.
+        block (dict): The block entry of the index.
+        chunk_rows (int, optional): Number of rows per frame. Default is the whole block in one frame.
+
+    Returns:
+        iterable: The parsed frames.
+    """
+    stream = io.BufferedReader(_BlockReader(file, header, block['offset'], block['length']))
+    frames = pd.read_csv(stream, delimiter=',', usecols=lambda column: column == 'RFU', dtype={'RFU': 'float64'},
+                         chunksize=chunk_rows)
+    return frames if chunk_rows else [frames]
+
+def read_well_blocks(file_path, wells, index=None, chunk_rows=None):
+    """
+    Reads only the blocks of the chosen wells, seeking to their byte offsets instead of scanning the file.
+
+    Args:
+        file_path (str): Path to the data file.
+        wells (list): Well names to read.
+        index (dict, optional): The file's index. Loaded from disk if not given.
+        chunk_rows (int, optional): Split every block into parts of at most this many rows, so that only
+            one part is held in memory at a time when the result is consumed lazily. Default is one part per block.
+
+    Returns:
+        iterable: Tuples of the well label, the block threshold and the valid RFU values of every matching
+            block (or block part), in file order (the same shape as ingest.iter_wells). A list, or a generator
+            when chunk_rows is given. None if the file has not been indexed.
+    """
+    index = index or load_well_index(file_path)
+    if index is None:
+        return None
+    blocks = _iter_well_blocks(file_path, set(wells), index, chunk_rows)
+    return blocks if chunk_rows else list(blocks)
+
+def _iter_well_blocks(file_path, wanted, index, chunk_rows):
+    """
+    Generates the blocks (or block parts) of the wanted wells for read_well_blocks.
+
+    Args:
+        file_path (str): Path to the data file.
+        wanted (set): Well names to read.
+        index (dict): The file's index.
+        chunk_rows (int): Number of rows per part, or None for whole blocks.
+
+    Yields:
+        tuple: The well label, the block threshold and the valid RFU values.
+    """
+    with open(file_path, 'rb') as file:
+        file.seek(index['header_offset'])
+        header = file.read(index['header_length'])
+        for block in index['blocks']:
+            if block['well'] not in wanted:
+                continue
+            threshold = np.nan if block['threshold'] is None else block['threshold']
+            # Parse the block on its own, behind the file's header line
+            for frame in _block_frames(file, header, block, chunk_rows):
+                rfus = frame['RFU'].to_numpy() if 'RFU' in frame.columns else np.empty(0)
+                yield block['well'], threshold, rfus[~np.isnan(rfus)]
@@ -0,0 +1,251 @@
+# Itai Alcalai
+# workspace.py
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import calibration_cache
+import parse_cache
+import well_index
+from job_scheduler import list_jobs
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one workspace per session, each with its own input and output directories
+WORKSPACES_DIR = 'workspaces'
+# Disk space the workspaces and the shared parse cache, well index and calibration cache may use together;
+# above it the least recently used workspaces and cache entries are evicted
+WORKSPACE_DISK_LIMIT_BYTES = 5 * 1024 ** 3
+
+# Measured size of every workspace and cache entry by path, so unchanged entries are not walked again
+_measured = {}
+_measured_lock = threading.Lock()
+
+def new_session_id():
+    """
+    Creates the id of a new session.
+
+    Returns:
+        str: A random 32 digit hexadecimal id.
+    """
+    return uuid.uuid4().hex
+
+def _session_dir(session_id):
+    """
+    Gets the workspace directory of a session.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        str: Path to the session's workspace directory.
+
+    Raises:
+        ValueError: If the session id is not a valid id, so it can never point outside WORKSPACES_DIR.
+    """
+    if not isinstance(session_id, str) or not re.fullmatch(r'[0-9a-f]{32}', session_id):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+    return os.path.join(WORKSPACES_DIR, session_id)
+
+def _workspace_subdir(session_id, name):
+    """
+    Gets a directory of a session's workspace, creating it if needed, and marks the session as used now.
+
+    Args:
+        session_id (str): The session id.
+        name (str): The directory name, 'input' or 'output'.
+
+    Returns:
+        str: Path to the directory.
+    """
+    session_dir = _session_dir(session_id)
+    path = os.path.join(session_dir, name)
+    os.makedirs(path, exist_ok=True)
+    # The modification time of the workspace records when the session was last used
+    os.utime(session_dir)
+    return path
+
+def input_dir(session_id):
+    """
+    Gets the directory the session's uploaded probe files are extracted to.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        str: Path to the input directory.
+    """
+    return _workspace_subdir(session_id, 'input')
+
+def output_dir(session_id):
+    """
+    Gets the directory the session's plots and tables are written to.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        str: Path to the output directory.
+    """
+    return _workspace_subdir(session_id, 'output')
+
+def list_input_files(session_id):
+    """
+    Lists the uploaded files of a session.
+
+    Args:
+        session_id (str): The session id.
+
+    Returns:
+        list: The filenames in the session's input directory.
+    """
+    return os.listdir(input_dir(session_id))
+
+def _directory_size(path):
+    """
+    Computes the disk usage of a directory tree, or of a single file.
+
+    Args:
+        path (str): Path to the directory or file.
+
+    Returns:
+        int: The total size of the files in bytes.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return size
+
+def _storage_entries():
+    """
+    Lists everything that counts towards WORKSPACE_DISK_LIMIT_BYTES: the session workspaces, the parse cache
+    and well index entries shared by all the sessions, and the calibration cache file.
+
+    Returns:
+        list: Per entry its 'path', its 'kind' ('workspace', 'parse_cache', 'well_index' or 'calibration_cache'),
+            its 'session' id (None for the caches) and the time it was 'last_used'.
+    """
+    candidates = []
+    if os.path.isdir(WORKSPACES_DIR):
+        candidates += [(os.path.join(WORKSPACES_DIR, name), 'workspace', name) for name in os.listdir(WORKSPACES_DIR)
+                       if re.fullmatch(r'[0-9a-f]{32}', name)]
+    if os.path.isdir(parse_cache.PARSE_CACHE_DIR):
+        # Entries still being converted or being evicted end with .tmp or .evicted
+        candidates += [(os.path.join(parse_cache.PARSE_CACHE_DIR, name), 'parse_cache', None)
+                       for name in os.listdir(parse_cache.PARSE_CACHE_DIR) if '.' not in name]
+    if os.path.isdir(well_index.WELL_INDEX_DIR):
+        candidates += [(os.path.join(well_index.WELL_INDEX_DIR, name), 'well_index', None)
+                       for name in os.listdir(well_index.WELL_INDEX_DIR) if name.endswith('.json')]
+    candidates.append((calibration_cache.CALIBRATION_CACHE_PATH, 'calibration_cache', None))
+
+    entries = []
+    for path, kind, session_id in candidates:
+        try:
+            last_used = os.path.getmtime(path)
+        except OSError:
+            continue  # Removed in the meantime
+        entries.append({'path': path, 'kind': kind, 'session': session_id, 'last_used': last_used})
+    return entries
+
+def storage_usage(current_session_id=None, busy_sessions=()):
+    """
+    Measures everything that counts towards WORKSPACE_DISK_LIMIT_BYTES. Sizes are remembered between calls, and
+    only entries that may have changed are walked again: the current session, sessions with queued or running
+    jobs, sessions used since their last measurement, and the calibration cache. Parse cache and well index
+    entries never change once written.
+
+    Args:
+        current_session_id (str, optional): The session id of the calling user.
+        busy_sessions (set, optional): Session ids with queued or running jobs.
+
+    Returns:
+        list: The entries of _storage_entries, each with its size in 'bytes'.
+    """
+    entries = _storage_entries()
+    with _measured_lock:
+        for entry in entries:
+            path = entry['path']
+            measured = _measured.get(path)
+            if entry['kind'] == 'workspace':
+                busy = entry['session'] == current_session_id or entry['session'] in busy_sessions
+                stale = (measured is None or measured['busy'] or busy or measured['last_used'] != entry['last_used'])
+            else:
+                busy = False
+                stale = measured is None or entry['kind'] == 'calibration_cache'
+            if stale:
+                measured = {'bytes': _directory_size(path), 'last_used': entry['last_used'], 'busy': busy}
+                _measured[path] = measured
+            entry['bytes'] = measured['bytes']
+        # Forget the sizes of entries that no longer exist
+        for path in set(_measured) - {entry['path'] for entry in entries}:
+            del _measured[path]
+    return entries
+
+def _remove_entry(path):
+    """
+    Deletes a workspace or cache entry. It is renamed first, so readers never see a partly deleted entry.
+
+    Args:
+        path (str): Path to the entry.
+
+    Returns:
+        bool: True if the entry was deleted, False if it could not be renamed (e.g. a file is still open).
+    """
+    evicted_path = f"{path}.{os.getpid()}.evicted"
+    try:
+        os.replace(path, evicted_path)
+    except OSError:
+        return False
+    if os.path.isdir(evicted_path):
+        shutil.rmtree(evicted_path, ignore_errors=True)
+    else:
+        os.remove(evicted_path)
+    return True
+
+def evict_workspaces(current_session_id, limit_bytes=WORKSPACE_DISK_LIMIT_BYTES):
+    """
+    Deletes the least recently used workspaces and parse cache and well index entries until everything fits in
+    the disk limit. Never evicted are the current session, sessions with queued or running jobs, cache entries
+    used since the oldest queued or running job was submitted (they may be in use), and the calibration cache,
+    which is capped by CALIBRATION_CACHE_MAX_ENTRIES instead.
+
+    Args:
+        current_session_id (str): The session id of the calling user.
+        limit_bytes (int, optional): The disk limit. Default is WORKSPACE_DISK_LIMIT_BYTES.
+
+    Returns:
+        list: The paths of the deleted workspaces and cache entries.
+    """
+    active = [job for job in list_jobs() if job['state'] in ('queued', 'running')]
+    busy = {job['session'] for job in active}
+    in_use_since = min((job['submitted'] for job in active), default=None)
+    entries = storage_usage(current_session_id, busy)
+    total = sum(entry['bytes'] for entry in entries)
+    evicted = []
+    for entry in sorted(entries, key=lambda entry: entry['last_used']):
+        if total <= limit_bytes:
+            break
+        if entry['kind'] == 'calibration_cache':
+            continue
+        if entry['kind'] == 'workspace' and (entry['session'] == current_session_id or entry['session'] in busy):
+            continue
+        if entry['kind'] != 'workspace' and in_use_since is not None and entry['last_used'] >= in_use_since:
+            continue
+        if not _remove_entry(entry['path']):
+            continue
+        total -= entry['bytes']
+        evicted.append(entry['path'])
+        with _measured_lock:
+            _measured.pop(entry['path'], None)
+        logger.info("Evicted %s (%.1f MB, idle %.0fs)", entry['path'], entry['bytes'] / 1e6, time.time() - entry['last_used'])
+    return evicted